@@ -0,0 +1,402 @@
+"""balance_store.py
+
+This script contains the BalanceStore class, which persists the periodic token
+balances of every chain as typed, long-format Parquet tables.
+
+Balances are stored as one row per (chain, contract_address, period) with a
+float amount, and the token name and ticker of every contract are kept in a
+separate token table. This replaces the round trip through the multi-header
+`<chain>_balance.csv` files, which are now only written as an optional report.
+
+A daily price table keeps the USD price history of every contract, so
+transfers can be valued at the price of their own day without refetching.
+
+A state table records the closing balance of the last period per contract and
+the timestamp of the last processed transfer, so a later run only has to fold
+in the transfers that arrived since.
+
+Usage:
+    from balance_store import BalanceStore
+
+    store = BalanceStore()
+    store.write_balances("ethereum", df_pivot)
+    store.write_tokens("ethereum", contract_dict)
+    balances = store.read_wide("ethereum")
+"""
+
+import os
+import pandas as pd
+
+
+class BalanceStore:
+    """
+    Class to read and write the balance and token tables of each chain.
+
+    Attributes:
+        BALANCE_COLUMNS (list): The columns of the balance table.
+        TOKEN_COLUMNS (list): The columns of the token table.
+        STATE_COLUMNS (list): The columns of the balance state table.
+        WALLET_COLUMNS (list): The columns of the per-wallet balance table.
+        PRICE_COLUMNS (list): The columns of the daily price table.
+        directory (str): The directory the Parquet files are stored in.
+        freq (str): The pandas period frequency of the stored balances.
+    """
+
+    BALANCE_COLUMNS = ["chain", "contract_address", "period", "amount"]
+    TOKEN_COLUMNS = ["chain", "contract_address", "token", "ticker"]
+    STATE_COLUMNS = [
+        "chain", "contract_address", "period", "balance", "last_time", "last_amount"
+    ]
+    WALLET_COLUMNS = ["chain", "wallet", "contract_address", "period", "amount"]
+    PRICE_COLUMNS = ["chain", "contract_address", "time", "price"]
+
+    def __init__(self, directory="data/store", freq="M"):
+        """
+        Initialize a new instance of the BalanceStore class.
+
+        Args:
+            directory (str): The directory the Parquet files are stored in.
+            freq (str): The pandas period frequency of the stored balances.
+            Balances of other frequencies than monthly are kept in separate
+            files so the granularities never overwrite each other.
+        """
+        self.directory = directory
+        self.freq = freq
+        self.suffix = "" if freq == "M" else f"_{freq}"
+
+    def balance_path(self, blockchain):
+        """
+        Get the path of the balance table of a blockchain.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            str: The path of the Parquet file.
+        """
+        return os.path.join(self.directory, f"{blockchain}_balances{self.suffix}.parquet")
+
+    def token_path(self, blockchain):
+        """
+        Get the path of the token table of a blockchain.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            str: The path of the Parquet file.
+        """
+        return os.path.join(self.directory, f"{blockchain}_tokens.parquet")
+
+    def state_path(self, blockchain):
+        """
+        Get the path of the balance state table of a blockchain.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            str: The path of the Parquet file.
+        """
+        return os.path.join(self.directory, f"{blockchain}_state{self.suffix}.parquet")
+
+    def wallet_path(self, blockchain):
+        """
+        Get the path of the per-wallet balance table of a blockchain.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            str: The path of the Parquet file.
+        """
+        return os.path.join(
+            self.directory, f"{blockchain}_wallet_balances{self.suffix}.parquet"
+        )
+
+    def price_path(self, blockchain):
+        """
+        Get the path of the daily price table of a blockchain.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            str: The path of the Parquet file.
+        """
+        return os.path.join(self.directory, f"{blockchain}_daily_prices.parquet")
+
+    def write_balances(self, blockchain, df_pivot):
+        """
+        Write the periodic balances of a blockchain in long format.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            df_pivot (DataFrame): The balances indexed by period with one
+            column per contract address.
+        """
+        balances = df_pivot.rename_axis(
+            index="period", columns="contract_address"
+        ).stack().rename("amount").reset_index()
+        balances.insert(0, "chain", blockchain)
+        self.write(self.type_balances(balances), self.balance_path(blockchain))
+
+    def write_tokens(self, blockchain, contract_dict):
+        """
+        Write the token name and ticker of every contract of a blockchain.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            contract_dict (dict): The [token, ticker] keyed by contract.
+        """
+        tokens = pd.DataFrame(
+            [
+                (blockchain, contract, token, ticker)
+                for contract, (token, ticker) in contract_dict.items()
+            ],
+            columns=self.TOKEN_COLUMNS,
+        )
+        tokens = tokens.astype({
+            "chain": "category",
+            "contract_address": "category",
+            "token": "string",
+            "ticker": "string",
+        })
+        self.write(tokens, self.token_path(blockchain))
+
+    def write_state(self, blockchain, df_pivot, last_time, last_amounts):
+        """
+        Write the closing balances and the last processed transfer time.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            df_pivot (DataFrame): The balances indexed by period with one
+            column per contract address.
+            last_time (Timestamp): The time of the last processed transfer.
+            last_amounts (Series): The signed amount per contract of the
+            transfers at last_time, which are part of the balances.
+        """
+        closing = df_pivot.iloc[-1]
+        contracts = closing.index.astype(str)
+        last_amounts = last_amounts.copy()
+        last_amounts.index = last_amounts.index.astype(str)
+        state = pd.DataFrame({
+            "chain": blockchain,
+            "contract_address": contracts,
+            "period": df_pivot.index[[-1] * len(closing)],
+            "balance": closing.to_numpy(dtype=float),
+            "last_time": last_time,
+            "last_amount": last_amounts.reindex(contracts, fill_value=0).to_numpy(
+                dtype=float
+            ),
+        })
+        state = state[self.STATE_COLUMNS].astype({
+            "chain": "category",
+            "contract_address": "category",
+        })
+        self.write(state, self.state_path(blockchain))
+
+    def write_wallet_balances(self, blockchain, df_pivot):
+        """
+        Write the periodic balances of every wallet of a blockchain.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            df_pivot (DataFrame): The balances indexed by period with one
+            (wallet, contract_address) column per wallet and contract.
+        """
+        balances = df_pivot.rename_axis(index="period").stack(
+            ["wallet", "contract_address"]
+        ).rename("amount").reset_index()
+        balances.insert(0, "chain", blockchain)
+        balances = balances[self.WALLET_COLUMNS].astype({
+            "chain": "category",
+            "wallet": "category",
+            "contract_address": "category",
+            "amount": "float64",
+        })
+        self.write(balances, self.wallet_path(blockchain))
+
+    def write_prices(self, blockchain, prices):
+        """
+        Write the daily USD prices of the contracts of a blockchain.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            prices (DataFrame): The prices indexed by timestamp with one
+            column per contract address.
+        """
+        prices = prices.rename_axis(
+            index="time", columns="contract_address"
+        ).stack().rename("price").reset_index()
+        prices.insert(0, "chain", blockchain)
+        prices["time"] = pd.to_datetime(prices["time"], utc=True)
+        prices = prices[self.PRICE_COLUMNS].astype({
+            "chain": "category",
+            "contract_address": "category",
+            "price": "float64",
+        })
+        self.write(prices, self.price_path(blockchain))
+
+    def write(self, df, path):
+        """
+        Write a table to a Parquet file, replacing it atomically.
+
+        Args:
+            df (DataFrame): The table to write.
+            path (str): The path of the Parquet file.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def type_balances(self, balances):
+        """
+        Cast a long-format balance table to the stored dtypes.
+
+        Args:
+            balances (DataFrame): The balance table.
+
+        Returns:
+            DataFrame: The typed balance table.
+        """
+        balances = balances[self.BALANCE_COLUMNS]
+        if not isinstance(balances["period"].dtype, pd.PeriodDtype):
+            balances = balances.assign(
+                period=pd.PeriodIndex(balances["period"], freq=self.freq)
+            )
+        return balances.astype({
+            "chain": "category",
+            "contract_address": "category",
+            "amount": "float64",
+        })
+
+    def read_balances(self, blockchain):
+        """
+        Read the long-format balance table of a blockchain.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            DataFrame: The chain, contract_address, period and amount rows.
+        """
+        return pd.read_parquet(self.balance_path(blockchain))
+
+    def read_tokens(self, blockchain):
+        """
+        Read the token table of a blockchain.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            DataFrame: The chain, contract_address, token and ticker rows.
+        """
+        return pd.read_parquet(self.token_path(blockchain))
+
+    def read_wallet_balances(self, blockchain):
+        """
+        Read the per-wallet balances of a blockchain as a wide matrix.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            DataFrame: The balances indexed by period with one
+            (wallet, contract_address) column per wallet and contract.
+        """
+        balances = pd.read_parquet(self.wallet_path(blockchain))
+        wide = balances.pivot(
+            index="period", columns=["wallet", "contract_address"], values="amount"
+        )
+        wide.columns = pd.MultiIndex.from_arrays(
+            [
+                wide.columns.get_level_values(0).astype(str),
+                wide.columns.get_level_values(1).astype(str),
+            ],
+            names=["wallet", "contract_address"],
+        )
+        wide.index.name = "date"
+        return wide
+
+    def read_prices(self, blockchain):
+        """
+        Read the daily price table of a blockchain.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            DataFrame: The chain, contract_address, time and price rows, or
+            None if no daily prices are stored for the chain.
+        """
+        path = self.price_path(blockchain)
+        if not os.path.exists(path):
+            return None
+        return pd.read_parquet(path)
+
+    def read_state(self, blockchain):
+        """
+        Read the balance state of a blockchain.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            DataFrame: The closing balance, last transfer time and amount at
+            that time per contract, or None if the chain has not been
+            processed yet or its state predates the last_amount column, in
+            which case the balances are rebuilt.
+        """
+        path = self.state_path(blockchain)
+        if not os.path.exists(path) or not os.path.exists(
+            self.balance_path(blockchain)
+        ):
+            return None
+        state = pd.read_parquet(path)
+        if "last_amount" not in state.columns:
+            return None
+        return state
+
+    def read_contract_dict(self, blockchain):
+        """
+        Read the token table of a blockchain as a contract dictionary.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            dict: The [token, ticker] keyed by contract, empty if the chain
+            has no token table yet.
+        """
+        if not os.path.exists(self.token_path(blockchain)):
+            return {}
+        tokens = self.read_tokens(blockchain)
+        return {
+            str(contract): [token, ticker]
+            for contract, token, ticker in zip(
+                tokens["contract_address"], tokens["token"], tokens["ticker"]
+            )
+        }
+
+    def read_wide(self, blockchain):
+        """
+        Read the balances of a blockchain as a period x contract matrix.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            DataFrame: The balances indexed by period with one column per
+            contract address.
+        """
+        balances = self.read_balances(blockchain)
+        wide = balances.pivot(
+            index="period", columns="contract_address", values="amount"
+        )
+        wide.columns = wide.columns.astype(str)
+        wide.columns.name = None
+        wide.index.name = "date"
+        return wide
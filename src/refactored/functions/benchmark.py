@@ -0,0 +1,605 @@
+"""benchmark.py
+
+This script contains the SyntheticData and Benchmark classes, which time the
+hot paths of the analysis on generated data of any size.
+
+The sample data has fewer than 500 transfers per chain, so scaling
+regressions do not show up in a normal run. SyntheticData generates
+transfers with the schema of `data/<blockchain>.csv` and a price workbook
+with the layout of `monthly_prices_full.xlsx`, for any number of rows and
+contracts. Contract activity follows a Zipf-like distribution and every
+contract starts trading on its own listing day, like the real chains.
+
+Benchmark times the CSV write and read, clean_data, get_grouped_data,
+get_pivot_data, the balance matrix, the Excel write and read, and the
+valuation of the balances and of the transfers. Each step is repeated and
+its minimum and median are kept. Every run is appended to a JSON history
+together with the commit it ran on, so two commits can be compared.
+
+With --check, the same data is used to check that the optimized paths still
+agree: the monthly sums of the chain and of its wallets must not depend on
+the granularity the balances are kept at or on the backend that computes
+them, and the point-in-time balances at month ends must be the monthly
+balances.
+
+Usage:
+    python benchmark.py --rows 1000 100000 10000000 --contracts 10 5000
+    python benchmark.py --compare
+    python benchmark.py --compare 3c1a2b4 HEAD
+    python benchmark.py --check --rows 10000 --contracts 10
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from balance_store import BalanceStore
+from calculations import DataAnalysis
+from point_in_time import BalanceLookup
+from transfer_loader import TransferLoader
+from transfer_valuation import TransferValuation
+from wallet_analysis import WalletAnalysis
+
+
+class SyntheticData:
+    """
+    Class to generate transfers and prices with the schemas of the real data.
+
+    Attributes:
+        COLUMNS (list): The columns of a `data/<blockchain>.csv` file.
+        TREASURY (str): The wallet all transfers go to or come from.
+        DECIMALS (list): The token decimals drawn from.
+        COUNTERPARTIES (int): The number of distinct counterparties.
+        rows (int): The number of transfers.
+        contracts (int): The number of contracts.
+        blockchain (str): The name of the blockchain.
+        start (Timestamp): The first day of the transfers.
+        end (Timestamp): The last day of the transfers.
+        rng (Generator): The random generator.
+    """
+
+    COLUMNS = ["category", "contract_address", "from", "time", "to", "token",
+               "value", "blockchain", "ticker", "decimal", "calc_value"]
+    TREASURY = "0x67f60b0891ebd842ebe55e4ccca1098d7aac1a55"
+    DECIMALS = [6, 8, 18]
+    COUNTERPARTIES = 1000
+
+    def __init__(
+        self,
+        rows,
+        contracts,
+        blockchain="ethereum",
+        start="2020-07-01",
+        end="2023-07-31",
+        seed=0
+    ):
+        """
+        Initialize a new instance of the SyntheticData class.
+
+        Args:
+            rows (int): The number of transfers.
+            contracts (int): The number of contracts.
+            blockchain (str): The name of the blockchain.
+            start (str): The first day of the transfers.
+            end (str): The last day of the transfers.
+            seed (int): The seed of the random generator.
+        """
+        self.rows = rows
+        self.contracts = contracts
+        self.blockchain = blockchain
+        self.start = pd.Timestamp(start)
+        self.end = pd.Timestamp(end)
+        self.rng = np.random.default_rng(seed)
+        self.addresses = self.make_addresses(contracts)
+        self.listing = self.rng.uniform(0, 0.9, contracts)
+
+    def make_addresses(self, count):
+        """
+        Generate random, distinct-looking addresses.
+
+        Args:
+            count (int): The number of addresses.
+
+        Returns:
+            list: The lowercase hex addresses.
+        """
+        raw = self.rng.integers(0, 256, (count, 20), dtype=np.uint8)
+        return ["0x" + row.tobytes().hex() for row in raw]
+
+    def transfers(self):
+        """
+        Generate the transfers.
+
+        The repeated string columns are categoricals, so even 10^7 rows fit
+        in memory.
+
+        Returns:
+            DataFrame: The transfers with the columns of a
+            `data/<blockchain>.csv` file, `time` as naive UTC datetime64.
+        """
+        rng = self.rng
+        weights = 1 / np.arange(1, self.contracts + 1)
+        codes = rng.choice(self.contracts, size=self.rows, p=weights / weights.sum())
+        span = (self.end - self.start).total_seconds()
+        offsets = self.listing[codes] + rng.random(self.rows) * (1 - self.listing[codes])
+        times = self.start.to_datetime64() + (offsets * span).astype("timedelta64[s]")
+        outgoing = rng.random(self.rows) < 0.45
+        counterparties = self.make_addresses(self.COUNTERPARTIES)
+        wallets = pd.Categorical.from_codes(
+            rng.integers(0, self.COUNTERPARTIES, self.rows), counterparties + [self.TREASURY]
+        )
+        treasury = pd.Categorical.from_codes(
+            np.full(self.rows, self.COUNTERPARTIES), wallets.categories
+        )
+        decimals = rng.choice(self.DECIMALS, self.contracts).astype(float)
+        calc_value = rng.lognormal(6, 2, self.rows)
+        return pd.DataFrame({
+            "category": pd.Categorical.from_codes(outgoing.astype(np.int8), ["in", "from"]),
+            "contract_address": pd.Categorical.from_codes(codes, self.addresses),
+            "from": np.where(outgoing, treasury, wallets),
+            "time": times,
+            "to": np.where(outgoing, wallets, treasury),
+            "token": pd.Categorical.from_codes(
+                codes, [f"Token {i}" for i in range(self.contracts)]
+            ),
+            "value": calc_value * 10 ** decimals[codes],
+            "blockchain": pd.Categorical.from_codes(
+                np.zeros(self.rows, dtype=np.int8), [self.blockchain]
+            ),
+            "ticker": pd.Categorical.from_codes(
+                codes, [f"TK{i}" for i in range(self.contracts)]
+            ),
+            "decimal": decimals[codes],
+            "calc_value": calc_value,
+        }, columns=self.COLUMNS)
+
+    def prices(self):
+        """
+        Generate the month-end prices of every contract.
+
+        Prices follow a log-normal random walk and are missing before the
+        month a contract is listed in.
+
+        Returns:
+            DataFrame: The prices indexed by month-end date with one column
+            per contract, like a sheet of `monthly_prices.xlsx`.
+        """
+        months = pd.date_range(self.start, self.end, freq="M")
+        steps = self.rng.normal(0, 0.2, (len(months), self.contracts))
+        prices = np.exp(self.rng.normal(0, 3, self.contracts) + np.cumsum(steps, axis=0))
+        listed = np.arange(len(months))[:, None] >= (
+            self.listing * len(months)
+        ).astype(int)
+        return pd.DataFrame(
+            np.where(listed, prices, np.nan), index=months, columns=self.addresses
+        )
+
+    def write_transfers(self, data, path):
+        """
+        Write transfers like the earlier stages do.
+
+        Args:
+            data (DataFrame): The transfers.
+            path (str): The path of the CSV file.
+        """
+        data.to_csv(path, date_format="%Y-%m-%d %H:%M:%S.000 UTC")
+
+    def write_prices(self, prices, raw_file, full_file):
+        """
+        Write the raw and the full price workbook like GetGecko does.
+
+        Args:
+            prices (DataFrame): The month-end prices.
+            raw_file (str): The path of the raw workbook.
+            full_file (str): The path of the full workbook.
+        """
+        with pd.ExcelWriter(raw_file) as writer:
+            prices.to_excel(writer, sheet_name=self.blockchain)
+        with pd.ExcelWriter(full_file) as writer:
+            pd.read_excel(raw_file, self.blockchain).to_excel(
+                writer, sheet_name=self.blockchain
+            )
+
+
+class Benchmark:
+    """
+    Class to time the analysis hot paths and keep a history of the timings.
+
+    Attributes:
+        STEPS (list): The timed steps, in the order they run.
+        rows (list): The numbers of transfers to benchmark.
+        contracts (list): The numbers of contracts to benchmark.
+        repeat (int): How often every step is timed.
+        history_file (str): The JSON file the runs are appended to.
+    """
+
+    STEPS = ["csv_write", "csv_read", "clean_data", "get_grouped_data",
+             "get_pivot_data", "get_balance_matrix", "excel_write",
+             "excel_read", "calculate_sums", "value_transfers"]
+
+    def __init__(
+        self,
+        rows=(1000, 10000, 100000),
+        contracts=(10, 100),
+        repeat=3,
+        history_file="data/benchmarks/history.json"
+    ):
+        """
+        Initialize a new instance of the Benchmark class.
+
+        Args:
+            rows (list): The numbers of transfers to benchmark.
+            contracts (list): The numbers of contracts to benchmark.
+            repeat (int): How often every step is timed.
+            history_file (str): The JSON file the runs are appended to.
+        """
+        self.rows = list(rows)
+        self.contracts = list(contracts)
+        self.repeat = repeat
+        self.history_file = os.path.abspath(history_file)
+
+    def measure(self, func):
+        """
+        Time a function.
+
+        Args:
+            func (callable): Function without arguments.
+
+        Returns:
+            tuple: The timings in seconds and the result of the last call.
+        """
+        timings = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start)
+        return timings, result
+
+    def run_case(self, rows, contracts):
+        """
+        Time every step on one data size.
+
+        The files are written to a temporary directory, which is the working
+        directory while the steps run, so the analysis finds them at their
+        usual paths.
+
+        Args:
+            rows (int): The number of transfers.
+            contracts (int): The number of contracts.
+
+        Returns:
+            dict: The timings in seconds keyed by step.
+        """
+        synthetic = SyntheticData(rows, contracts)
+        blockchain = synthetic.blockchain
+        data, prices = synthetic.transfers(), synthetic.prices()
+        timings = {}
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                os.mkdir("data")
+                path = f"data/{blockchain}.csv"
+                analysis = DataAnalysis(
+                    store=BalanceStore("data/store"), incremental=False, rollups=False
+                )
+                loader = TransferLoader()
+                timings["csv_write"], _ = self.measure(
+                    lambda: synthetic.write_transfers(data, path)
+                )
+                timings["csv_read"], raw = self.measure(lambda: loader.read(path))
+                timings["clean_data"], clean = self.measure(
+                    lambda: analysis.clean_data(raw.copy())
+                )
+                df = analysis.get_required_columns(clean)
+                timings["get_grouped_data"], grouped = self.measure(
+                    lambda: analysis.get_grouped_data(df.copy())
+                )
+                timings["get_pivot_data"], _ = self.measure(
+                    lambda: analysis.get_pivot_data(grouped)
+                )
+                timings["get_balance_matrix"], chain = self.measure(
+                    lambda: analysis.get_balance_matrix(df)
+                )
+                timings["excel_write"], _ = self.measure(
+                    lambda: synthetic.write_prices(
+                        prices, "data/monthly_prices.xlsx",
+                        "data/monthly_prices_full.xlsx"
+                    )
+                )
+                timings["excel_read"], monthly = self.measure(
+                    lambda: analysis.load_monthly_data(
+                        analysis.load_excel_file(), blockchain
+                    )
+                )
+                timings["calculate_sums"], _ = self.measure(
+                    lambda: analysis.calculate_sums(monthly, chain)
+                )
+                valuation = TransferValuation(analysis)
+                valuation.load_prices(blockchain)
+                timings["value_transfers"], _ = self.measure(
+                    lambda: valuation.value_transfers(blockchain, raw)
+                )
+            finally:
+                os.chdir(cwd)
+        return timings
+
+    def check_case(self, rows, contracts):
+        """
+        Check the analysis on one data size.
+
+        The chain and its wallets are analyzed at every granularity, and the
+        chain with every backend as well. The balances are valued at the end
+        of each month, so every run must give the monthly sums of the pandas
+        backend at monthly granularity, also for the weeks that cross a
+        month end. The point-in-time balances at the end of every month must
+        be the monthly balances. Some transfers have no contract address,
+        like rows the Dune queries return for unknown tokens, and must be
+        left out by every path.
+
+        Args:
+            rows (int): The number of transfers.
+            contracts (int): The number of contracts.
+
+        Returns:
+            list: The descriptions of the failed checks, empty if all passed.
+        """
+        synthetic = SyntheticData(rows, contracts)
+        blockchain = synthetic.blockchain
+        failures = []
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                os.mkdir("data")
+                data = synthetic.transfers()
+                data.loc[::100, "contract_address"] = np.nan
+                synthetic.write_transfers(data, f"data/{blockchain}.csv")
+                synthetic.write_prices(
+                    synthetic.prices(), "data/monthly_prices.xlsx",
+                    "data/monthly_prices_full.xlsx"
+                )
+                pd.DataFrame({"blockchain": [blockchain]}).to_csv(
+                    "chain_info.csv", index=False
+                )
+                sums, wallet_sums = {}, {}
+                for granularity in DataAnalysis.GRANULARITIES:
+                    balances = {}
+                    for backend in ("duckdb", "pandas"):
+                        shutil.rmtree("data/store", ignore_errors=True)
+                        analysis = DataAnalysis(
+                            granularity=granularity, backend=backend, rollups=False
+                        )
+                        analysis.run()
+                        sums[f"{granularity} {backend}"] = pd.read_csv(
+                            "summed.csv", index_col="date"
+                        )["usd_amount"]
+                        balances[backend] = analysis.store.read_wide(blockchain)
+                    if not balances["duckdb"].columns.equals(
+                        balances["pandas"].columns
+                    ) or not np.allclose(balances["duckdb"], balances["pandas"]):
+                        failures.append(
+                            f"{granularity} duckdb balances differ from the "
+                            f"pandas balances"
+                        )
+                    WalletAnalysis(analysis).run()
+                    wallet_sums[f"{granularity} pandas"] = pd.read_csv(
+                        "wallet_summed.csv", index_col="date"
+                    )
+                chain = analysis.store.read_wide(blockchain)
+                lookup = BalanceLookup(analysis)
+                for month in chain.index[chain.index.end_time <= synthetic.end]:
+                    found = lookup.balances(blockchain, month.end_time)
+                    if not found.index.equals(chain.columns) or not np.allclose(
+                        found, chain.loc[month]
+                    ):
+                        failures.append(
+                            f"point-in-time balances differ from the monthly "
+                            f"balances of {month}"
+                        )
+                        break
+                for label, runs in [("sums", sums), ("wallet sums", wallet_sums)]:
+                    monthly = runs["monthly pandas"]
+                    for name, summed in runs.items():
+                        if not summed.index.equals(monthly.index) or not np.allclose(
+                            summed, monthly, rtol=1e-9
+                        ):
+                            failures.append(
+                                f"{name} {label} differ from the monthly {label}"
+                            )
+            finally:
+                os.chdir(cwd)
+        return failures
+
+    def check(self):
+        """
+        Check every combination of rows and contracts.
+
+        Combinations with more contracts than rows are skipped.
+
+        Raises:
+            AssertionError: If a check failed.
+        """
+        failures = []
+        for rows in self.rows:
+            for contracts in self.contracts:
+                if contracts > rows:
+                    continue
+                print(f"{rows} rows, {contracts} contracts")
+                for failure in self.check_case(rows, contracts):
+                    print(f"  FAILED {failure}")
+                    failures.append(f"{rows} rows, {contracts} contracts: {failure}")
+        if failures:
+            raise AssertionError("\n".join(failures))
+
+    def run(self):
+        """
+        Time every combination of rows and contracts and save the run.
+
+        Combinations with more contracts than rows are skipped.
+
+        Returns:
+            dict: The run as appended to the history.
+        """
+        cases = []
+        for rows in self.rows:
+            for contracts in self.contracts:
+                if contracts > rows:
+                    continue
+                print(f"{rows} rows, {contracts} contracts")
+                for step, timings in self.run_case(rows, contracts).items():
+                    cases.append({
+                        "rows": rows,
+                        "contracts": contracts,
+                        "step": step,
+                        "min": min(timings),
+                        "median": statistics.median(timings),
+                        "repeat": len(timings),
+                    })
+                    print(f"  {step:<20} {min(timings):10.4f} s")
+        run = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            **self.get_commit(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cases": cases,
+        }
+        history = self.load_history()
+        history.append(run)
+        self.save_history(history)
+        return run
+
+    def get_commit(self):
+        """
+        Get the commit the benchmark runs on.
+
+        Returns:
+            dict: The commit hash and whether the tree has uncommitted
+            changes, both None outside a git checkout.
+        """
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                check=True
+            ).stdout.strip()
+            dirty = bool(subprocess.run(
+                ["git", "status", "--porcelain", "--untracked-files=no"],
+                capture_output=True, text=True, check=True
+            ).stdout.strip())
+        except (OSError, subprocess.CalledProcessError):
+            commit, dirty = None, None
+        return {"commit": commit, "dirty": dirty}
+
+    def load_history(self):
+        """
+        Load the saved runs.
+
+        Returns:
+            list: The runs, oldest first.
+        """
+        if not os.path.exists(self.history_file):
+            return []
+        with open(self.history_file, encoding="utf-8") as file:
+            return json.load(file)
+
+    def save_history(self, history):
+        """
+        Save the runs, replacing the history file atomically.
+
+        Args:
+            history (list): The runs, oldest first.
+        """
+        os.makedirs(os.path.dirname(self.history_file), exist_ok=True)
+        tmp_path = f"{self.history_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(history, file, indent=2)
+        os.replace(tmp_path, self.history_file)
+
+    def find_run(self, history, ref):
+        """
+        Find a run in the history.
+
+        Args:
+            history (list): The runs, oldest first.
+            ref (str or int): A position in the history, or a commit hash or
+            prefix whose latest run is returned.
+
+        Returns:
+            dict: The run.
+
+        Raises:
+            ValueError: If no run matches.
+        """
+        if isinstance(ref, int) or (str(ref).lstrip("-").isdigit() and len(str(ref)) < 4):
+            return history[int(ref)]
+        if ref == "HEAD":
+            ref = self.get_commit()["commit"]
+        for run in reversed(history):
+            if run.get("commit") and run["commit"].startswith(ref):
+                return run
+        raise ValueError(f"No benchmark run for {ref}")
+
+    def compare(self, base=-2, head=-1):
+        """
+        Compare the timings of two runs.
+
+        Args:
+            base (str or int): The baseline run, see find_run.
+            head (str or int): The run compared with it, see find_run.
+
+        Returns:
+            DataFrame: The minimum timings of both runs and their ratio for
+            every case they share.
+        """
+        history = self.load_history()
+        keys = ["rows", "contracts", "step"]
+        base_cases = pd.DataFrame(self.find_run(history, base)["cases"])
+        head_cases = pd.DataFrame(self.find_run(history, head)["cases"])
+        compared = base_cases[keys + ["min"]].merge(
+            head_cases[keys + ["min"]], on=keys, suffixes=("_base", "_head")
+        )
+        compared["ratio"] = compared["min_head"] / compared["min_base"]
+        return compared
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analysis hot paths.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--contracts", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--history", default="data/benchmarks/history.json")
+    parser.add_argument(
+        "--compare", nargs="*", metavar="RUN",
+        help="compare two runs (commits or history positions), the last two by default"
+    )
+    parser.add_argument(
+        "--check", action="store_true",
+        help="check that the optimized paths agree instead of timing them"
+    )
+    args = parser.parse_args()
+    benchmark = Benchmark(args.rows, args.contracts, args.repeat, args.history)
+    if args.check:
+        benchmark.check()
+        return
+    if args.compare is None:
+        benchmark.run()
+        return
+    refs = args.compare or [-2, -1]
+    if len(refs) == 1:
+        refs.append(-1)
+    print(benchmark.compare(*refs).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,10 +7,17 @@ calculating sums, and writing results to CSV files. The class is used to
 generate detailed and summarized reports about tokens in different blockchains.
 """
 
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
+from balance_store import BalanceStore
+from metrics import METRICS
+from rollups import Rollups
+from transfer_loader import TransferLoader
 
 
+@METRICS.instrument
 class DataAnalysis:
     """
     The DataAnalysis class contains methods for loading, processing,
@@ -18,40 +25,386 @@ class DataAnalysis:
 
     Attributes:
         df1 (pd.DataFrame): A pandas DataFrame to store processed data.
+        store (BalanceStore): The Parquet store of balances and tokens.
+        export_reports (bool): Whether the multi-header balance CSV reports
+        are written as well.
+        incremental (bool): Whether only the transfers after the stored
+        balance state are processed.
+        freq (str): The pandas period frequency of the balances.
+        workers (int): The number of worker processes used to process the
+        chains, or None to process them one after another.
+        chunksize (int): The number of transfers read at a time in streaming
+        mode, or None to read each chain's transfers at once.
+        backend (DuckDBBackend): The backend that runs the balance and
+        valuation queries, or None for the pandas path.
+        rollups (Rollups): The dashboard rollups kept up to date after every
+        valued chain, or None.
+        chains (list): The blockchains to process, or None for every chain
+        of chain_info.csv.
+        month_end (DataAnalysis): The monthly analysis whose balances are
+        valued when the periods of freq cross month ends, or None.
+        MONTH_ALIGNED (tuple): The frequencies whose periods never cross a
+        month end, so the balance at the end of a month is the balance of
+        its last period.
     """
 
-    def __init__(self):
+    GRANULARITIES = {"daily": "D", "weekly": "W", "monthly": "M"}
+    MONTH_ALIGNED = ("D", "M")
+
+    def __init__(
+        self,
+        store=None,
+        export_reports=False,
+        incremental=True,
+        granularity="monthly",
+        workers=None,
+        chunksize=None,
+        backend="pandas",
+        rollups=True,
+        chains=None
+    ):
         """
         Initialize a new instance of the DataAnalysis class.
+
+        Args:
+            store (BalanceStore, optional): The balance store to use, the
+            default `data/store` store if None.
+            export_reports (bool): Whether to also write the multi-header
+            `data/<blockchain>_balance.csv` reports.
+            incremental (bool): Whether to fold only the transfers after the
+            stored balance state into the stored balances. A full rebuild is
+            done when False or when the chain has no stored state.
+            granularity (str): The period of the balances, one of "daily",
+            "weekly" or "monthly". Valuation always uses the balance at the
+            end of each month. A week can end in the month after most of
+            its days, so weekly runs keep the monthly balances in the store
+            as well and value those.
+            workers (int, optional): The number of worker processes. When
+            set, every chain is processed and valued in its own process and
+            only the monthly sums are sent back.
+            chunksize (int, optional): When set, the transfers are streamed
+            in chunks of this many rows and folded into per (contract,
+            period) sums, so memory is bounded by the number of distinct
+            contract periods rather than the number of transfers.
+            backend (str): Either "pandas" or "duckdb". The DuckDB backend
+            scans the transfer CSV and the balance store directly and runs
+            the balance and valuation stages as multi-threaded queries.
+            rollups (bool): Whether to update the chain, ticker and asset
+            class rollups in the store whenever a chain is valued.
+            chains (list, optional): The blockchains to process, every chain
+            of chain_info.csv if None. summed.csv still covers every chain,
+            the sums of the other chains are read from their
+            `data/<blockchain>_summed.csv` files.
         """
         pd.set_option("display.float_format", lambda x: f"{x:.3f}")
         self.df1 = pd.DataFrame()
+        self.freq = self.GRANULARITIES[granularity]
+        self.store = store or BalanceStore(freq=self.freq)
+        self.export_reports = export_reports
+        self.incremental = incremental
+        self.workers = workers
+        self.chunksize = chunksize
+        self.backend = None
+        if backend == "duckdb":
+            from duckdb_backend import DuckDBBackend
+            self.backend = DuckDBBackend(freq=self.freq)
+        self.rollups = Rollups(self.store) if rollups else None
+        self.chains = None if chains is None else list(chains)
+        self.month_end = None
+        if self.freq not in self.MONTH_ALIGNED:
+            self.month_end = DataAnalysis(
+                store=BalanceStore(self.store.directory),
+                incremental=incremental,
+                chunksize=chunksize,
+                backend=backend,
+                rollups=False,
+                chains=self.chains
+            )
+        self.loader = TransferLoader()
+        self.options = {
+            "store": self.store,
+            "export_reports": export_reports,
+            "incremental": incremental,
+            "granularity": granularity,
+            "chunksize": chunksize,
+            "backend": backend,
+            "rollups": rollups,
+            "chains": self.chains,
+        }
 
 
     def process_chain_info(self):
         """
         Process the chain info data by iterating over each row, processing
         data and monthly prices for each blockchain.
+
+        The price workbook is opened once and each chain is valued exactly
+        once against its own sheet.
         """
         data = pd.read_csv("chain_info.csv")
+        if self.chains is not None:
+            data = data[data["blockchain"].isin(self.chains)]
+        if self.workers:
+            self.process_chains_parallel(list(data["blockchain"]))
+            return
+        excel_file = self.load_excel_file()
         for _, row in data.iterrows():
             blockchain = row["blockchain"]
             self.process_data(blockchain)
-            self.process_monthly_prices(blockchain)
+            self.process_monthly_prices(blockchain, excel_file)
+
+    def process_chains_parallel(self, blockchains):
+        """
+        Process and value the chains in a pool of worker processes.
+
+        The chains share no state until the final summation, so each worker
+        runs the whole balance and valuation stage of one chain and returns
+        its monthly sums as two arrays, which are merged into df1 here. The
+        workers also return the aligned price and balance arrays of their
+        chain, and the rollups are updated from those here, so only one
+        process writes them and nothing is valued twice.
+
+        Args:
+            blockchains (list): The names of the blockchains.
+        """
+        with_rollups = self.rollups is not None
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(
+                process_chain_worker,
+                [{**self.options, "rollups": False}] * len(blockchains),
+                blockchains,
+                [with_rollups] * len(blockchains)
+            ))
+        frames = [
+            pd.DataFrame({
+                "date": pd.arrays.PeriodArray(
+                    ordinals, dtype=pd.PeriodDtype("M")
+                ),
+                "usd_amount": usd_amounts,
+                "blockchain": blockchain,
+            })
+            for blockchain, ordinals, usd_amounts, _ in results
+        ]
+        self.df1 = pd.concat([self.df1, *frames], ignore_index=True)
+        if with_rollups:
+            for blockchain, _, _, rollup_data in results:
+                self.rollups.update(blockchain, *rollup_data)
 
     def process_data(self, blockchain):
         """
         Process the data of a specific blockchain.
 
+        The periodic balances and the token names are written to the balance
+        store. When a balance state is stored from an earlier run, only the
+        transfers from its last transfer time on are grouped and added to the
+        stored balances. The transfers at that time are read again, so ones
+        added after the earlier run are not lost, and the amounts of the ones
+        already in the stored balances are taken off. The multi-header CSV
+        report is only written when export_reports is set. When the periods
+        cross month ends, the monthly balances are updated as well.
+
         Args:
             blockchain (str): The name of the blockchain.
         """
+        state = self.store.read_state(blockchain) if self.incremental else None
+        if self.backend is not None:
+            df_pivot, contract_dict, last_time, last_amounts = (
+                self.backend.get_balances(f"data/{blockchain}.csv", state)
+            )
+        elif self.chunksize:
+            df_pivot, contract_dict, last_time, last_amounts = (
+                self.stream_balances(blockchain, state)
+            )
+        else:
+            df_pivot, contract_dict, last_time, last_amounts = (
+                self.get_balances(blockchain, state)
+            )
+        if state is not None:
+            folded = pd.Series(
+                state["last_amount"].to_numpy(dtype=float),
+                index=state["contract_address"].astype(str)
+            )
+            if df_pivot is None:
+                last_amounts = folded
+            else:
+                df_pivot = df_pivot.sub(
+                    folded.reindex(df_pivot.columns, fill_value=0), axis=1
+                )
+            contract_dict = {
+                **contract_dict, **self.store.read_contract_dict(blockchain)
+            }
+            df_pivot = self.extend_pivot_data(
+                self.store.read_wide(blockchain), df_pivot
+            )
+        self.store.write_balances(blockchain, df_pivot)
+        self.store.write_tokens(blockchain, contract_dict)
+        self.store.write_state(blockchain, df_pivot, last_time, last_amounts)
+        if self.export_reports:
+            self.export_report(df_pivot, contract_dict, blockchain)
+        if self.month_end is not None:
+            self.month_end.process_data(blockchain)
+
+    def get_balances(self, blockchain, state):
+        """
+        Get the balances of the new transfers of a blockchain in one pass.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            state (DataFrame): The stored balance state, or None.
+
+        Returns:
+            tuple: The pivot data of the new transfers (None if there are
+            none), their contract dictionary, the last transfer time and the
+            amount per contract of the transfers at that time.
+        """
         data = self.load_data(blockchain)
+        data, last_time, last_amounts = self.get_new_transfers(data, state)
+        if data.empty:
+            return None, {}, last_time, last_amounts
         data = self.clean_data(data)
         df = self.get_required_columns(data)
         contract_dict = self.get_contract_dict(df)
-        df_grouped = self.get_grouped_data(df)
-        df_pivot = self.get_pivot_data(df_grouped)
+        return self.get_balance_matrix(df), contract_dict, last_time, last_amounts
+
+    def stream_balances(self, blockchain, state):
+        """
+        Get the balances of the new transfers of a blockchain chunk by chunk.
+
+        Each chunk is cleaned and reduced to per (contract, period) sums,
+        which are added to the running sums. The cumulative pass is done once
+        at the end over those sums only.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            state (DataFrame): The stored balance state, or None.
+
+        Returns:
+            tuple: The pivot data of the new transfers (None if there are
+            none), their contract dictionary, the last transfer time and the
+            amount per contract of the transfers at that time.
+        """
+        partial_sums = None
+        contract_dict = {}
+        last_time = state["last_time"].max() if state is not None else pd.NaT
+        last_amounts = pd.Series(dtype=float)
+        for chunk in self.loader.read_chunks(
+            f"data/{blockchain}.csv", self.chunksize
+        ):
+            chunk, chunk_time, chunk_amounts = self.get_new_transfers(chunk, state)
+            if chunk.empty:
+                continue
+            if pd.isna(last_time) or chunk_time > last_time or last_amounts.empty:
+                last_time, last_amounts = chunk_time, chunk_amounts
+            elif chunk_time == last_time:
+                last_amounts = last_amounts.add(chunk_amounts, fill_value=0)
+            df = self.get_required_columns(self.clean_data(chunk))
+            for contract, header in self.get_contract_dict(df).items():
+                contract_dict.setdefault(contract, header)
+            sums = df.groupby(
+                [
+                    df["contract_address"].astype(str),
+                    pd.PeriodIndex(df["time"], freq=self.freq),
+                ]
+            )["calc_value"].sum()
+            partial_sums = (
+                sums if partial_sums is None
+                else partial_sums.add(sums, fill_value=0)
+            )
+        if partial_sums is None:
+            return None, contract_dict, last_time, last_amounts
+        contracts, periods = partial_sums.index.levels
+        codes = partial_sums.index.codes
+        df_sums = pd.DataFrame({
+            "contract_address": contracts[codes[0]],
+            "time": periods[codes[1]].to_timestamp(),
+            "calc_value": partial_sums.to_numpy(),
+        })
+        return self.get_balance_matrix(df_sums), contract_dict, last_time, last_amounts
+
+    def get_new_transfers(self, data, state):
+        """
+        Select the transfers that are not yet part of the stored balances.
+
+        The transfers at the stored last time are selected as well, since
+        the times are truncated to the day and transfers can be added for a
+        day after it was processed.
+
+        Args:
+            data (DataFrame): The data of the blockchain.
+            state (DataFrame): The stored balance state, or None to select
+            every transfer.
+
+        Returns:
+            tuple: The selected transfers, the time of the last transfer that
+            is part of the balances after this run, and the signed amount per
+            contract of the selected transfers at that time (empty if none
+            are selected).
+        """
+        times = pd.to_datetime(data["time"])
+        if state is not None:
+            last_time = state["last_time"].max()
+            new = (times >= last_time).to_numpy()
+            data, times = data[new], times[new]
+            if data.empty:
+                return data, last_time, pd.Series(dtype=float)
+        last_time = times.max()
+        last = data[(times == last_time).to_numpy()]
+        amounts = last["calc_value"].fillna(0).to_numpy(dtype=float)
+        amounts = np.where((last["category"] == "from").to_numpy(), -amounts, amounts)
+        last_amounts = (
+            pd.Series(amounts, index=last["contract_address"].astype("object"))
+            .groupby(level=0)
+            .sum()
+        )
+        return data, last_time, last_amounts
+
+    def extend_pivot_data(self, df_stored, df_pivot):
+        """
+        Add the cumulative balances of new transfers to the stored balances.
+
+        The stored balances are carried forward to the current period, so
+        their last row is the closing balance of every contract, and the new
+        cumulative balances are added on top.
+
+        Args:
+            df_stored (DataFrame): The stored balances.
+            df_pivot (DataFrame): The pivot data of the new transfers, or
+            None if there are none.
+
+        Returns:
+            DataFrame: The balances of all transfers up to the current period.
+        """
+        start = df_stored.index.min()
+        columns = df_stored.columns
+        if df_pivot is not None:
+            start = min(start, df_pivot.index.min())
+            columns = columns.union(df_pivot.columns)
+        current_period = pd.to_datetime("today").to_period(self.freq)
+        full_index = pd.period_range(
+            start=start, end=current_period, freq=self.freq
+        )
+        df_extended = (
+            df_stored.reindex(index=full_index, columns=columns)
+            .fillna(method="ffill")
+            .fillna(value=0)
+        )
+        if df_pivot is not None:
+            df_extended += (
+                df_pivot.reindex(index=full_index, columns=columns)
+                .fillna(method="ffill")
+                .fillna(value=0)
+            )
+        return df_extended
+
+    def export_report(self, df_pivot, contract_dict, blockchain):
+        """
+        Write the balances of a blockchain as a multi-header CSV report.
+
+        Args:
+            df_pivot (DataFrame): The pivot DataFrame.
+            contract_dict (dict): The contract dictionary.
+            blockchain (str): The name of the blockchain.
+        """
         df_with_headers = self.add_headers(df_pivot, contract_dict)
         new_df = self.promote_rows_as_headers(df_with_headers)
         self.write_to_csv(new_df, blockchain)
@@ -64,34 +417,39 @@ class DataAnalysis:
             blockchain (str): The name of the blockchain.
 
         Returns:
-            DataFrame: The loaded data.
+            DataFrame: The loaded data, typed by the TransferLoader.
         """
-        data = pd.read_csv(f"data/{blockchain}.csv")
+        data = self.loader.read(f"data/{blockchain}.csv")
         return data
 
     def clean_data(self, data):
         """
-        Clean the data by reformatting time, sorting values, resetting index,
-        calculating values, and dropping unnecessary columns.
+        Normalize the transfers in a single pass.
+
+        The timestamps are parsed once and truncated to the UTC day as naive
+        datetime64 values, the rows are sorted on them with a stable sort,
+        and the amounts are signed by category. Later stages use the typed
+        `time` column as it is, without parsing it again.
 
         Args:
             data (DataFrame): The data to clean.
 
         Returns:
-            DataFrame: The cleaned data.
-        """
-        data = data.drop(data.columns[0], axis=1)
-        data["time"] = pd.to_datetime(data["time"]).dt.strftime("%Y-%m-%d")
-        data = data.sort_values(by="time").reset_index()
-        data = data.drop(data.columns[0], axis=1)
-        data["calc_value"] = (
-            data["calc_value"]
-            .astype(float)
-            .mul(np.where(data["category"] == "from", -1, 1))
+            DataFrame: The transfers sorted by day, without the `from` and
+            `to` columns.
+        """
+        days = (
+            pd.to_datetime(data["time"], utc=True)
+            .dt.tz_localize(None)
+            .dt.normalize()
+            .to_numpy()
         )
-        data["price_usd"] = pd.Series(dtype="float")
-        data = data.drop(["from"], axis=1)
-        data = data.drop(["to"], axis=1)
+        amounts = data["calc_value"].to_numpy(dtype=float)
+        outgoing = (data["category"] == "from").to_numpy()
+        order = np.argsort(days, kind="stable")
+        data = data.drop(columns=["from", "to"]).iloc[order].reset_index(drop=True)
+        data["time"] = days[order]
+        data["calc_value"] = np.where(outgoing, -amounts, amounts)[order]
         return data
 
     def get_required_columns(self, data):
@@ -117,19 +475,18 @@ class DataAnalysis:
         Returns:
             dict: The contract dictionary.
         """
-        contract_dict = {}
-        for _, row in df.iterrows():
-            contract_address = row["contract_address"]
-            token = row["token"]
-            ticker = row["ticker"]
-            if contract_address not in contract_dict:
-                contract_dict[contract_address] = [token, ticker]
-        return contract_dict
+        labels = df.drop_duplicates("contract_address")
+        return {
+            contract_address: [token, ticker]
+            for contract_address, token, ticker in zip(
+                labels["contract_address"], labels["token"], labels["ticker"]
+            )
+        }
 
     def get_grouped_data(self, df):
         """
         Get the grouped data by aggregating calc_value by contract_address and
-        month.
+        period.
 
         Args:
             df (DataFrame): The DataFrame.
@@ -137,12 +494,11 @@ class DataAnalysis:
         Returns:
             DataFrame: The grouped data.
         """
-        df["time"] = pd.to_datetime(df["time"])
-        df["month"] = df["time"].dt.to_period("M")
+        df["month"] = df["time"].dt.to_period(self.freq)
         df_grouped = (
-            df.groupby(["contract_address", "month"])["calc_value"]
+            df.groupby(["contract_address", "month"], observed=True)["calc_value"]
             .sum()
-            .groupby("contract_address")
+            .groupby("contract_address", observed=True)
             .cumsum()
         )
         df_grouped = df_grouped.reset_index()
@@ -161,15 +517,82 @@ class DataAnalysis:
         df_pivot = df_grouped.pivot(
             index="month", columns="contract_address", values="calc_value"
         )
-        current_month = pd.to_datetime("today").to_period("M")
+        current_period = pd.to_datetime("today").to_period(self.freq)
         full_index = pd.period_range(
-            start=df_pivot.index.min(), end=current_month, freq="M"
+            start=df_pivot.index.min(), end=current_period, freq=self.freq
         )
         df_pivot = df_pivot.reindex(full_index)
         df_pivot = df_pivot.fillna(method="ffill")
         df_pivot = df_pivot.fillna(value=0)
         return df_pivot
 
+    def get_balance_matrix(self, df, keys=("contract_address",)):
+        """
+        Get the cumulative balances of every contract for every period.
+
+        The contracts are factorized and the transfer times are bucketed to
+        integer period codes, the amounts are summed into a dense
+        (period x contract) matrix with `np.add.at`, and a cumulative sum
+        over the periods carries every balance forward. This gives the same
+        result as get_grouped_data followed by get_pivot_data without the
+        groupby, pivot and forward fill passes. Transfers with a missing key
+        are left out, as groupby leaves them out.
+
+        Args:
+            df (DataFrame): The DataFrame.
+            keys (tuple): The columns that identify a balance. With more than
+            one key, for example ("wallet", "contract_address"), every
+            distinct combination gets its own column.
+
+        Returns:
+            DataFrame: The balances indexed by period, from the first
+            transfer up to the current period, with one column per contract,
+            or a MultiIndex column per key combination.
+        """
+        periods = pd.PeriodIndex(df["time"], freq=self.freq)
+        codes = periods.asi8
+        contract_codes, columns = self.factorize_keys(df, list(keys))
+        start = codes.min()
+        current_period = pd.to_datetime("today").to_period(self.freq)
+        end = max(codes.max(), current_period.ordinal)
+        matrix = np.zeros((end - start + 1, len(columns)))
+        keep = contract_codes >= 0
+        np.add.at(
+            matrix,
+            (codes[keep] - start, contract_codes[keep]),
+            df["calc_value"].fillna(0).to_numpy(dtype=float)[keep]
+        )
+        np.cumsum(matrix, axis=0, out=matrix)
+        index = pd.period_range(
+            start=pd.Period(ordinal=start, freq=self.freq),
+            periods=len(matrix),
+            freq=self.freq
+        )
+        return pd.DataFrame(matrix, index=index, columns=columns)
+
+    def factorize_keys(self, df, keys):
+        """
+        Encode the balance keys of every transfer as sorted integer codes.
+
+        Args:
+            df (DataFrame): The DataFrame.
+            keys (list): The columns that identify a balance.
+
+        Returns:
+            tuple: The code of every row, -1 for rows with a missing key,
+            and the Index, or MultiIndex, of the distinct keys.
+        """
+        if len(keys) == 1:
+            codes, uniques = pd.factorize(df[keys[0]], sort=True)
+            return codes, pd.Index(np.asarray(uniques, dtype=object), name=keys[0])
+        present = df[keys].notna().all(axis=1).to_numpy()
+        labels = pd.MultiIndex.from_arrays(
+            [np.asarray(df[key], dtype=object)[present] for key in keys]
+        )
+        codes = np.full(len(df), -1, dtype=np.intp)
+        codes[present], uniques = labels.factorize(sort=True)
+        return codes, uniques.set_names(keys)
+
     def add_headers(self, df_pivot, contract_dict):
         """
         Add headers to the pivot DataFrame.
@@ -218,20 +641,76 @@ class DataAnalysis:
         """
         new_df.to_csv(f"data/{blockchain}_balance.csv")
 
-    def process_monthly_prices(self, blockchain):
+    def process_monthly_prices(self, blockchain, excel_file=None, monthly=None):
         """
         Process the monthly prices of a specific blockchain.
 
+        The chain's balances are valued against its own price sheet, the sums
+        are written to `data/<blockchain>_summed.csv` and accumulated in df1.
+
         Args:
             blockchain (str): The name of the blockchain.
+            excel_file (ExcelFile, optional): The already opened price
+            workbook, opened here if None.
+            monthly (DataFrame, optional): The monthly prices of the chain,
+            read from the workbook if None.
+
+        Returns:
+            DataFrame: The date and usd_amount of every month.
+        """
+        if monthly is None:
+            if excel_file is None:
+                excel_file = self.load_excel_file()
+            monthly = self.load_monthly_data(excel_file, blockchain)
+        if self.backend is not None:
+            valued = self.month_end or self
+            row_sums = valued.backend.calculate_sums(
+                monthly, valued.store.balance_path(blockchain)
+            )
+            chain = None
+        else:
+            chain = self.load_chain_data(blockchain)
+            row_sums = self.calculate_sums(monthly, chain)
+        if self.rollups is not None:
+            self.update_rollups(blockchain, monthly, chain)
+        self.write_sums_to_csv(row_sums, blockchain)
+        self.df1 = pd.concat(
+            [self.df1, row_sums.assign(blockchain=blockchain)],
+            ignore_index=True
+        )
+        return row_sums
+
+    def update_rollups(self, blockchain, monthly, chain=None):
         """
-        excel_file = self.load_excel_file()
-        for sheet_name in excel_file.sheet_names:
-            monthly = self.load_monthly_data(excel_file, sheet_name)
-            chain = self.load_chain_data(sheet_name)
-            merged_dataframe = self.merge_data(monthly, chain)
-            row_sums = self.calculate_sums(merged_dataframe)
-            self.write_sums_to_csv(row_sums, sheet_name)
+        Replace the rollup contribution of a blockchain.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            monthly (DataFrame): The monthly prices.
+            chain (DataFrame, optional): The monthly balances, loaded from
+            the store if None.
+        """
+        self.rollups.update(blockchain, *self.get_rollup_data(blockchain, monthly, chain))
+
+    def get_rollup_data(self, blockchain, monthly, chain=None):
+        """
+        Get the aligned arrays the rollups of a blockchain are built from.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            monthly (DataFrame): The monthly prices.
+            chain (DataFrame, optional): The monthly balances, loaded from
+            the store if None.
+
+        Returns:
+            tuple: The valued months, the (month, contract) prices and
+            balances, and the valued contract addresses.
+        """
+        if chain is None:
+            chain = self.load_chain_data(blockchain)
+        months, prices, amounts = self.align_data(monthly, chain)
+        contracts = chain.columns[chain.columns.isin(monthly.columns)]
+        return months, prices, amounts, contracts
 
     def load_excel_file(self):
         """
@@ -252,80 +731,82 @@ class DataAnalysis:
             sheet_name (str): The name of the sheet.
 
         Returns:
-            DataFrame: The monthly data.
+            DataFrame: The monthly prices, indexed by month with one column
+            per contract address.
         """
         monthly = pd.read_excel(excel_file, sheet_name)
         del monthly[monthly.columns[0]]
-        cols = list(monthly.columns)
-        cols[0] = "date"
-        monthly.columns = cols
-        monthly = monthly.melt(
-            id_vars=["date"],
-            value_vars=monthly.columns[1:],
-            var_name="contract_address",
-            value_name="price",
-        )
-        monthly["date"] = pd.to_datetime(monthly["date"]).dt.to_period("m")
+        monthly = monthly.set_index(monthly.columns[0])
+        monthly.index = pd.to_datetime(monthly.index).to_period("M")
+        monthly.index.name = "date"
         return monthly
 
     def load_chain_data(self, sheet_name):
         """
-        Load the chain data from a CSV file.
+        Load the chain data from the balance store.
+
+        Daily balances are reduced to the balance of the last day of each
+        month. Weekly balances cannot be reduced that way, since the last
+        week of a month usually ends in the next one, so the monthly
+        balances kept next to them are loaded instead.
 
         Args:
             sheet_name (str): The name of the sheet.
 
         Returns:
-            DataFrame: The chain data.
-        """
-
-        chain = pd.read_csv(f"data/{sheet_name}_balance.csv", skiprows=[1, 2])
-        cols = list(chain.columns)
-        cols[0] = "date"
-        chain.columns = cols
-        chain = chain.melt(
-            id_vars=["date"],
-            value_vars=chain.columns[1:],
-            var_name="contract_address",
-            value_name="amount",
-        )
-        chain["date"] = pd.to_datetime(chain["date"]).dt.to_period("m")
+            DataFrame: The monthly balances, indexed by month with one column
+            per contract address.
+        """
+        if self.month_end is not None:
+            return self.month_end.load_chain_data(sheet_name)
+        chain = self.store.read_wide(sheet_name)
+        if self.freq != "M":
+            chain = chain.groupby(chain.index.asfreq("M")).last()
+            chain.index.name = "date"
         return chain
 
-    def merge_data(self, monthly, chain):
+    def align_data(self, monthly, chain):
         """
-        Merge the monthly and chain data.
+        Align the monthly prices and the chain balances on the months and
+        contract addresses present in both.
 
         Args:
-            monthly (DataFrame): The monthly data.
-            chain (DataFrame): The chain data.
+            monthly (DataFrame): The monthly prices.
+            chain (DataFrame): The monthly balances.
 
         Returns:
-            DataFrame: The merged data.
-        """
-        merged_dataframe = pd.merge(
-            monthly, chain, how="inner", on=["date", "contract_address"]
-        )
-        merged_dataframe["value_usd"] = (
-            merged_dataframe["price"] * merged_dataframe["amount"]
-        )
-        merged_dataframe = merged_dataframe.pivot(index="date", columns="contract_address")[
-            "value_usd"
-        ]
-        return merged_dataframe
-
-    def calculate_sums(self, merged_dataframe):
-        """
-        Calculate the sums of the merged data.
+            tuple: The shared months (PeriodIndex), the price matrix and the
+            amount matrix, both of shape (months, contracts).
+        """
+        contracts = chain.columns[chain.columns.isin(monthly.columns)]
+        months = chain.index[chain.index.isin(monthly.index)].sort_values()
+        if contracts.empty:
+            months = months[:0]
+        prices = monthly.to_numpy(dtype=float)[np.ix_(
+            monthly.index.get_indexer(months),
+            monthly.columns.get_indexer(contracts)
+        )]
+        amounts = chain.to_numpy(dtype=float)[np.ix_(
+            chain.index.get_indexer(months),
+            chain.columns.get_indexer(contracts)
+        )]
+        return months, prices, amounts
+
+    def calculate_sums(self, monthly, chain):
+        """
+        Calculate the USD value of the chain balances for every month.
 
         Args:
-            merged_dataframe (DataFrame): The merged data.
+            monthly (DataFrame): The monthly prices.
+            chain (DataFrame): The monthly balances.
 
         Returns:
-            Series: The sums of the merged data.
+            DataFrame: The date and usd_amount of every shared month.
         """
-        row_sums = merged_dataframe.sum(axis=1).rename("usd_amount")
-        row_sums = row_sums.reset_index()
+        months, prices, amounts = self.align_data(monthly, chain)
+        row_sums = pd.DataFrame(
+            {"date": months, "usd_amount": np.nansum(prices * amounts, axis=1)}
+        )
         return row_sums
 
     def write_sums_to_csv(self, row_sums, sheet_name):
@@ -342,7 +823,87 @@ class DataAnalysis:
         """
         Run the data analysis by processing chain info and writing the
         summed data to a CSV file.
+
+        Raises:
+            FileNotFoundError: If a chain that is not processed has no
+            `data/<blockchain>_summed.csv` file.
         """
         self.process_chain_info()
-        summed = self.df1.groupby("date").sum()
+        self.write_summed()
+
+    def write_summed(self):
+        """
+        Write the sums of all chains to summed.csv.
+
+        When only some chains were processed, the sums of the other chains
+        are read from their `data/<blockchain>_summed.csv` files.
+
+        Raises:
+            FileNotFoundError: If a chain that was not processed has no file.
+        """
+        self.check_other_chains("_summed.csv")
+        frames = [self.df1]
+        if self.chains is not None:
+            for blockchain in pd.read_csv("chain_info.csv")["blockchain"]:
+                path = f"data/{blockchain}_summed.csv"
+                if blockchain not in self.chains:
+                    sums = pd.read_csv(path, index_col=0)
+                    sums["date"] = pd.PeriodIndex(sums["date"], freq="M")
+                    frames.append(sums.assign(blockchain=blockchain))
+        summed = pd.concat(frames).groupby("date")["usd_amount"].sum()
         summed.to_csv("summed.csv")
+
+    def check_other_chains(self, suffix, chain_file="chain_info.csv"):
+        """
+        Check that the chains that are not processed have their per-chain
+        results, which the totals over all chains are completed from.
+
+        Args:
+            suffix (str): The suffix of the per-chain files, for example
+            "_summed.csv" for `data/<blockchain>_summed.csv`.
+            chain_file (str): File path of the chain info CSV file.
+
+        Raises:
+            FileNotFoundError: If a chain that is not processed has no file,
+            so the totals would be incomplete.
+        """
+        if self.chains is None:
+            return
+        missing = [
+            f"data/{blockchain}{suffix}"
+            for blockchain in pd.read_csv(chain_file)["blockchain"]
+            if blockchain not in self.chains
+            and not os.path.exists(f"data/{blockchain}{suffix}")
+        ]
+        if missing:
+            raise FileNotFoundError(
+                f"The totals over all chains would be incomplete, process "
+                f"these chains first: {missing}"
+            )
+
+
+def process_chain_worker(options, blockchain, rollups=False):
+    """
+    Process and value a single chain in a worker process.
+
+    Args:
+        options (dict): The keyword arguments of the DataAnalysis instance.
+        blockchain (str): The name of the blockchain.
+        rollups (bool): Whether to return the arrays the rollups are built
+        from as well.
+
+    Returns:
+        tuple: The blockchain, the monthly period ordinals and the USD
+        amounts as numpy arrays, and the rollup data of get_rollup_data, or
+        None.
+    """
+    analysis = DataAnalysis(**options)
+    analysis.process_data(blockchain)
+    monthly = analysis.load_monthly_data(analysis.load_excel_file(), blockchain)
+    row_sums = analysis.process_monthly_prices(blockchain, monthly=monthly)
+    return (
+        blockchain,
+        pd.PeriodIndex(row_sums["date"], freq="M").asi8,
+        row_sums["usd_amount"].to_numpy(dtype=float),
+        analysis.get_rollup_data(blockchain, monthly) if rollups else None,
+    )
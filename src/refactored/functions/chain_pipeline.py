@@ -0,0 +1,348 @@
+"""chain_pipeline.py
+
+This script contains the ChainPipeline class, which streams every chain
+through the Dune, metadata, pricing and valuation stages on its own.
+
+The stage graph of main.py finishes a stage for all chains before the next
+one starts, so pricing waits for the slowest Dune query and the valuation
+waits for the slowest scrape. Here each stage is a small pool of worker
+threads connected to the next stage by a bounded queue, and a chain moves on
+as soon as its own work in a stage is done. The queues are bounded, so a
+fast stage blocks instead of piling up results in memory, and the number of
+workers of a stage bounds the load on its service. CoinGecko requests from
+the metadata and pricing stages go through the rate limiter of the shared
+GetGecko, explorer and RPC lookups through the resolver of the shared
+TokenData. The end-to-end time approaches the one of the slowest chain.
+
+main.py runs the pipeline without the valuation stage as the fetch stage of
+its stage graph, and values the chains in its calc stage, so changing the
+analysis code does not fetch the data again.
+
+A chain that fails in a stage is logged and dropped, the other chains carry
+on. The price workbooks, the contract info and summed.csv are written once
+all chains are through. The Dune executions, prices, contract info and token
+details recorded in the journal are kept until every chain is done, so
+rerunning after a failure only repeats the work that was not finished.
+
+Usage:
+    from chain_pipeline import ChainPipeline
+
+    pipeline = ChainPipeline(chains=["ethereum", "fantom"])
+    results = pipeline.run()
+"""
+
+import logging
+import queue
+import threading
+import pandas as pd
+from calculations import DataAnalysis
+from get_dune import Dune
+from get_gecko import GetGecko
+from metrics import METRICS
+
+
+class ChainPipeline:
+    """
+    Class to stream the chains through the stages of the application.
+
+    Attributes:
+        STAGES (list): The stages every chain goes through, in order.
+        WORKERS (dict): The default number of worker threads of each stage.
+        STOP (object): The sentinel that shuts down the workers of a stage.
+        chain_file (str): File path of the chain info CSV file.
+        chains (list): The blockchains to process, or None for every chain
+        of the chain info file.
+        stages (list): The stages run, STAGES without the valuation unless
+        the chains are valued.
+        queue_size (int): The maximum number of chains waiting in front of a
+        stage.
+        workers (dict): The number of worker threads of each stage.
+        dune (Dune): The Dune client the queries are run with.
+        gecko (GetGecko): The CoinGecko client shared by the metadata and
+        pricing stages.
+        analysis (DataAnalysis): The analysis the chains are valued with.
+        token_data (TokenData): The scraper shared by all chains, created
+        when the first chain needs it.
+        lock (threading.Lock): Lock for the state shared between the workers.
+        contract_info (dict): The contract info rows keyed by blockchain.
+        prices (dict): The monthly price workbook sheets keyed by blockchain.
+        results (dict): "done" or the failed stage keyed by blockchain.
+    """
+
+    STAGES = ["dune", "metadata", "prices", "valuation"]
+    WORKERS = {"dune": 3, "metadata": 2, "prices": 2, "valuation": 2}
+    STOP = object()
+
+    def __init__(
+        self,
+        chain_file="chain_info.csv",
+        queue_size=2,
+        workers=None,
+        analysis=None,
+        gecko=None,
+        chains=None,
+        value=True
+    ):
+        """
+        Initialize a new instance of the ChainPipeline class.
+
+        Args:
+            chain_file (str): File path of the chain info CSV file.
+            queue_size (int): The maximum number of chains waiting in front
+            of a stage.
+            workers (dict, optional): The number of worker threads of some
+            stages, overriding the defaults.
+            analysis (DataAnalysis, optional): The analysis to value the
+            chains with, a default DataAnalysis if None.
+            gecko (GetGecko, optional): The CoinGecko client, a default
+            GetGecko if None.
+            chains (list, optional): The blockchains to process, every chain
+            of the chain info file if None. The workbook sheets and contract
+            info rows of the other chains are kept.
+            value (bool): Whether the chains are valued and summed.csv is
+            written, or the pipeline stops after the prices.
+        """
+        self.chain_file = chain_file
+        self.chains = None if chains is None else list(chains)
+        self.stages = self.STAGES if value else self.STAGES[:-1]
+        self.queue_size = queue_size
+        self.workers = {**self.WORKERS, **(workers or {})}
+        self.dune = Dune()
+        self.gecko = gecko or GetGecko(chains=self.chains)
+        self.analysis = analysis or DataAnalysis(chains=self.chains)
+        self.token_data = None
+        self.lock = threading.Lock()
+        self.contract_info = {}
+        self.prices = {}
+        self.results = {}
+
+    def load_jobs(self):
+        """
+        Load a job for every selected chain of the chain info file.
+
+        Returns:
+            list: The blockchain, query_id, query_csv and base_url of every
+            chain.
+        """
+        chains = pd.read_csv(self.chain_file, skipinitialspace=True)
+        if self.chains is not None:
+            chains = chains[chains["blockchain"].isin(self.chains)]
+        return [
+            {
+                "blockchain": row["blockchain"],
+                "query_id": str(row["queryID"]),
+                "query_csv": row["queryCSV"],
+                "base_url": row["blockExplorerURL"],
+            }
+            for _, row in chains.iterrows()
+        ]
+
+    def get_token_data(self):
+        """
+        Get the scraper shared by all chains, starting it on first use.
+
+        Returns:
+            TokenData: The scraper.
+        """
+        with self.lock:
+            if self.token_data is None:
+                # Imported here because the scraper starts a browser.
+                from scraper import TokenData
+                self.token_data = TokenData(chains=self.chains)
+            return self.token_data
+
+    def run_dune(self, job):
+        """
+        Run the Dune query of a chain and save its result rows.
+
+        Args:
+            job (dict): The job of the chain.
+
+        Returns:
+            dict: The job.
+
+        Raises:
+            RuntimeError: If the query did not return any results.
+        """
+        rows = self.dune.save_query_results(
+            job["query_id"], f"data/{job['query_csv']}"
+        )
+        if rows is None:
+            raise RuntimeError(f"Dune query {job['query_id']} failed")
+        return job
+
+    def resolve_metadata(self, job):
+        """
+        Resolve the ticker and decimals of the contracts of a chain.
+
+        CoinGecko is asked first, the contracts it does not know are looked
+        up on the block explorer or an RPC node by the scraper, which also
+        filters and writes `data/<blockchain>.csv`.
+
+        Args:
+            job (dict): The job of the chain.
+
+        Returns:
+            dict: The job.
+        """
+        blockchain = job["blockchain"]
+        contract_info = self.gecko.fetch_chain_contract_info(
+            blockchain, job["query_csv"]
+        )
+        with self.lock:
+            self.contract_info[blockchain] = contract_info
+        contract_df = pd.DataFrame(
+            contract_info,
+            columns=["blockchain", "contract_address", "ticker", "decimal"]
+        )
+        self.gecko.fill_chain_data(blockchain, job["query_csv"], contract_df)
+        self.get_token_data().process_chain(blockchain, job["base_url"])
+        return job
+
+    def fetch_prices(self, job):
+        """
+        Fetch the prices of the contracts of a chain.
+
+        Args:
+            job (dict): The job of the chain.
+
+        Returns:
+            dict: The job with the monthly prices of the chain, laid out like
+            its sheet of the full price workbook.
+        """
+        blockchain = job["blockchain"]
+        blockchain_prices = self.gecko.fetch_chain_prices(
+            blockchain, job["query_csv"]
+        )
+        with self.lock:
+            self.prices[blockchain] = blockchain_prices
+        monthly = self.gecko.copy_columns_with_new_headers(
+            blockchain_prices.copy(), blockchain
+        )
+        monthly.index = pd.DatetimeIndex(monthly.index).to_period("M")
+        monthly.index.name = "date"
+        return {**job, "monthly": monthly}
+
+    def value_chain(self, job):
+        """
+        Compute the balances of a chain and value them.
+
+        The valuation itself is serialized, since it accumulates into the
+        shared DataAnalysis and rewrites the shared rollups. With the DuckDB
+        backend the balances are serialized as well, as the backend has a
+        single connection.
+
+        Args:
+            job (dict): The job of the chain.
+
+        Returns:
+            dict: The job.
+        """
+        blockchain = job["blockchain"]
+        if self.analysis.backend is not None:
+            with self.lock:
+                self.analysis.process_data(blockchain)
+        else:
+            self.analysis.process_data(blockchain)
+        with self.lock:
+            self.analysis.process_monthly_prices(blockchain, monthly=job["monthly"])
+        return job
+
+    def work(self, stage, func, inbox, outbox, remaining):
+        """
+        Run the jobs of a stage until it is shut down.
+
+        The last worker of a stage to stop shuts down the next stage.
+
+        Args:
+            stage (str): The name of the stage.
+            func (callable): The function run on every job.
+            inbox (Queue): The queue the jobs are taken from.
+            outbox (Queue): The queue of the next stage, or None for the last
+            stage.
+            remaining (dict): The number of running workers of every stage.
+        """
+        while True:
+            job = inbox.get()
+            if job is self.STOP:
+                break
+            blockchain = job["blockchain"]
+            try:
+                with METRICS.timer("chain_stage_seconds", stage=stage, chain=blockchain):
+                    job = func(job)
+            except Exception:
+                logging.exception("Chain %s failed in stage %s", blockchain, stage)
+                self.results[blockchain] = stage
+                continue
+            logging.info("Chain %s finished stage %s", blockchain, stage)
+            if outbox is None:
+                self.results[blockchain] = "done"
+            else:
+                outbox.put(job)
+        with self.lock:
+            remaining[stage] -= 1
+            last = remaining[stage] == 0
+        if last and outbox is not None:
+            next_stage = self.stages[self.stages.index(stage) + 1]
+            for _ in range(self.workers[next_stage]):
+                outbox.put(self.STOP)
+
+    def finish(self):
+        """
+        Write the outputs that span all chains.
+
+        The monthly price workbooks and the contract info are written for
+        the chains that got that far, keeping what is stored for the others,
+        and summed.csv for the valued ones.
+        """
+        if self.prices:
+            self.gecko.write_prices(self.prices)
+            self.gecko.save_prices_to_excel()
+        if self.contract_info:
+            self.gecko.write_contract_info(self.contract_info)
+        if self.token_data is not None:
+            self.token_data.classifier.save()
+            if self.token_data.driver is not None:
+                self.token_data.driver.quit()
+        if not self.analysis.df1.empty:
+            self.analysis.write_summed()
+        if all(result == "done" for result in self.results.values()):
+            self.dune.clear_journal()
+            self.gecko.journal.clear("prices", "contracts", "metadata")
+
+    def run(self):
+        """
+        Stream every chain through the stages.
+
+        Returns:
+            dict: "done", or the name of the stage it failed in, keyed by
+            blockchain.
+        """
+        funcs = {
+            "dune": self.run_dune,
+            "metadata": self.resolve_metadata,
+            "prices": self.fetch_prices,
+            "valuation": self.value_chain,
+        }
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        remaining = {stage: self.workers[stage] for stage in self.stages}
+        threads = []
+        for i, stage in enumerate(self.stages):
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+            for _ in range(self.workers[stage]):
+                thread = threading.Thread(
+                    target=self.work,
+                    args=(stage, funcs[stage], queues[i], outbox, remaining),
+                    name=f"{stage}-worker",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+        for job in self.load_jobs():
+            queues[0].put(job)
+        for _ in range(self.workers[self.stages[0]]):
+            queues[0].put(self.STOP)
+        for thread in threads:
+            thread.join()
+        self.finish()
+        return self.results
@@ -0,0 +1,283 @@
+"""duckdb_backend.py
+
+This script contains the DuckDBBackend class, an alternative execution
+backend for the balance and valuation stages of DataAnalysis.
+
+The pandas path reads a whole transfer file into a DataFrame and runs every
+step eagerly with intermediate copies. Here each stage is one SQL query that
+DuckDB plans and runs multi-threaded, spilling to disk when it runs out of
+memory: the transfer CSV and the Parquet balance table are scanned directly,
+and only the small results come back as DataFrames. The results have the
+same shape, index, columns and dtypes as the pandas path, and equal values
+up to floating point summation order. Like the pandas path, transfers without
+a contract address are left out of the balances.
+
+Usage:
+    from calculations import DataAnalysis
+
+    analysis = DataAnalysis(backend="duckdb")
+    analysis.run()
+"""
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+
+class DuckDBBackend:
+    """
+    Class to compute balances and their USD values with DuckDB.
+
+    Attributes:
+        UNITS (dict): The DuckDB date part of each pandas period frequency.
+        MONTH_ALIGNED (tuple): The frequencies whose periods never cross a
+        month end, so their balances can be valued per month.
+        freq (str): The pandas period frequency of the balances.
+        connection (DuckDBPyConnection): The DuckDB connection the queries
+        run on.
+    """
+
+    UNITS = {"D": "day", "W": "week", "M": "month"}
+    MONTH_ALIGNED = ("D", "M")
+
+    def __init__(self, freq="M", threads=None, memory_limit=None):
+        """
+        Initialize a new instance of the DuckDBBackend class.
+
+        Args:
+            freq (str): The pandas period frequency of the balances.
+            threads (int, optional): The number of DuckDB threads, one per
+            core if None.
+            memory_limit (str, optional): The DuckDB memory limit, for
+            example "4GB", above which DuckDB spills to disk.
+        """
+        self.freq = freq
+        self.connection = duckdb.connect()
+        self.connection.execute("SET TimeZone = 'UTC'")
+        if threads:
+            self.connection.execute(f"SET threads = {int(threads)}")
+        if memory_limit:
+            self.connection.execute(f"SET memory_limit = '{memory_limit}'")
+
+    def load_transfers(self, path, state):
+        """
+        Define the `transfers` view over the new transfers of a CSV file.
+
+        Args:
+            path (str): The path of the transfer CSV file.
+            state (DataFrame): The stored balance state, or None to select
+            every transfer.
+        """
+        raw = self.connection.read_csv(
+            path,
+            header=True,
+            dtype={"time": "VARCHAR", "calc_value": "DOUBLE"},
+        )
+        raw.create_view("raw_transfers", replace=True)
+        last_time = None if state is None else state["last_time"].max()
+        self.connection.execute(
+            """
+            CREATE OR REPLACE TEMP VIEW transfers AS
+            SELECT * FROM (
+                SELECT
+                    contract_address,
+                    token,
+                    ticker,
+                    CAST(time AS TIMESTAMPTZ) AS time,
+                    CASE WHEN category = 'from' THEN -1 ELSE 1 END
+                        * COALESCE(calc_value, 0) AS amount,
+                    row_number() OVER () AS row
+                FROM raw_transfers
+            )
+            """
+            + ("" if last_time is None else
+               f"WHERE time >= TIMESTAMPTZ '{last_time.isoformat()}'")
+        )
+
+    def get_balances(self, path, state):
+        """
+        Get the balances of the new transfers of a CSV file.
+
+        Args:
+            path (str): The path of the transfer CSV file.
+            state (DataFrame): The stored balance state, or None.
+
+        Returns:
+            tuple: The pivot data of the new transfers (None if there are
+            none), their contract dictionary, the last transfer time and the
+            amount per contract of the transfers at that time.
+        """
+        self.load_transfers(path, state)
+        last_time = self.connection.sql("SELECT max(time) FROM transfers").fetchone()[0]
+        if last_time is None:
+            return None, {}, state["last_time"].max(), pd.Series(dtype=float)
+        last_amounts = self.connection.sql(
+            """
+            SELECT contract_address, SUM(amount) AS amount
+            FROM transfers
+            WHERE time = (SELECT max(time) FROM transfers)
+                AND contract_address IS NOT NULL
+            GROUP BY ALL
+            """
+        ).df()
+        last_amounts = pd.Series(
+            last_amounts["amount"].to_numpy(dtype=float),
+            index=last_amounts["contract_address"].astype(str),
+        )
+        contract_dict = self.get_contract_dict()
+        current_period = pd.to_datetime("today").to_period(self.freq)
+        unit = self.UNITS[self.freq]
+        balances = self.connection.execute(
+            f"""
+            WITH sums AS (
+                SELECT
+                    contract_address,
+                    CAST(date_trunc('{unit}', CAST(time AS DATE)) AS TIMESTAMP)
+                        AS period,
+                    SUM(amount) AS amount
+                FROM transfers
+                WHERE contract_address IS NOT NULL
+                GROUP BY ALL
+            ),
+            periods AS (
+                SELECT period FROM generate_series(
+                    (SELECT min(period) FROM sums),
+                    greatest((SELECT max(period) FROM sums), ?::TIMESTAMP),
+                    INTERVAL 1 {unit}
+                ) AS t(period)
+            )
+            SELECT
+                contracts.contract_address,
+                periods.period,
+                SUM(COALESCE(sums.amount, 0)) OVER (
+                    PARTITION BY contracts.contract_address
+                    ORDER BY periods.period
+                ) AS balance
+            FROM (SELECT DISTINCT contract_address FROM sums) AS contracts
+            CROSS JOIN periods
+            LEFT JOIN sums USING (contract_address, period)
+            ORDER BY contracts.contract_address, periods.period
+            """,
+            [current_period.start_time.to_pydatetime()],
+        ).df()
+        contracts = balances["contract_address"].unique()
+        periods = pd.PeriodIndex(
+            balances["period"].iloc[: len(balances) // len(contracts)],
+            freq=self.freq,
+        )
+        matrix = balances["balance"].to_numpy(dtype=float).reshape(
+            len(contracts), len(periods)
+        ).T
+        df_pivot = pd.DataFrame(
+            matrix,
+            index=periods.rename(None),
+            columns=pd.Index(np.asarray(contracts, dtype=object), name="contract_address"),
+        )
+        return (
+            df_pivot,
+            contract_dict,
+            pd.Timestamp(last_time).tz_convert("UTC"),
+            last_amounts,
+        )
+
+    def get_contract_dict(self):
+        """
+        Get the token and ticker of every contract of the `transfers` view.
+
+        Returns:
+            dict: The [token, ticker] keyed by contract, in the order the
+            contracts first appear by day.
+        """
+        rows = self.connection.sql(
+            """
+            SELECT
+                contract_address,
+                first(token ORDER BY CAST(time AS DATE), row),
+                first(ticker ORDER BY CAST(time AS DATE), row)
+            FROM transfers
+            WHERE contract_address IS NOT NULL
+            GROUP BY contract_address
+            ORDER BY
+                min(CAST(time AS DATE)),
+                first(row ORDER BY CAST(time AS DATE), row)
+            """
+        ).fetchall()
+        return {
+            contract: [
+                np.nan if token is None else token,
+                np.nan if ticker is None else ticker,
+            ]
+            for contract, token, ticker in rows
+        }
+
+    def calculate_sums(self, monthly, balance_path):
+        """
+        Calculate the USD value of the stored balances for every month.
+
+        Daily balances are reduced to the balance of the last day of each
+        month before they are valued. Weekly balances cannot be, since a
+        week can end in the month after most of its days, so DataAnalysis
+        values the monthly balances it keeps next to them instead.
+
+        Args:
+            monthly (DataFrame): The monthly prices, indexed by month with one
+            column per contract address.
+            balance_path (str): The path of the Parquet balance table.
+
+        Returns:
+            DataFrame: The date and usd_amount of every shared month.
+
+        Raises:
+            ValueError: If the periods of freq cross month ends.
+        """
+        if self.freq not in self.MONTH_ALIGNED:
+            raise ValueError(
+                f"Balances of frequency {self.freq} cannot be valued at month "
+                f"ends, value the monthly balances instead"
+            )
+        prices = monthly.rename_axis(
+            index="month", columns="contract_address"
+        ).stack(dropna=False).fillna(0).rename("price").reset_index()
+        prices["month"] = pd.PeriodIndex(prices["month"], freq="M").asi8
+        balances = self.connection.read_parquet(balance_path)
+        balances.create_view("stored_balances", replace=True)
+        ordinals = np.array(
+            self.connection.sql(
+                "SELECT DISTINCT period FROM stored_balances"
+            ).fetchnumpy()["period"],
+            dtype=np.int64,
+        )
+        period_months = pd.DataFrame({
+            "period": ordinals,
+            "month": pd.arrays.PeriodArray(
+                ordinals, dtype=pd.PeriodDtype(self.freq)
+            ).asfreq("M").asi8,
+        })
+        self.connection.register("prices", prices)
+        self.connection.register("period_months", period_months)
+        sums = self.connection.sql(
+            """
+            WITH month_end AS (
+                SELECT
+                    b.contract_address,
+                    m.month,
+                    arg_max(b.amount, b.period) AS amount
+                FROM stored_balances AS b
+                JOIN period_months AS m USING (period)
+                GROUP BY ALL
+            )
+            SELECT b.month, SUM(p.price * b.amount) AS usd_amount
+            FROM month_end AS b
+            JOIN prices AS p USING (month, contract_address)
+            GROUP BY b.month
+            ORDER BY b.month
+            """
+        ).df()
+        self.connection.unregister("prices")
+        self.connection.unregister("period_months")
+        return pd.DataFrame({
+            "date": pd.arrays.PeriodArray(
+                sums["month"].to_numpy(dtype=np.int64), dtype=pd.PeriodDtype("M")
+            ),
+            "usd_amount": sums["usd_amount"].to_numpy(dtype=float),
+        })
@@ -9,16 +9,21 @@ The Dune API is used to execute queries and retrieve the results. The class
 provides methods for executing queries, getting the status of a query, getting
 the results of a query, and cancelling a query execution.
 
+Started executions and saved results are recorded in the journal, so a
+restarted run polls the executions it already started and skips the queries
+it already saved, instead of executing them again.
+
 Returns:
     Dune: an instance of the Dune class.
 """
 
 # Importing important packages
 import os
-import time
 import pandas as pd
 import requests as req
-from requests import get, post
+from journal import JOURNAL
+from metrics import METRICS
+from transport import TRANSPORT
 pd.set_option('display.float_format', lambda x: f'{x:.3f}')
 from dotenv import load_dotenv
 
@@ -39,21 +44,29 @@ class Dune:
         module (str): The module to use in the API URL.
         action (str): The action to use in the API URL.
         ID (str): The ID to use in the API URL.
+        journal (Journal): The journal the started executions and saved
+        results are recorded in.
+        FAILED_STATES (set): The execution states that will never complete.
     """
 
+    FAILED_STATES = {
+        "QUERY_STATE_FAILED", "QUERY_STATE_CANCELLED", "QUERY_STATE_EXPIRED"
+    }
     API_KEY = os.getenv("DUNE_API_KEY")
     BASE_URL = "https://api.dune.com/api/v1/"
     HEADER = {"x-dune-api-key" : API_KEY}
 
 
-    def __init__(self, module, action, ID):
+    def __init__(self, module="query", action="execute", ID=None, journal=None):
         """
         Generate a URL to call the API.
 
         Args:
             module (str): The module to use in the API URL.
             action (str): The action to use in the API URL.
-            ID (str): The ID to use in the API URL.
+            ID (str, optional): The ID to use in the API URL.
+            journal (Journal, optional): The journal to record progress in,
+            JOURNAL if None.
 
         Returns:
             str: The URL to call the API.
@@ -61,6 +74,7 @@ class Dune:
         self.module = module
         self.action = action
         self.ID = ID
+        self.journal = journal or JOURNAL
 
     def make_api_url(self, module, action, ID):
         """
@@ -90,7 +104,7 @@ class Dune:
         """
         url = self.make_api_url("query", "execute", query_id)
         try:
-            response = post(url, headers=self.HEADER, timeout=300)
+            response = TRANSPORT.request("POST", url, headers=self.HEADER, timeout=300)
             response.raise_for_status()  # This will raise an exception if the response contains an HTTP error status.
         except req.exceptions.RequestException as req_err:
             print(f"Error executing query: {req_err}")
@@ -120,7 +134,7 @@ class Dune:
         """
         url = self.make_api_url("execution", "status", execution_id)
         try:
-            response = req.get(url, headers=self.HEADER, timeout=300)
+            response = TRANSPORT.request("GET", url, headers=self.HEADER, timeout=300)
             response.raise_for_status()
         except req.exceptions.RequestException as req_err:
             print(f"Error getting query status: {req_err}")
@@ -148,7 +162,7 @@ class Dune:
         """
         url = self.make_api_url("execution", "results", execution_id)
         try:
-            response = req.get(url, headers=self.HEADER, timeout=300)
+            response = TRANSPORT.request("GET", url, headers=self.HEADER, timeout=300)
             response.raise_for_status()
         except req.exceptions.RequestException as req_err:
             print(f"Error getting query results: {req_err}")
@@ -176,7 +190,7 @@ class Dune:
         """
         url = self.make_api_url("execution", "cancel", execution_id)
         try:
-            response = req.get(url, headers=self.HEADER, timeout=300)
+            response = TRANSPORT.request("GET", url, headers=self.HEADER, timeout=300)
             response.raise_for_status()
         except req.exceptions.RequestException as req_err:
             print(f"Error canceling query execution: {req_err}")
@@ -215,7 +229,9 @@ class Dune:
 
         This method sends a POST request to execute a query, then polls the API
         until the query execution has completed. It then fetches and returns the
-        results of the query.
+        results of the query. An execution recorded in the journal by an
+        interrupted run is polled instead of executing the query again, and
+        if it failed or expired in the meantime the query is executed anew.
 
         Args:
             query_id (str): The ID of the query to run.
@@ -223,23 +239,120 @@ class Dune:
         Returns:
             dict: The results of the query, or None if an error occurred.
         """
+        execution_id = self.journal.get("dune_execution", query_id)
+        if execution_id is not None:
+            try:
+                results = self.wait_for_results(query_id, execution_id)
+            except req.exceptions.RequestException:
+                results = None
+            if results is not None:
+                return results
+            print(f"Execution {execution_id} of query {query_id} is gone, executing it again")
         execution_id = self.execute_query(query_id)
+        self.journal.record("dune_execution", query_id, execution_id)
+        return self.wait_for_results(query_id, execution_id)
 
-        while not self.stop_checking(execution_id):
-            time.sleep(1)  #TODO: #1 wait for a bit before checking again
+    def wait_for_results(self, query_id, execution_id):
+        """
+        Wait for an execution to complete and fetch its results.
+
+        A failed execution is removed from the journal.
+
+        Args:
+            query_id (str): The ID of the query.
+            execution_id (str): The execution ID of the query.
+
+        Returns:
+            dict: The results of the query, or None if the execution failed.
+        """
+        with METRICS.timer("dune_wait_seconds", query=query_id):
+            while True:
+                state = self.get_query_status(execution_id)['state']
+                if state == 'QUERY_STATE_COMPLETED':
+                    break
+                if state in self.FAILED_STATES:
+                    print(f"Execution {execution_id} ended in {state}")
+                    self.journal.remove("dune_execution", query_id)
+                    return None
+                TRANSPORT.sleep(1)  #TODO: #1 wait for a bit before checking again
 
         results = self.get_query_results(execution_id)
 
         if 'error' in results:
             print(f"Error executing query: {results['error']}")
+            self.journal.remove("dune_execution", query_id)
             return None
 
         return results
 
+    def save_query_results(self, query_id, path):
+        """
+        Run a query and write its result rows to a CSV file.
+
+        A query the journal records as saved to the same file is not run
+        again, its rows are read from the file.
+
+        Args:
+            query_id (str): The ID of the query to run.
+            path (str): The path of the CSV file.
+
+        Returns:
+            DataFrame: The result rows, or None if an error occurred.
+        """
+        if self.journal.get("dune_result", query_id) == path and os.path.exists(path):
+            return pd.read_csv(path, index_col=0)
+        results = self.run_query(query_id)
+        if results is None:
+            return None
+        result = results['result']
+        rows = pd.DataFrame(
+            result['rows'], columns=result['metadata']['column_names']
+        )
+        rows.to_csv(path)
+        self.journal.record("dune_result", query_id, path)
+        return rows
+
+    def clear_journal(self):
+        """
+        Forget the executions and results of a completed run, so the next
+        run executes the queries again.
+        """
+        self.journal.clear("dune_execution", "dune_result")
+
+    def fetch_and_save_results(self, chain_file="chain_info.csv", blockchains=None):
+        """
+        Run the query of every chain in chain_info.csv and save its results.
+
+        The journal is cleared once every query is saved. A run that stops
+        or fails before keeps it, and is resumed by the next one.
+
+        Args:
+            chain_file (str): File path of the chain info CSV file.
+            blockchains (list, optional): The chains to run the query of,
+            every chain if None.
+
+        Raises:
+            RuntimeError: If the query of a chain returned no results. The
+            other chains are saved first.
+        """
+        chains = pd.read_csv(chain_file, skipinitialspace=True)
+        if blockchains is not None:
+            chains = chains[chains['blockchain'].isin(blockchains)]
+        failed = [
+            row['blockchain']
+            for _, row in chains.iterrows()
+            if self.save_query_results(
+                str(row['queryID']), f"data/{row['queryCSV']}"
+            ) is None
+        ]
+        if failed:
+            raise RuntimeError(f"Dune queries of {failed} returned no results")
+        self.clear_journal()
+
     def run(self, query_id):
         execution_id = self.execute_query(query_id)
         while not self.stop_checking(execution_id):
-            time.sleep(1)  # wait for a bit before checking again
+            TRANSPORT.sleep(1)  # wait for a bit before checking again
         results = self.get_query_results(execution_id)
         if 'error' in results:
             print(f"Error executing query: {results['error']}")
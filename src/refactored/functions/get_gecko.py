@@ -11,6 +11,10 @@ CSV files for further analysis.
 The class also provides utility methods to manipulate data, such as
 copying columns with new headers and filling missing blockchain data.
 
+The daily prices and the contract info of every contract are recorded in
+the journal as soon as they are fetched, so a run interrupted by a crash or
+by rate limiting resumes with the contracts it had not fetched yet.
+
 Usage:
     To use this script, import the GetGecko class and instantiate it,
     then call the run() method.
@@ -30,10 +34,16 @@ Exceptions:
 """
 
 
-import time
+import os
+import threading
 import pandas as pd
 import numpy as np
 import requests
+from balance_store import BalanceStore
+from journal import JOURNAL
+from transport import TRANSPORT
+from resolver import RateLimiter
+from transfer_loader import TransferLoader
 
 
 class GetGecko:
@@ -45,16 +55,31 @@ class GetGecko:
     BASE_URL : str
         Base URL for the CoinGecko API.
     SLEEP_TIME : int
-        Time in seconds to sleep between requests to avoid hitting rate limit.
+        Minimum time in seconds between requests to avoid hitting rate limit.
     prices_file : str
         File path for the file where prices will be saved.
     info_file : str
         File path for the file where contract info will be saved.
+    store : BalanceStore
+        Store the daily prices are saved to.
+    limiter : RateLimiter
+        Limiter every request goes through. By default all instances share
+        one limiter, so stages running at the same time stay within the
+        CoinGecko rate together.
+    chains : list
+        The blockchains to fetch, or None for every chain of
+        chain_info.csv. The workbook sheets and contract info rows of the
+        other chains are kept.
+    journal : Journal
+        Journal the fetched prices and contract info are recorded in.
 
     Methods
     -------
     send_request(url, params=None):
         Send a request to the specified URL with optional parameters.
+    get_daily_prices(contract_address, blockchain):
+        Get the daily prices for a given contract address on a specified
+        blockchain.
     get_monthly_prices(contract_address, blockchain):
         Get the monthly prices for a given contract address on a specified
         blockchain.
@@ -89,14 +114,25 @@ class GetGecko:
     OPT_ETHER = '0x4200000000000000000000000000000000000006'
     BASE_URL = "https://api.coingecko.com/api/v3"
     SLEEP_TIME = 7
+    shared_limiter = None
+    shared_limiter_lock = threading.Lock()
 
     def __init__(
         self,
         prices_file='data/monthly_prices.xlsx',
-        info_file='data/contract_info.csv'
+        info_file='data/contract_info.csv',
+        store=None,
+        limiter=None,
+        chains=None,
+        journal=None
     ):
         self.prices_file = prices_file
         self.info_file = info_file
+        self.store = store or BalanceStore()
+        self.limiter = limiter or self.get_shared_limiter()
+        self.chains = None if chains is None else list(chains)
+        self.journal = journal or JOURNAL
+        self.loader = TransferLoader()
         pd.set_option('display.float_format', lambda x: f'{x:.3f}')
         self.sheet_headers_mapping = {
             "arbitrum-one": [
@@ -140,6 +176,20 @@ class GetGecko:
         }
 
 
+    @classmethod
+    def get_shared_limiter(cls):
+        """
+        Get the limiter shared by the instances without their own limiter,
+        creating it on first use.
+
+        Returns:
+            RateLimiter: The shared limiter.
+        """
+        with cls.shared_limiter_lock:
+            if cls.shared_limiter is None:
+                cls.shared_limiter = RateLimiter(1, 1 / cls.SLEEP_TIME, name="coingecko")
+            return cls.shared_limiter
+
     def send_request(self, url, params=None):
         """
         Send a request to the specified URL with optional parameters.
@@ -152,7 +202,8 @@ class GetGecko:
             dict: The JSON response from the server, or None if an error occurred.
         """
         try:
-            response = requests.get(url, params=params)
+            with self.limiter:
+                response = TRANSPORT.request("GET", url, params=params)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.HTTPError as http_err:
@@ -163,27 +214,65 @@ class GetGecko:
             print(f"An error occurred: {exc_err}")
         return None
 
-    def get_monthly_prices(self, contract_address, blockchain):
+    def get_daily_prices(self, contract_address, blockchain):
         """
-        Get the monthly prices for a given contract address on a specified blockchain.
+        Get the daily prices for a given contract address on a specified blockchain.
 
         Args:
             contract_address (str): The contract address to get prices for.
             blockchain (str): The blockchain that the contract address is on.
 
         Returns:
-            DataFrame: A DataFrame containing the monthly prices, or None if an error occurred.
+            DataFrame: A DataFrame containing the daily prices, or None if an error occurred.
         """
-
         url = f"{self.BASE_URL}/coins/{blockchain}/contract/{contract_address}/market_chart"
         params = {'vs_currency': 'usd', 'days': '1111'}
-        data = self.send_request(url, params=params)
+        data = self.journal.run(
+            "prices",
+            f"{blockchain}:{contract_address}",
+            lambda: self.get_price_points(url, params)
+        )
         if data is not None:
             prices = data['prices']
             timestamps = pd.to_datetime(np.array(prices)[:, 0], unit='ms')
             prices = np.array(prices)[:, 1].astype(float)
-            df = pd.DataFrame(prices, index=timestamps, columns=[contract_address])
-            monthly_prices = df.resample('M').last()
+            return pd.DataFrame(prices, index=timestamps, columns=[contract_address])
+        return None
+
+    def get_price_points(self, url, params):
+        """
+        Get the price points of a contract, without the market caps and
+        volumes, which are not used and would bloat the journal.
+
+        Args:
+            url (str): The market chart URL of the contract.
+            params (dict): The parameters of the request.
+
+        Returns:
+            dict: The [timestamp, price] pairs under 'prices', or None if an
+            error occurred.
+        """
+        data = self.send_request(url, params=params)
+        if data is None:
+            return None
+        return {'prices': data['prices']}
+
+    def get_monthly_prices(self, contract_address, blockchain, daily_prices=None):
+        """
+        Get the monthly prices for a given contract address on a specified blockchain.
+
+        Args:
+            contract_address (str): The contract address to get prices for.
+            blockchain (str): The blockchain that the contract address is on.
+            daily_prices (DataFrame, optional): The already fetched daily prices.
+
+        Returns:
+            DataFrame: A DataFrame containing the monthly prices, or None if an error occurred.
+        """
+        if daily_prices is None:
+            daily_prices = self.get_daily_prices(contract_address, blockchain)
+        if daily_prices is not None:
+            monthly_prices = daily_prices.resample('M').last()
             return monthly_prices
         return None
 
@@ -200,73 +289,248 @@ class GetGecko:
             tuple: A tuple containing the ticker and precision, or (None, None) if an error occurred.
         """
         url = f"{self.BASE_URL}/coins/{blkchn}/contract/{contract_addr}"
-        data = self.send_request(url)
-        if data is not None:
-            ticker = data['symbol']
-            precision = data['detail_platforms'][f'{blkchn}']['decimal_place']
-            return ticker, precision
+        info = self.journal.run(
+            "contracts",
+            f"{blkchn}:{contract_addr}",
+            lambda: self.get_contract_details(url, blkchn)
+        )
+        if info is not None:
+            return tuple(info)
         return None, None
 
+    def get_contract_details(self, url, blkchn):
+        """
+        Get the ticker and precision from the contract endpoint.
+
+        Args:
+            url (str): The contract URL.
+            blkchn (str): The blockchain that the contract address is on.
+
+        Returns:
+            list: The ticker and precision, or None if an error occurred.
+        """
+        data = self.send_request(url)
+        if data is None:
+            return None
+        return [data['symbol'], data['detail_platforms'][f'{blkchn}']['decimal_place']]
+
     def fetch_and_save_prices(self):
         """
         Fetch and save the monthly prices for all contracts on all blockchains specified in chain_info.csv.
 
+        The daily prices behind the monthly ones are saved to the daily price
+        table of the store as well, with the same column copies as the
+        monthly workbook. The workbook is only replaced once every chain is
+        fetched, so an interrupted run leaves the previous one intact. The
+        prices recorded in the journal by an interrupted run are not fetched
+        again, and the journal is cleared once the workbook is written.
+
         Returns:
             None
         """
-        writer = pd.ExcelWriter(self.prices_file)
-        data = pd.read_csv('chain_info.csv')
+        sheets = {}
+        data = self.load_chains()
         for _, row in data.iterrows():
             blockchain = row['blockchain']
-            addresses_file = row[' queryCSV']
-            addresses_df = pd.read_csv(f'data/{addresses_file}')
-            contract_addrs = addresses_df['contract_address'].unique()
-            if blockchain == 'optimistic-ethereum':
-                contract_addrs = np.append(contract_addrs, self.OPT_ETHER)
-            if blockchain == 'fantom':
-                contract_addrs = np.append(contract_addrs, self.FANT)
-            blockchain_prices = pd.DataFrame()
-            for address in contract_addrs:
-                monthly_prices = self.get_monthly_prices(address, blockchain)
-                if monthly_prices is not None:
-                    blockchain_prices = pd.concat([blockchain_prices, monthly_prices], axis=1)
-                time.sleep(7)
-            blockchain_prices.to_excel(writer, sheet_name=blockchain)
-        writer.close()
+            sheets[blockchain] = self.fetch_chain_prices(blockchain, row[' queryCSV'])
+        self.write_prices(sheets)
+        self.journal.clear("prices")
+
+
+    def write_prices(self, sheets):
+        """
+        Write the monthly price workbook, keeping the sheets of the chains
+        that were not fetched.
+
+        The workbook is written to a temporary file that then replaces it.
+
+        Args:
+            sheets (dict): The monthly prices of the fetched chains keyed by
+            blockchain.
+
+        Returns:
+            None
+        """
+        sheets = {**self.load_other_sheets(sheets), **sheets}
+        root, ext = os.path.splitext(self.prices_file)
+        tmp_path = f"{root}.tmp{ext}"
+        with pd.ExcelWriter(tmp_path) as writer:
+            for sheet, blockchain_prices in sheets.items():
+                blockchain_prices.to_excel(writer, sheet_name=sheet)
+        os.replace(tmp_path, self.prices_file)
+
+
+    def load_chains(self):
+        """
+        Load the chains to fetch from chain_info.csv.
+
+        Returns:
+            DataFrame: The rows of the selected chains.
+        """
+        data = pd.read_csv('chain_info.csv')
+        if self.chains is not None:
+            data = data[data['blockchain'].isin(self.chains)]
+        return data
+
+
+    def load_other_sheets(self, fetched):
+        """
+        Load the sheets of the chains that were not fetched from the price
+        workbook, so rewriting it keeps them.
+
+        Args:
+            fetched (iterable): The blockchains that were fetched.
+
+        Returns:
+            dict: The monthly prices keyed by sheet name, empty when there
+            is no workbook yet.
+        """
+        if not os.path.exists(self.prices_file):
+            return {}
+        excel_file = pd.ExcelFile(self.prices_file)
+        return {
+            sheet: pd.read_excel(excel_file, sheet, index_col=0)
+            for sheet in excel_file.sheet_names
+            if sheet not in fetched
+        }
+
+
+    def get_contract_addresses(self, blockchain, addresses_file):
+        """
+        Get the contract addresses of a blockchain from its Dune result file.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            addresses_file (str): The name of the Dune result file.
+
+        Returns:
+            ndarray: The unique contract addresses, with the native token
+            wrappers that are priced as well.
+        """
+        addresses_df = pd.read_csv(f'data/{addresses_file}')
+        contract_addrs = addresses_df['contract_address'].unique()
+        if blockchain == 'optimistic-ethereum':
+            contract_addrs = np.append(contract_addrs, self.OPT_ETHER)
+        if blockchain == 'fantom':
+            contract_addrs = np.append(contract_addrs, self.FANT)
+        return contract_addrs
+
+
+    def fetch_chain_prices(self, blockchain, addresses_file):
+        """
+        Fetch the prices of every contract of one blockchain.
+
+        The daily prices are saved to the store, the monthly ones returned.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            addresses_file (str): The name of the Dune result file.
+
+        Returns:
+            DataFrame: The monthly prices with one column per contract.
+        """
+        blockchain_prices = pd.DataFrame()
+        daily_prices = []
+        for address in self.get_contract_addresses(blockchain, addresses_file):
+            daily = self.get_daily_prices(address, blockchain)
+            monthly_prices = self.get_monthly_prices(address, blockchain, daily)
+            if monthly_prices is not None:
+                blockchain_prices = pd.concat([blockchain_prices, monthly_prices], axis=1)
+                daily_prices.append(daily)
+        if daily_prices:
+            self.save_daily_prices(blockchain, daily_prices)
+        return blockchain_prices
+
+
+    def save_daily_prices(self, blockchain, daily_prices):
+        """
+        Save the daily prices of a blockchain to the store.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            daily_prices (list): The daily price DataFrames, one per contract.
+
+        Returns:
+            None
+        """
+        daily = pd.concat(
+            [prices[~prices.index.duplicated(keep='last')] for prices in daily_prices],
+            axis=1
+        )
+        daily = self.copy_columns_with_new_headers(daily, blockchain)
+        self.store.write_prices(blockchain, daily)
 
 
     def fetch_and_save_contract_info(self):
         """
         Fetch and save the ticker and precision for all contracts on all blockchains specified in chain_info.csv.
 
+        Contract info recorded in the journal by an interrupted run is not
+        fetched again, and the journal is cleared once the file is written.
+
         Returns:
             None
         """
-        contract_info = []
-        data = pd.read_csv('chain_info.csv')
+        contract_info = {}
+        data = self.load_chains()
         for _, row in data.iterrows():
-            blockchain = row['blockchain']
-            addresses_file = row[' queryCSV']
-            addrs_df = pd.read_csv(f'data/{addresses_file}')
-            contract_addresses = addrs_df['contract_address'].unique()
-            if blockchain == 'optimistic-ethereum':
-                contract_addresses = np.append(contract_addresses, self.OPT_ETHER)
-            if blockchain == 'fantom':
-                contract_addresses = np.append(contract_addresses, self.FANT)
-            for address in contract_addresses:
-                ticker, precision = self.get_contract_info(address, blockchain)
-                if ticker is not None and precision is not None:
-                    contract_info.append({
-                        'blockchain': blockchain,
-                        'contract_address':address,
-                        'ticker': ticker,
-                        'decimal': precision
-                    })
-                time.sleep(7)
-        contract_info_df = pd.DataFrame(contract_info)
+            contract_info[row['blockchain']] = self.fetch_chain_contract_info(
+                row['blockchain'], row[' queryCSV']
+            )
+        self.write_contract_info(contract_info)
+        self.journal.clear("contracts")
+
+
+    def write_contract_info(self, contract_info):
+        """
+        Write the contract info file, keeping the rows of the chains that
+        were not fetched.
+
+        Args:
+            contract_info (dict): The contract info rows of the fetched
+            chains keyed by blockchain.
+
+        Returns:
+            None
+        """
+        contract_info_df = pd.DataFrame(
+            [row for rows in contract_info.values() for row in rows],
+            columns=['blockchain', 'contract_address', 'ticker', 'decimal']
+        )
+        if os.path.exists(self.info_file):
+            stored = pd.read_csv(self.info_file)
+            contract_info_df = pd.concat(
+                [stored[~stored['blockchain'].isin(list(contract_info))], contract_info_df],
+                ignore_index=True
+            )
         contract_info_df.to_csv(self.info_file, index=False)
 
 
+    def fetch_chain_contract_info(self, blockchain, addresses_file):
+        """
+        Fetch the ticker and precision of every contract of one blockchain.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            addresses_file (str): The name of the Dune result file.
+
+        Returns:
+            list: The blockchain, contract_address, ticker and decimal of
+            every contract CoinGecko knows.
+        """
+        contract_info = []
+        for address in self.get_contract_addresses(blockchain, addresses_file):
+            ticker, precision = self.get_contract_info(address, blockchain)
+            if ticker is not None and precision is not None:
+                contract_info.append({
+                    'blockchain': blockchain,
+                    'contract_address':address,
+                    'ticker': ticker,
+                    'decimal': precision
+                })
+        return contract_info
+
+
     def copy_column_with_new_header(self, df, orig_header, new_header):
         if orig_header in df.columns:
             df[new_header] = df[orig_header]
@@ -341,13 +605,27 @@ class GetGecko:
             None
         """
         contract_df = pd.read_csv(self.info_file)
-        data = pd.read_csv('chain_info.csv')
+        data = self.load_chains()
         for _, row in data.iterrows():
-            blockchain = row['blockchain']
-            file_name = row['queryCSV']
-            transactions_df = pd.read_csv(f'data/{file_name}')
-            merged_df = self.merge_dataframes(transactions_df, contract_df)
-            self.fill_data_and_save(merged_df, blockchain)
+            self.fill_chain_data(row['blockchain'], row[' queryCSV'], contract_df)
+
+
+    def fill_chain_data(self, blockchain, addresses_file, contract_df):
+        """
+        Merge the contract info into the Dune results of one blockchain and
+        save them as the chain's transfer file.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            addresses_file (str): The name of the Dune result file.
+            contract_df (DataFrame): The contract info.
+
+        Returns:
+            None
+        """
+        transactions_df = self.loader.read(f'data/{addresses_file}')
+        merged_df = self.merge_dataframes(transactions_df, contract_df)
+        self.fill_data_and_save(merged_df, blockchain)
 
 
     def fill_data_and_save(self, merged_df, blkchn):
@@ -0,0 +1,177 @@
+"""journal.py
+
+This script contains the Journal class, a durable record of the finished
+units of work of the long fetch runs, and JOURNAL, the journal the other
+modules record into.
+
+A refresh of the prices, the contract info, the token metadata or the Dune
+results makes hours of throttled requests, and used to lose all of them on a
+crash, because the results were only written at the end. Now every finished
+unit is recorded as soon as it is done: the daily prices and the contract
+info of every (chain, contract), the metadata of every scraped token, and
+the execution and saved result of every Dune query. A restarted run takes
+the recorded results instead of repeating the requests. Only successful
+results are recorded, so failed requests are retried. When a run completes,
+it clears its entries, so the next refresh fetches fresh data.
+
+The journal is a SQLite database in WAL mode. Every entry is committed on
+its own, so an interrupted run loses at most the unit it was working on.
+
+Usage:
+    from journal import JOURNAL
+
+    prices = JOURNAL.run("prices", "ethereum:0x...", fetch_prices)
+    JOURNAL.clear("prices")
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+
+class Journal:
+    """
+    Class to record finished units of work durably.
+
+    Attributes:
+        path (str): The path of the SQLite database.
+        connection (Connection): The database connection, opened on first
+        use.
+    """
+
+    def __init__(self, path="data/journal.sqlite"):
+        """
+        Initialize a new instance of the Journal class.
+
+        Args:
+            path (str): The path of the SQLite database, created on first
+            use.
+        """
+        self.path = path
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """
+        Get the database connection, opening it and creating the table on
+        first use. Must be called with the lock held.
+
+        Returns:
+            Connection: The connection.
+        """
+        if self.connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS work (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT,
+                    done_at TEXT NOT NULL,
+                    PRIMARY KEY (kind, key)
+                )
+                """
+            )
+            self.connection.commit()
+        return self.connection
+
+    def get(self, kind, key, default=None):
+        """
+        Get the recorded result of a unit of work.
+
+        Args:
+            kind (str): The kind of work, for example "prices".
+            key (str): The key of the unit, for example "ethereum:0x...".
+            default (object): The value returned if the unit is not done.
+
+        Returns:
+            object: The recorded result, or default.
+        """
+        with self.lock:
+            row = self.connect().execute(
+                "SELECT value FROM work WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def record(self, kind, key, value=None):
+        """
+        Record a unit of work as done, replacing an earlier record.
+
+        Args:
+            kind (str): The kind of work.
+            key (str): The key of the unit.
+            value (object): The JSON serializable result.
+        """
+        with self.lock:
+            connection = self.connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO work VALUES (?, ?, ?, ?)",
+                (kind, key, json.dumps(value),
+                 datetime.now(timezone.utc).isoformat()),
+            )
+            connection.commit()
+
+    def remove(self, kind, key):
+        """
+        Forget a unit of work.
+
+        Args:
+            kind (str): The kind of work.
+            key (str): The key of the unit.
+        """
+        with self.lock:
+            connection = self.connect()
+            connection.execute(
+                "DELETE FROM work WHERE kind = ? AND key = ?", (kind, key)
+            )
+            connection.commit()
+
+    def run(self, kind, key, fetch):
+        """
+        Run a unit of work unless it is done.
+
+        Args:
+            kind (str): The kind of work.
+            key (str): The key of the unit.
+            fetch (callable): Function without arguments that does the work
+            and returns a JSON serializable result, or None if it failed.
+
+        Returns:
+            object: The recorded or the new result. Lists come back from the
+            journal as lists, even if fetch returned a tuple.
+        """
+        value = self.get(kind, key)
+        if value is not None:
+            return value
+        value = fetch()
+        if value is not None:
+            self.record(kind, key, value)
+        return value
+
+    def clear(self, *kinds):
+        """
+        Forget every unit of some kinds of work, after the run they belong
+        to completed.
+
+        Args:
+            *kinds (str): The kinds of work, every kind if none are given.
+        """
+        with self.lock:
+            connection = self.connect()
+            if kinds:
+                connection.executemany(
+                    "DELETE FROM work WHERE kind = ?", [(kind,) for kind in kinds]
+                )
+            else:
+                connection.execute("DELETE FROM work")
+            connection.commit()
+
+
+JOURNAL = Journal()
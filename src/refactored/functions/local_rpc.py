@@ -0,0 +1,596 @@
+"""local_rpc.py
+
+This script contains a lightweight local stand-in for an EVM JSON-RPC node, so
+the on-chain lookups in scraper.py can be tested and timed without Infura keys
+or network access.
+
+The LocalRPC class builds its fixture data from contract_info.csv, with the
+token names taken from the chain's transfer file, and answers
+the calls the pipeline makes: `eth_call` for the ERC-20 `name`, `symbol`,
+`decimals` and `balanceOf` functions and for Multicall3 `aggregate` /
+`aggregate3`, plus `eth_getLogs`, `eth_blockNumber` and `eth_chainId`. Batch
+requests are supported. Latency, jitter and error rates are tunable so that
+batching, pooling and hedging strategies can be measured reproducibly.
+
+Usage:
+    Start a server for one chain from the command line:
+
+        python local_rpc.py --blockchain ethereum --port 8545 --latency 0.05
+
+    or from Python, and point a Web3 HTTPProvider at `rpc.url`:
+
+        from local_rpc import LocalRPC
+
+        rpc = LocalRPC("ethereum", latency=0.05, error_rate=0.01)
+        rpc.start()
+        w3 = Web3(Web3.HTTPProvider(rpc.url))
+        ...
+        rpc.stop()
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+from eth_abi import decode, encode
+
+
+class LocalRPC:
+    """
+    Class to serve fixture token data over a local EVM JSON-RPC endpoint.
+
+    Attributes:
+        CHAIN_IDS (dict): The chain ID of each supported blockchain.
+        MULTICALL3 (str): The address Multicall3 is deployed at on every chain.
+        SELECTORS (dict): The 4-byte function selectors that are understood.
+        TRANSFER_TOPIC (str): The topic of the ERC-20 Transfer event.
+        blockchain (str): The blockchain whose fixture data is served.
+        latency (float): Seconds to wait before answering each HTTP request.
+        jitter (float): Maximum random seconds added to the latency.
+        error_rate (float): Probability that a call returns a JSON-RPC error.
+        http_error_rate (float): Probability that a request returns HTTP 429.
+        tokens (dict): The fixture token data keyed by contract address. The
+        name is None for contracts without a known name.
+        logs (list): The fixture Transfer logs, ordered by block number.
+        block_number (int): The block number reported as the chain head.
+        stats (dict): Counters of served requests, calls and errors.
+    """
+
+    CHAIN_IDS = {
+        "arbitrum-one": 42161,
+        "avalanche": 43114,
+        "binance-smart-chain": 56,
+        "fantom": 250,
+        "ethereum": 1,
+        "optimistic-ethereum": 10,
+        "polygon-pos": 137,
+    }
+    MULTICALL3 = "0xca11bde05977b3631167028862be2a173976ca11"
+    SELECTORS = {
+        "06fdde03": "name",
+        "95d89b41": "symbol",
+        "313ce567": "decimals",
+        "70a08231": "balanceOf",
+        "18160ddd": "totalSupply",
+        "252dba42": "aggregate",
+        "82ad56cb": "aggregate3",
+        "42cbb15c": "getBlockNumber",
+    }
+    TRANSFER_TOPIC = (
+        "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+    )
+
+    def __init__(
+        self,
+        blockchain,
+        info_file="data/summary_info/contract_info.csv",
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        http_error_rate=0.0,
+        block_number=20_000_000,
+        logs_per_contract=25,
+        seed=0,
+        names_file=None
+    ):
+        """
+        Initialize a new instance of the LocalRPC class.
+
+        Args:
+            blockchain (str): The blockchain whose fixture data is served.
+            info_file (str): File path of the contract info CSV file.
+            host (str): The host to bind the server to.
+            port (int): The port to bind to, 0 picks a free port.
+            latency (float): Seconds to wait before answering each request.
+            jitter (float): Maximum random seconds added to the latency.
+            error_rate (float): Probability that a call returns an error.
+            http_error_rate (float): Probability that a request returns 429.
+            block_number (int): The block number reported as the chain head.
+            logs_per_contract (int): Number of Transfer logs per contract.
+            seed (int): Seed for the random latency and error draws.
+            names_file (str, optional): File path of a transfer CSV file
+            whose `token` column gives the token names,
+            `data/<blockchain>.csv` if None. `name()` reverts for contracts
+            without a name.
+        """
+        self.blockchain = blockchain
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.http_error_rate = http_error_rate
+        self.block_number = block_number
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "calls": 0, "errors": 0}
+        self.tokens = self.load_fixtures(
+            info_file, names_file or f"data/{blockchain}.csv"
+        )
+        self.logs = self.build_logs(logs_per_contract)
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        """
+        str: The HTTP URL of the running server.
+        """
+        return f"http://{self.host}:{self.port}"
+
+    def load_fixtures(self, info_file, names_file):
+        """
+        Build the fixture token data from the contract info CSV file.
+
+        Args:
+            info_file (str): File path of the contract info CSV file.
+            names_file (str): File path of the transfer CSV file the token
+            names are read from, if it exists.
+
+        Returns:
+            dict: The name, symbol and decimals keyed by contract address.
+        """
+        info = pd.read_csv(info_file)
+        info = info[info["blockchain"] == self.blockchain]
+        names = {}
+        if os.path.exists(names_file):
+            transfers = pd.read_csv(
+                names_file, usecols=["contract_address", "token"], dtype=str
+            ).dropna()
+            names = dict(zip(
+                transfers["contract_address"].str.lower(), transfers["token"]
+            ))
+        tokens = {}
+        for row in info.itertuples(index=False):
+            tokens[row.contract_address.lower()] = {
+                "name": names.get(row.contract_address.lower()),
+                "symbol": str(row.ticker),
+                "decimals": int(row.decimal),
+            }
+        return tokens
+
+    def build_logs(self, logs_per_contract):
+        """
+        Build deterministic Transfer logs for every fixture contract.
+
+        Args:
+            logs_per_contract (int): Number of Transfer logs per contract.
+
+        Returns:
+            list: The logs in JSON-RPC format, ordered by block number.
+        """
+        logs = []
+        for contract in self.tokens:
+            for i in range(logs_per_contract):
+                digest = self.digest(contract, str(i))
+                block = int.from_bytes(digest[:4], "big") % self.block_number
+                sender = "0x" + digest[4:24].hex()
+                receiver = "0x" + self.digest(sender)[:20].hex()
+                logs.append({
+                    "address": contract,
+                    "blockNumber": hex(block),
+                    "transactionHash": "0x" + self.digest(contract, "tx", str(i)).hex(),
+                    "logIndex": hex(i),
+                    "topics": [
+                        self.TRANSFER_TOPIC,
+                        "0x" + "0" * 24 + sender[2:],
+                        "0x" + "0" * 24 + receiver[2:],
+                    ],
+                    "data": "0x" + encode(
+                        ["uint256"], [int.from_bytes(digest[24:32], "big")]
+                    ).hex(),
+                    "removed": False,
+                })
+        logs.sort(key=lambda log: int(log["blockNumber"], 16))
+        return logs
+
+    def digest(self, *parts):
+        """
+        Hash the given strings into reproducible pseudo-random bytes.
+
+        Args:
+            *parts (str): The strings to hash.
+
+        Returns:
+            bytes: The 32-byte SHA-256 digest.
+        """
+        return hashlib.sha256("|".join(parts).encode()).digest()
+
+    def balance_of(self, contract, holder):
+        """
+        Get the deterministic fixture balance of a holder.
+
+        Args:
+            contract (str): The contract address of the token.
+            holder (str): The address of the holder.
+
+        Returns:
+            int: The balance in the token's smallest unit.
+        """
+        decimals = self.tokens[contract]["decimals"]
+        whole = int.from_bytes(self.digest(contract, holder.lower())[:4], "big")
+        return (whole % 10_000_000) * 10 ** decimals
+
+    def call(self, to, data):
+        """
+        Execute an eth_call against the fixture data.
+
+        Args:
+            to (str): The address of the called contract.
+            data (str): The hex encoded call data.
+
+        Returns:
+            bytes: The ABI encoded return data.
+
+        Raises:
+            ValueError: If the contract or function is not known.
+        """
+        to = to.lower()
+        data = bytes.fromhex(data[2:] if data.startswith("0x") else data)
+        function = self.SELECTORS.get(data[:4].hex())
+        args = data[4:]
+        if to == self.MULTICALL3:
+            return self.multicall(function, args)
+        if to not in self.tokens or function is None:
+            raise ValueError("execution reverted")
+        token = self.tokens[to]
+        if function in ("name", "symbol"):
+            if token[function] is None:
+                raise ValueError("execution reverted")
+            return encode(["string"], [token[function]])
+        if function == "decimals":
+            return encode(["uint8"], [token["decimals"]])
+        if function == "balanceOf":
+            (holder,) = decode(["address"], args)
+            return encode(["uint256"], [self.balance_of(to, holder)])
+        if function == "totalSupply":
+            return encode(["uint256"], [10 ** (9 + token["decimals"])])
+        raise ValueError("execution reverted")
+
+    def multicall(self, function, args):
+        """
+        Execute a Multicall3 call against the fixture data.
+
+        Args:
+            function (str): The name of the Multicall3 function.
+            args (bytes): The ABI encoded arguments.
+
+        Returns:
+            bytes: The ABI encoded return data.
+
+        Raises:
+            ValueError: If the function is not supported or a required call
+            fails.
+        """
+        if function == "getBlockNumber":
+            return encode(["uint256"], [self.block_number])
+        if function == "aggregate":
+            (calls,) = decode(["(address,bytes)[]"], args)
+            results = [self.call(target, "0x" + data.hex()) for target, data in calls]
+            return encode(["uint256", "bytes[]"], [self.block_number, results])
+        if function == "aggregate3":
+            (calls,) = decode(["(address,bool,bytes)[]"], args)
+            results = []
+            for target, allow_failure, data in calls:
+                try:
+                    results.append((True, self.call(target, "0x" + data.hex())))
+                except ValueError:
+                    if not allow_failure:
+                        raise
+                    results.append((False, b""))
+            return encode(["(bool,bytes)[]"], [results])
+        raise ValueError("execution reverted")
+
+    def get_logs(self, params):
+        """
+        Get the fixture Transfer logs matching a filter.
+
+        Args:
+            params (dict): The eth_getLogs filter object.
+
+        Returns:
+            list: The matching logs.
+        """
+        from_block = self.parse_block(params.get("fromBlock", "earliest"))
+        to_block = self.parse_block(params.get("toBlock", "latest"))
+        address = params.get("address")
+        if isinstance(address, str):
+            address = [address]
+        addresses = {a.lower() for a in address} if address else None
+        topics = params.get("topics") or []
+        logs = []
+        for log in self.logs:
+            block = int(log["blockNumber"], 16)
+            if block < from_block or block > to_block:
+                continue
+            if addresses is not None and log["address"] not in addresses:
+                continue
+            if not self.match_topics(log["topics"], topics):
+                continue
+            logs.append(log)
+        return logs
+
+    def match_topics(self, log_topics, topics):
+        """
+        Check whether the topics of a log match a topic filter.
+
+        Args:
+            log_topics (list): The topics of the log.
+            topics (list): The topic filter, where each entry may be None, a
+            topic or a list of alternative topics.
+
+        Returns:
+            bool: True if the log matches the filter, False otherwise.
+        """
+        for i, topic in enumerate(topics):
+            if topic is None:
+                continue
+            options = topic if isinstance(topic, list) else [topic]
+            if i >= len(log_topics) or log_topics[i].lower() not in {
+                t.lower() for t in options
+            }:
+                return False
+        return True
+
+    def parse_block(self, block):
+        """
+        Convert a block tag or hex block number to an integer.
+
+        Args:
+            block (str or int): The block tag, hex block number or block
+            number.
+
+        Returns:
+            int: The block number.
+        """
+        if isinstance(block, int):
+            return block
+        if block in ("latest", "pending", "safe", "finalized"):
+            return self.block_number
+        if block == "earliest":
+            return 0
+        return int(block, 16)
+
+    def answer(self, body):
+        """
+        Answer a raw JSON-RPC request body, single or batched.
+
+        Args:
+            body (bytes): The HTTP request body.
+
+        Returns:
+            dict or list: The JSON-RPC response object, or the list of them
+            for a batch.
+        """
+        try:
+            request = json.loads(body)
+        except ValueError:
+            return self.error_response(None, -32700, "Parse error")
+        if isinstance(request, list) and request:
+            return [
+                self.handle(item) if isinstance(item, dict)
+                else self.error_response(None, -32600, "Invalid Request")
+                for item in request
+            ]
+        if isinstance(request, dict):
+            return self.handle(request)
+        return self.error_response(None, -32600, "Invalid Request")
+
+    def error_response(self, request_id, code, message):
+        """
+        Build a JSON-RPC error response.
+
+        Args:
+            request_id (object): The id of the request, None if unknown.
+            code (int): The JSON-RPC error code.
+            message (str): The error message.
+
+        Returns:
+            dict: The JSON-RPC response object.
+        """
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "error": {"code": code, "message": message},
+        }
+
+    def handle(self, request):
+        """
+        Answer a single JSON-RPC request.
+
+        Args:
+            request (dict): The JSON-RPC request object.
+
+        Returns:
+            dict: The JSON-RPC response object.
+        """
+        with self.lock:
+            self.stats["calls"] += 1
+            failed = self.random.random() < self.error_rate
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        if failed:
+            with self.lock:
+                self.stats["errors"] += 1
+            response["error"] = {"code": -32005, "message": "limit exceeded"}
+            return response
+        method, params = request.get("method"), request.get("params") or []
+        try:
+            if method == "eth_call":
+                call = params[0]
+                data = call.get("data") or call.get("input") or "0x"
+                result = "0x" + self.call(call["to"], data).hex()
+            elif method == "eth_getLogs":
+                result = self.get_logs(params[0])
+            elif method == "eth_blockNumber":
+                result = hex(self.block_number)
+            elif method == "eth_chainId":
+                result = hex(self.CHAIN_IDS.get(self.blockchain, 1))
+            elif method == "net_version":
+                result = str(self.CHAIN_IDS.get(self.blockchain, 1))
+            else:
+                response["error"] = {"code": -32601, "message": "method not found"}
+                return response
+        except ValueError as err:
+            response["error"] = {"code": 3, "message": str(err), "data": "0x"}
+            return response
+        except (TypeError, KeyError, IndexError, AttributeError) as err:
+            response["error"] = {"code": -32602, "message": f"invalid params: {err!r}"}
+            return response
+        response["result"] = result
+        return response
+
+    def delay(self):
+        """
+        Sleep for the configured latency plus a random jitter.
+
+        Returns:
+            bool: True if the request should fail with HTTP 429.
+        """
+        with self.lock:
+            self.stats["requests"] += 1
+            extra = self.random.uniform(0, self.jitter)
+            throttled = self.random.random() < self.http_error_rate
+        if self.latency or extra:
+            time.sleep(self.latency + extra)
+        return throttled
+
+    def make_handler(self):
+        """
+        Create the HTTP request handler class bound to this instance.
+
+        Returns:
+            type: The BaseHTTPRequestHandler subclass.
+        """
+        rpc = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            HTTP handler that forwards JSON-RPC bodies to the LocalRPC.
+            """
+
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                """
+                Answer a JSON-RPC POST request, single or batched.
+                """
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if rpc.delay():
+                    self.reply(429, b'{"error": "Too Many Requests"}')
+                    return
+                self.reply(200, json.dumps(rpc.answer(body)).encode())
+
+            def reply(self, status, payload):
+                """
+                Write a JSON response with the given status.
+                """
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                """
+                Silence the per-request access log.
+                """
+
+        return Handler
+
+    def start(self):
+        """
+        Start serving in a background thread.
+
+        Returns:
+            str: The HTTP URL of the running server.
+        """
+        self.server = ThreadingHTTPServer((self.host, self.port), self.make_handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        """
+        Stop the server and wait for the background thread to finish.
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    """
+    Serve the fixture data of one blockchain until interrupted.
+    """
+    parser = argparse.ArgumentParser(description="Local EVM JSON-RPC stand-in")
+    parser.add_argument("--blockchain", default="ethereum")
+    parser.add_argument("--info-file", default="data/summary_info/contract_info.csv")
+    parser.add_argument("--names-file", default=None)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8545)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--http-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rpc = LocalRPC(
+        args.blockchain,
+        info_file=args.info_file,
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        http_error_rate=args.http_error_rate,
+        seed=args.seed,
+        names_file=args.names_file,
+    )
+    rpc.start()
+    print(f"Serving {args.blockchain} fixtures on {rpc.url}")
+    try:
+        rpc.thread.join()
+    except KeyboardInterrupt:
+        rpc.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,527 @@
+"""metrics.py
+
+This script contains the Metrics class, which collects the timings, counts
+and sizes of a run, and METRICS, the registry the other modules record into.
+
+Three kinds of metrics are kept, each identified by a name and a set of
+labels: counters, gauges and histograms. Histograms keep the count, sum,
+maximum and fixed latency buckets of their observations. The pipeline times
+its stages and records the rows and bytes they write, every outbound HTTP
+request is timed by host, endpoint, method and status, and every
+DataAnalysis method is timed. Rate limiter waits, Dune polling and browser
+sleeps are timed as well, so a slow run shows where its time went.
+
+At the end of a run the metrics are written as a JSON report and as a
+Prometheus textfile for the node exporter textfile collector. Metrics
+recorded in worker processes stay in those processes.
+
+Usage:
+    from metrics import METRICS
+
+    with METRICS.timer("stage_seconds", stage="calc"):
+        run_calculations()
+    response = METRICS.request("GET", url, params=params)
+    METRICS.write_report("data/metrics/run_report.json")
+    METRICS.write_prometheus("data/metrics/twa.prom")
+"""
+
+import functools
+import inspect
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+import requests
+
+
+class Metrics:
+    """
+    Class to collect and export the metrics of a run.
+
+    Attributes:
+        BUCKETS (tuple): The upper bounds in seconds of the histogram
+        buckets.
+        PREFIX (str): The prefix of the exported Prometheus metric names.
+        ID_PATTERN (Pattern): Path segments replaced by {id} in endpoint
+        labels, such as contract addresses, query IDs and API keys.
+        counters (dict): The counter values keyed by name and labels.
+        gauges (dict): The gauge values keyed by name and labels.
+        histograms (dict): The histogram states keyed by name and labels.
+        started (datetime): When the collection started.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+               10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+    PREFIX = "twa_"
+    ID_PATTERN = re.compile(r"^(0x[0-9a-fA-F]+|\d+|[0-9a-fA-F-]{24,}|[0-9A-Z]{20,})$")
+
+    def __init__(self):
+        """
+        Initialize a new instance of the Metrics class.
+        """
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Drop every recorded metric and restart the collection.
+        """
+        with self.lock:
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+            self.started = datetime.now(timezone.utc)
+
+    @staticmethod
+    def key(name, labels):
+        """
+        Get the registry key of a metric.
+
+        Args:
+            name (str): The name of the metric.
+            labels (dict): The labels of the metric.
+
+        Returns:
+            tuple: The name and the sorted label items.
+        """
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def increment(self, name, value=1, **labels):
+        """
+        Add to a counter.
+
+        Args:
+            name (str): The name of the counter.
+            value (float): The amount to add.
+            **labels: The labels of the counter.
+        """
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """
+        Set a gauge.
+
+        Args:
+            name (str): The name of the gauge.
+            value (float): The value.
+            **labels: The labels of the gauge.
+        """
+        with self.lock:
+            self.gauges[self.key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        """
+        Add an observation to a histogram.
+
+        Args:
+            name (str): The name of the histogram.
+            value (float): The observed value, usually seconds.
+            **labels: The labels of the histogram.
+        """
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    "count": 0, "sum": 0.0, "max": 0.0,
+                    "buckets": [0] * len(self.BUCKETS),
+                }
+            histogram["count"] += 1
+            histogram["sum"] += value
+            histogram["max"] = max(histogram["max"], value)
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+                    break
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Time a block into a histogram, also when it raises.
+
+        Args:
+            name (str): The name of the histogram.
+            **labels: The labels of the histogram.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def instrument(self, cls):
+        """
+        Time every public method of a class, for use as a class decorator.
+
+        The calls are recorded in the method_seconds histogram, labelled
+        with the class and method name.
+
+        Args:
+            cls (type): The class.
+
+        Returns:
+            type: The same class with its methods wrapped.
+        """
+        for name, func in list(vars(cls).items()):
+            if name.startswith("_") or not inspect.isfunction(func):
+                continue
+            setattr(cls, name, self.timed(func, cls.__name__))
+        return cls
+
+    def timed(self, func, owner):
+        """
+        Wrap a function so its calls are timed.
+
+        Args:
+            func (callable): The function.
+            owner (str): The class label of the calls.
+
+        Returns:
+            callable: The wrapped function.
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.timer("method_seconds", cls=owner, method=func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def endpoint(self, url):
+        """
+        Get the endpoint label of a URL.
+
+        Args:
+            url (str): The URL.
+
+        Returns:
+            tuple: The host and the path with its identifying segments
+            replaced by {id}.
+        """
+        parsed = urlparse(url)
+        segments = [
+            "{id}" if self.ID_PATTERN.match(segment) else segment
+            for segment in parsed.path.split("/")
+        ]
+        return parsed.netloc, "/".join(segments) or "/"
+
+    def record_request(self, method, url, status, seconds, size=0, endpoint=None):
+        """
+        Record an outbound request.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The requested URL.
+            status (int or str): The HTTP status, or "error" if no response
+            was received.
+            seconds (float): The duration of the request.
+            size (int): The number of bytes of the response body.
+            endpoint (str, optional): The endpoint label, derived from the
+            URL if None.
+        """
+        host, path = self.endpoint(url)
+        labels = {
+            "host": host, "endpoint": endpoint or path,
+            "method": method.upper(), "status": status,
+        }
+        self.observe("http_request_seconds", seconds, **labels)
+        self.increment("http_response_bytes_total", size, **labels)
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request with requests and record it.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL.
+            **kwargs: The keyword arguments of requests.request.
+
+        Returns:
+            Response: The response.
+        """
+        start = time.perf_counter()
+        try:
+            response = requests.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.record_request(method, url, "error", time.perf_counter() - start)
+            raise
+        self.record_request(
+            method, url, response.status_code, time.perf_counter() - start,
+            len(response.content)
+        )
+        return response
+
+    def session(self):
+        """
+        Get a requests session that records every response it receives.
+
+        Requests with a JSON-RPC body are labelled with their RPC method
+        instead of the URL path, so node calls are broken down by method.
+
+        Returns:
+            Session: The session.
+        """
+        session = requests.Session()
+        session.hooks["response"].append(self.record_response)
+        return session
+
+    def record_response(self, response, *args, **kwargs):
+        """
+        Record a response received by a session from session().
+
+        Args:
+            response (Response): The response.
+        """
+        endpoint = None
+        try:
+            body = json.loads(response.request.body or b"null")
+            if isinstance(body, dict) and "method" in body:
+                endpoint = body["method"]
+        except (TypeError, ValueError):
+            pass
+        self.record_request(
+            response.request.method, response.url, response.status_code,
+            response.elapsed.total_seconds(), len(response.content), endpoint
+        )
+
+    def cache(self, name, hit):
+        """
+        Record a cache lookup.
+
+        Args:
+            name (str): The name of the cache.
+            hit (bool): Whether the lookup was answered from the cache.
+        """
+        self.increment(
+            "cache_lookups_total", cache=name, result="hit" if hit else "miss"
+        )
+
+    def record_files(self, stage, paths):
+        """
+        Record the number of rows and bytes of the files a stage wrote.
+
+        Rows are counted for CSV and Parquet files only.
+
+        Args:
+            stage (str): The name of the stage.
+            paths (list): The paths of the files.
+        """
+        rows = size = 0
+        for path in paths:
+            if not os.path.isfile(path):
+                continue
+            size += os.path.getsize(path)
+            rows += self.count_rows(path)
+        self.set("stage_output_rows", rows, stage=stage)
+        self.set("stage_output_bytes", size, stage=stage)
+
+    @staticmethod
+    def count_rows(path):
+        """
+        Count the data rows of a file.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            int: The rows of a Parquet file or the lines after the header of
+            a CSV file, 0 for other files.
+        """
+        if path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+            return pq.ParquetFile(path).metadata.num_rows
+        if path.endswith(".csv"):
+            with open(path, "rb") as file:
+                lines = sum(block.count(b"\n")
+                            for block in iter(lambda: file.read(1 << 20), b""))
+            return max(lines - 1, 0)
+        return 0
+
+    def cache_hit_rates(self):
+        """
+        Get the hit rate of every cache.
+
+        Returns:
+            dict: The share of lookups answered from the cache keyed by
+            cache name.
+        """
+        lookups = {}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                if name != "cache_lookups_total":
+                    continue
+                labels = dict(labels)
+                hits, total = lookups.get(labels["cache"], (0, 0))
+                lookups[labels["cache"]] = (
+                    hits + (value if labels["result"] == "hit" else 0),
+                    total + value,
+                )
+        return {cache: hits / total for cache, (hits, total) in lookups.items()}
+
+    def report(self):
+        """
+        Get the recorded metrics as a JSON serializable dictionary.
+
+        Returns:
+            dict: The run times, counters, gauges, histograms and cache hit
+            rates.
+        """
+        finished = datetime.now(timezone.utc)
+        with self.lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            gauges = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.gauges.items())
+            ]
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": h["count"],
+                    "sum": h["sum"],
+                    "mean": h["sum"] / h["count"],
+                    "max": h["max"],
+                    "buckets": dict(zip(
+                        [str(bound) for bound in self.BUCKETS],
+                        self.cumulative(h["buckets"]),
+                    )),
+                }
+                for (name, labels), h in sorted(self.histograms.items())
+            ]
+        return {
+            "started": self.started.isoformat(),
+            "finished": finished.isoformat(),
+            "duration_seconds": (finished - self.started).total_seconds(),
+            "counters": counters,
+            "gauges": gauges,
+            "histograms": histograms,
+            "cache_hit_rates": self.cache_hit_rates(),
+        }
+
+    @staticmethod
+    def cumulative(buckets):
+        """
+        Get the cumulative counts of histogram buckets.
+
+        Args:
+            buckets (list): The count of every bucket.
+
+        Returns:
+            list: The number of observations up to every bucket bound.
+        """
+        total, counts = 0, []
+        for count in buckets:
+            total += count
+            counts.append(total)
+        return counts
+
+    def prometheus(self):
+        """
+        Get the recorded metrics in the Prometheus text format.
+
+        Returns:
+            str: The exposition text.
+        """
+        lines = []
+        report = self.report()
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for kind in ("counters", "gauges"):
+            for metric in report[kind]:
+                name = self.PREFIX + metric["name"]
+                declare(name, "counter" if kind == "counters" else "gauge")
+                lines.append(f"{name}{self.labels(metric['labels'])} {metric['value']}")
+        for metric in report["histograms"]:
+            name = self.PREFIX + metric["name"]
+            declare(name, "histogram")
+            for bound, count in metric["buckets"].items():
+                lines.append(
+                    f"{name}_bucket{self.labels({**metric['labels'], 'le': bound})} {count}"
+                )
+            lines.append(
+                f"{name}_bucket{self.labels({**metric['labels'], 'le': '+Inf'})} "
+                f"{metric['count']}"
+            )
+            lines.append(f"{name}_sum{self.labels(metric['labels'])} {metric['sum']}")
+            lines.append(f"{name}_count{self.labels(metric['labels'])} {metric['count']}")
+        name = self.PREFIX + "cache_hit_ratio"
+        for cache, rate in report["cache_hit_rates"].items():
+            declare(name, "gauge")
+            lines.append(f"{name}{self.labels({'cache': cache})} {rate}")
+        name = self.PREFIX + "run_duration_seconds"
+        declare(name, "gauge")
+        lines.append(f"{name} {report['duration_seconds']}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def labels(labels):
+        """
+        Format labels for the Prometheus text format.
+
+        Args:
+            labels (dict): The labels.
+
+        Returns:
+            str: The label set, empty if there are no labels.
+        """
+        if not labels:
+            return ""
+        items = ",".join(
+            '{}="{}"'.format(
+                key, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                .replace("\n", "\\n")
+            )
+            for key, value in labels.items()
+        )
+        return "{" + items + "}"
+
+    def write_report(self, path):
+        """
+        Write the JSON run report, replacing the file atomically.
+
+        Args:
+            path (str): The path of the report.
+        """
+        self.write_file(path, json.dumps(self.report(), indent=2))
+
+    def write_prometheus(self, path):
+        """
+        Write the Prometheus textfile, replacing the file atomically so the
+        collector never reads a partial file.
+
+        Args:
+            path (str): The path of the textfile, ending in .prom.
+        """
+        self.write_file(path, self.prometheus())
+
+    @staticmethod
+    def write_file(path, text):
+        """
+        Write a text file atomically.
+
+        Args:
+            path (str): The path of the file.
+            text (str): The content.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(tmp_path, path)
+
+
+METRICS = Metrics()
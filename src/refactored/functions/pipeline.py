@@ -0,0 +1,309 @@
+"""pipeline.py
+
+This script contains the Stage and Pipeline classes, which run the stages of
+the application as a dependency graph and skip the stages that are up to
+date.
+
+Every stage declares the files it reads and the files it writes, as paths or
+glob patterns. A stage depends on the stages that write one of its inputs.
+Before a stage runs, the content of its inputs is hashed. It is skipped when
+that hash and the hash of its outputs match the ones recorded after its last
+successful run, so changing the analysis code only reruns the analysis
+stages and never the network stages in front of them. When a stage rewrites
+files another stage wrote too, the output hash of the other stage is
+updated, so the rewrite does not count as a change. Stages whose
+dependencies are done run concurrently in a thread pool.
+
+Usage:
+    from pipeline import Pipeline
+
+    pipeline = Pipeline()
+    pipeline.add("prices", fetch_prices, inputs=["chain_info.csv"],
+                 outputs=["data/monthly_prices.xlsx"])
+    pipeline.add("calc", run_calculations,
+                 inputs=["data/monthly_prices.xlsx", "calculations.py"],
+                 outputs=["summed.csv"])
+    results = pipeline.run()
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from metrics import METRICS
+
+
+class Stage:
+    """
+    Class to hold the declaration of a pipeline stage.
+
+    Attributes:
+        name (str): The name of the stage.
+        func (callable): Function without arguments that runs the stage.
+        inputs (list): The paths or glob patterns the stage reads.
+        outputs (list): The paths or glob patterns the stage writes.
+        after (list): Names of stages that must finish first, on top of the
+        ones derived from the inputs.
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), after=()):
+        """
+        Initialize a new instance of the Stage class.
+
+        Args:
+            name (str): The name of the stage.
+            func (callable): Function without arguments that runs the stage.
+            inputs (list): The paths or glob patterns the stage reads.
+            outputs (list): The paths or glob patterns the stage writes.
+            after (list): Names of stages that must finish first.
+        """
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.after = list(after)
+
+
+class Pipeline:
+    """
+    Class to run stages in dependency order, skipping up-to-date stages.
+
+    Attributes:
+        state_file (str): The JSON file the hashes of the last runs are kept
+        in.
+        max_workers (int): The maximum number of stages run at once.
+        stages (dict): The declared stages keyed by name.
+    """
+
+    def __init__(self, state_file="data/pipeline_state.json", max_workers=None):
+        """
+        Initialize a new instance of the Pipeline class.
+
+        Args:
+            state_file (str): The JSON file the hashes of the last runs are
+            kept in.
+            max_workers (int, optional): The maximum number of stages run at
+            once, the thread pool default if None.
+        """
+        self.state_file = state_file
+        self.max_workers = max_workers
+        self.stages = {}
+
+    def add(self, name, func, inputs=(), outputs=(), after=()):
+        """
+        Declare a stage.
+
+        Args:
+            name (str): The name of the stage.
+            func (callable): Function without arguments that runs the stage.
+            inputs (list): The paths or glob patterns the stage reads.
+            outputs (list): The paths or glob patterns the stage writes.
+            after (list): Names of stages that must finish first.
+
+        Returns:
+            Stage: The declared stage.
+        """
+        self.stages[name] = Stage(name, func, inputs, outputs, after)
+        return self.stages[name]
+
+    def dependencies(self, stage):
+        """
+        Get the stages a stage depends on.
+
+        Args:
+            stage (Stage): The stage.
+
+        Returns:
+            set: The names of the stages that write one of its inputs or are
+            listed in its after list.
+        """
+        inputs = set(stage.inputs)
+        depends = {
+            other.name
+            for other in self.stages.values()
+            if other is not stage and inputs & set(other.outputs)
+        }
+        return depends | set(stage.after)
+
+    def hash_files(self, patterns):
+        """
+        Hash the paths and contents of the files matching some patterns.
+
+        Args:
+            patterns (list): The paths or glob patterns.
+
+        Returns:
+            str: The hex digest, or None if a plain path does not exist. A
+            glob pattern may match no file at all.
+        """
+        digest = hashlib.sha256()
+        for pattern in patterns:
+            paths = sorted(glob.glob(pattern))
+            if not paths and not glob.has_magic(pattern):
+                return None
+            for path in paths:
+                digest.update(path.encode())
+                with open(path, "rb") as file:
+                    for block in iter(lambda: file.read(1 << 20), b""):
+                        digest.update(block)
+        return digest.hexdigest()
+
+    def load_state(self):
+        """
+        Load the hashes recorded after the last runs.
+
+        Returns:
+            dict: The input and output hashes keyed by stage name.
+        """
+        if not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file, encoding="utf-8") as file:
+            return json.load(file)
+
+    def save_state(self, state):
+        """
+        Save the recorded hashes, replacing the state file atomically.
+
+        Args:
+            state (dict): The input and output hashes keyed by stage name.
+        """
+        directory = os.path.dirname(self.state_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(state, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.state_file)
+
+    def is_up_to_date(self, stage, record):
+        """
+        Check whether a stage can be skipped.
+
+        Args:
+            stage (Stage): The stage.
+            record (dict): The hashes recorded after its last run, or None.
+
+        Returns:
+            bool: True if the inputs and outputs are unchanged since then.
+        """
+        if not record:
+            return False
+        inputs = self.hash_files(stage.inputs)
+        outputs = self.hash_files(stage.outputs)
+        return (
+            inputs is not None
+            and outputs is not None
+            and inputs == record.get("inputs")
+            and outputs == record.get("outputs")
+        )
+
+    def execute(self, stage, record, force):
+        """
+        Run a stage unless it is up to date.
+
+        Args:
+            stage (Stage): The stage.
+            record (dict): The hashes recorded after its last run, or None.
+            force (bool): Whether to run the stage even if it is up to date.
+
+        Returns:
+            tuple: "ran" or "skipped", and the hashes to record.
+        """
+        if not force and self.is_up_to_date(stage, record):
+            logging.info("Stage %s is up to date", stage.name)
+            METRICS.increment("stage_runs_total", stage=stage.name, result="skipped")
+            return "skipped", record
+        logging.info("Running stage %s", stage.name)
+        try:
+            with METRICS.timer("stage_seconds", stage=stage.name):
+                stage.func()
+        except Exception:
+            METRICS.increment("stage_runs_total", stage=stage.name, result="failed")
+            raise
+        METRICS.increment("stage_runs_total", stage=stage.name, result="ran")
+        METRICS.record_files(
+            stage.name,
+            sorted({path for pattern in stage.outputs for path in glob.glob(pattern)})
+        )
+        return "ran", {
+            "inputs": self.hash_files(stage.inputs),
+            "outputs": self.hash_files(stage.outputs),
+        }
+
+    def rehash_shared_outputs(self, stage, state):
+        """
+        Update the recorded output hashes of the stages that declare an
+        output of a stage that just ran.
+
+        Args:
+            stage (Stage): The stage that ran.
+            state (dict): The input and output hashes keyed by stage name.
+        """
+        outputs = set(stage.outputs)
+        for other in self.stages.values():
+            record = state.get(other.name)
+            if other is not stage and record and outputs & set(other.outputs):
+                record["outputs"] = self.hash_files(other.outputs)
+
+    def run(self, stages=None, force=()):
+        """
+        Run the pipeline.
+
+        A stage whose dependency failed is not run.
+
+        Args:
+            stages (list, optional): The names of the stages to consider,
+            every stage if None. Dependencies outside this list are treated
+            as done.
+            force (list): Names of stages to run even if they are up to date.
+
+        Returns:
+            dict: "ran", "skipped", "failed" or "blocked" keyed by stage name.
+
+        Raises:
+            ValueError: If a stage is not known or the stages depend on each
+            other in a cycle.
+        """
+        selected = list(self.stages) if stages is None else list(stages)
+        for name in selected:
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage: {name}")
+        waiting = {
+            name: self.dependencies(self.stages[name]) & set(selected)
+            for name in selected
+        }
+        state = self.load_state()
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while waiting or running:
+                for name in [n for n, deps in waiting.items() if not deps - set(results)]:
+                    deps = waiting.pop(name)
+                    if any(results[dep] in ("failed", "blocked") for dep in deps):
+                        results[name] = "blocked"
+                        logging.info("Stage %s is blocked", name)
+                        continue
+                    future = executor.submit(
+                        self.execute, self.stages[name], state.get(name),
+                        name in force
+                    )
+                    running[future] = name
+                if not running:
+                    if waiting:
+                        raise ValueError(f"Dependency cycle between {sorted(waiting)}")
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name], state[name] = future.result()
+                        if results[name] == "ran":
+                            self.rehash_shared_outputs(self.stages[name], state)
+                    except Exception:
+                        logging.exception("Stage %s failed", name)
+                        results[name] = "failed"
+                        state.pop(name, None)
+                    self.save_state(state)
+        return results
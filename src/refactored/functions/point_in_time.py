@@ -0,0 +1,242 @@
+"""point_in_time.py
+
+This script contains the BalanceLookup class, which answers what the treasury
+held, and what it was worth, at any point in time.
+
+For every chain the transfers produced by DataAnalysis are sorted by contract
+and time and turned into cumulative balance arrays. The arrays of all
+contracts are laid end to end and keyed by (contract code, seconds), so the
+balance of one contract or of a whole chain at a timestamp is a single
+`np.searchsorted`. USD values use the latest monthly price at or before the
+timestamp. Chains are loaded on first use and kept in memory, so repeated
+queries never rerun the monthly pipeline.
+
+Usage:
+    from point_in_time import BalanceLookup
+
+    lookup = BalanceLookup()
+    lookup.balance("ethereum", "0xa0b8...eb48", "2023-03-15")
+    lookup.values("ethereum", "2023-03-15 12:00")
+"""
+
+import numpy as np
+import pandas as pd
+from calculations import DataAnalysis
+
+
+class BalanceLookup:
+    """
+    Class to look up balances and USD values at any timestamp.
+
+    Attributes:
+        analysis (DataAnalysis): The analysis used to load and clean the
+        transfers and to load the prices.
+        prices_file (str): File path of the monthly price workbook.
+        chains (dict): The loaded lookup arrays keyed by blockchain.
+    """
+
+    def __init__(self, analysis=None, prices_file="data/monthly_prices_full.xlsx"):
+        """
+        Initialize a new instance of the BalanceLookup class.
+
+        Args:
+            analysis (DataAnalysis, optional): The analysis used to load the
+            data, a default DataAnalysis if None.
+            prices_file (str): File path of the monthly price workbook.
+        """
+        self.analysis = analysis or DataAnalysis()
+        self.prices_file = prices_file
+        self.excel_file = None
+        self.chains = {}
+
+    def load(self, blockchain):
+        """
+        Build the lookup arrays of a blockchain, once.
+
+        Transfers without a contract address are left out, as they are left
+        out of the balances of DataAnalysis.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            dict: The contracts, sort keys, cumulative balances and prices of
+            the blockchain.
+        """
+        if blockchain in self.chains:
+            return self.chains[blockchain]
+        data = self.analysis.clean_data(self.analysis.load_data(blockchain))
+        seconds = self.to_seconds(data["time"])
+        codes, contracts = pd.factorize(data["contract_address"], sort=True)
+        contracts = np.asarray(contracts, dtype=object)
+        amounts = data["calc_value"].fillna(0).to_numpy(dtype=float)
+        keep = codes >= 0
+        seconds, codes, amounts = seconds[keep], codes[keep], amounts[keep]
+
+        order = np.lexsort((seconds, codes))
+        seconds, codes, amounts = seconds[order], codes[order], amounts[order]
+        start = seconds.min() if len(seconds) else 0
+        span = (seconds.max() - start + 1) if len(seconds) else 1
+        keys = codes * span + (seconds - start)
+        cumulative = np.cumsum(amounts)
+        offsets = np.searchsorted(codes, np.arange(len(contracts)))
+        base = np.where(offsets > 0, cumulative[offsets - 1], 0.0)
+        cumulative -= np.repeat(base, np.diff(np.append(offsets, len(codes))))
+
+        if self.excel_file is None:
+            self.excel_file = pd.ExcelFile(self.prices_file)
+        monthly = self.analysis.load_monthly_data(self.excel_file, blockchain)
+        monthly = monthly.reindex(columns=contracts)
+        price_seconds = self.to_seconds(
+            monthly.index.to_timestamp(how="end").normalize()
+        )
+
+        self.chains[blockchain] = {
+            "contracts": pd.Index(contracts, name="contract_address"),
+            "positions": {contract: i for i, contract in enumerate(contracts)},
+            "codes": codes,
+            "keys": keys,
+            "cumulative": cumulative,
+            "start": start,
+            "span": span,
+            "price_seconds": price_seconds,
+            "prices": monthly.to_numpy(dtype=float),
+        }
+        return self.chains[blockchain]
+
+    def to_seconds(self, times):
+        """
+        Convert timestamps to integer seconds since the epoch in UTC.
+
+        Args:
+            times (Timestamp, DatetimeIndex or Series): The timestamps, naive
+            timestamps are taken to be UTC.
+
+        Returns:
+            int or ndarray: The seconds since the epoch.
+        """
+        if isinstance(times, pd.Series):
+            times = pd.DatetimeIndex(times)
+        if isinstance(times, pd.Timestamp):
+            if times.tzinfo is not None:
+                times = times.tz_convert("UTC").tz_localize(None)
+            return times.value // 10**9
+        if times.tz is not None:
+            times = times.tz_convert("UTC").tz_localize(None)
+        return times.asi8 // 10**9
+
+    def locate(self, chain, codes, when):
+        """
+        Find the last transfer at or before a timestamp for some contracts.
+
+        Args:
+            chain (dict): The lookup arrays of the blockchain.
+            codes (ndarray): The contract codes to look up.
+            when (str or Timestamp): The point in time.
+
+        Returns:
+            ndarray: The cumulative balance of every contract at that time.
+        """
+        offset = self.to_seconds(pd.Timestamp(when)) - chain["start"]
+        if offset < 0:
+            return np.zeros(len(codes))
+        offset = min(offset, chain["span"] - 1)
+        index = np.searchsorted(
+            chain["keys"], codes * chain["span"] + offset, side="right"
+        ) - 1
+        found = (index >= 0) & (chain["codes"][np.maximum(index, 0)] == codes)
+        return np.where(found, chain["cumulative"][np.maximum(index, 0)], 0.0)
+
+    def price_row(self, chain, when):
+        """
+        Get the latest monthly prices at or before a timestamp.
+
+        Args:
+            chain (dict): The lookup arrays of the blockchain.
+            when (str or Timestamp): The point in time.
+
+        Returns:
+            ndarray: The price of every contract, NaN if unknown.
+        """
+        row = np.searchsorted(
+            chain["price_seconds"], self.to_seconds(pd.Timestamp(when)),
+            side="right"
+        ) - 1
+        if row < 0:
+            return np.full(len(chain["contracts"]), np.nan)
+        return chain["prices"][row]
+
+    def balance(self, blockchain, contract_address, when):
+        """
+        Get the balance of one contract at a timestamp.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            contract_address (str): The contract address of the token.
+            when (str or Timestamp): The point in time.
+
+        Returns:
+            float: The token balance, 0 for unknown contracts.
+        """
+        chain = self.load(blockchain)
+        if contract_address not in chain["positions"]:
+            return 0.0
+        code = np.array([chain["positions"][contract_address]])
+        return float(self.locate(chain, code, when)[0])
+
+    def balances(self, blockchain, when):
+        """
+        Get the balance of every contract of a chain at a timestamp.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            when (str or Timestamp): The point in time.
+
+        Returns:
+            Series: The token balances indexed by contract address.
+        """
+        chain = self.load(blockchain)
+        codes = np.arange(len(chain["contracts"]))
+        return pd.Series(
+            self.locate(chain, codes, when), index=chain["contracts"],
+            name="amount"
+        )
+
+    def value(self, blockchain, contract_address, when):
+        """
+        Get the USD value of one contract at a timestamp.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            contract_address (str): The contract address of the token.
+            when (str or Timestamp): The point in time.
+
+        Returns:
+            float: The USD value, NaN if the price is unknown.
+        """
+        chain = self.load(blockchain)
+        if contract_address not in chain["positions"]:
+            return 0.0
+        code = np.array([chain["positions"][contract_address]])
+        price = self.price_row(chain, when)[code[0]]
+        return float(self.locate(chain, code, when)[0] * price)
+
+    def values(self, blockchain, when):
+        """
+        Get the USD value of every contract of a chain at a timestamp.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            when (str or Timestamp): The point in time.
+
+        Returns:
+            Series: The USD values indexed by contract address, NaN where
+            the price is unknown. Use `.sum()` for the chain total.
+        """
+        chain = self.load(blockchain)
+        codes = np.arange(len(chain["contracts"]))
+        amounts = self.locate(chain, codes, when)
+        return pd.Series(
+            amounts * self.price_row(chain, when), index=chain["contracts"],
+            name="usd_amount"
+        )
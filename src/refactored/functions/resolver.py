@@ -0,0 +1,153 @@
+"""resolver.py
+
+This script contains the RateLimiter and MetadataResolver classes, which let
+several threads share the network lookups for token metadata without
+overloading the block explorers and RPC nodes they talk to.
+
+Every lookup goes through a single MetadataResolver. Lookups are grouped by
+service (for example the shared Selenium browser or the RPC node of a chain),
+and each service has its own RateLimiter that caps both the number of requests
+in flight and the rate at which they start. Results are cached, and concurrent
+lookups of the same token wait for the first one instead of repeating it.
+
+Usage:
+    from resolver import MetadataResolver
+
+    resolver = MetadataResolver(limits={"browser": (1, 1 / 15)})
+    details = resolver.resolve(
+        "browser", ("fantom", contract_address), fetch_details
+    )
+"""
+
+import threading
+import time
+from metrics import METRICS
+from transport import TRANSPORT
+
+
+class RateLimiter:
+    """
+    Class to limit the concurrency and request rate of a service.
+
+    Attributes:
+        concurrency (int): The maximum number of requests in flight.
+        interval (float): The minimum number of seconds between two request
+        starts.
+        name (str): The service label of the recorded waits.
+    """
+
+    def __init__(self, concurrency=1, rate=None, name=None):
+        """
+        Initialize a new instance of the RateLimiter class.
+
+        Args:
+            concurrency (int): The maximum number of requests in flight.
+            rate (float, optional): The maximum number of request starts per
+            second, unlimited if None.
+            name (str, optional): The service label of the time spent
+            waiting for a slot, recorded in throttle_wait_seconds.
+        """
+        self.name = name
+        self.concurrency = concurrency
+        self.interval = 1 / rate if rate else 0.0
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+        self.next_start = 0.0
+
+    def __enter__(self):
+        waited = time.monotonic()
+        self.semaphore.acquire()
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            TRANSPORT.sleep(start - now)
+        if self.name is not None:
+            METRICS.observe(
+                "throttle_wait_seconds", max(start, now) - waited, service=self.name
+            )
+        return self
+
+    def __exit__(self, *exc):
+        self.semaphore.release()
+
+
+class MetadataResolver:
+    """
+    Class to resolve token metadata through shared, rate limited services.
+
+    Attributes:
+        DEFAULT_LIMIT (tuple): The (concurrency, rate) used for services that
+        have no explicit limit.
+        limits (dict): The (concurrency, rate) of each service.
+        cache (dict): The resolved metadata keyed by lookup key.
+    """
+
+    DEFAULT_LIMIT = (4, 5.0)
+
+    def __init__(self, limits=None):
+        """
+        Initialize a new instance of the MetadataResolver class.
+
+        Args:
+            limits (dict, optional): The (concurrency, rate) of each service.
+        """
+        self.limits = dict(limits or {})
+        self.limiters = {}
+        self.cache = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def limiter(self, service):
+        """
+        Get the RateLimiter of a service, creating it on first use.
+
+        Args:
+            service (str): The name of the service.
+
+        Returns:
+            RateLimiter: The limiter of the service.
+        """
+        with self.lock:
+            if service not in self.limiters:
+                concurrency, rate = self.limits.get(service, self.DEFAULT_LIMIT)
+                self.limiters[service] = RateLimiter(concurrency, rate, service)
+            return self.limiters[service]
+
+    def resolve(self, service, key, fetch):
+        """
+        Resolve the metadata of a token once, through the service's limiter.
+
+        Args:
+            service (str): The name of the service that performs the lookup.
+            key (tuple): The lookup key, usually (blockchain, contract).
+            fetch (callable): Function without arguments that performs the
+            lookup.
+
+        Returns:
+            object: The result of fetch, or the cached result of an earlier
+            lookup with the same key.
+        """
+        with self.lock:
+            if key in self.cache:
+                METRICS.cache("metadata", True)
+                return self.cache[key]
+            event = self.pending.get(key)
+            owner = event is None
+            if owner:
+                event = self.pending[key] = threading.Event()
+        METRICS.cache("metadata", not owner)
+        if not owner:
+            event.wait()
+            return self.cache.get(key)
+        try:
+            with self.limiter(service):
+                result = fetch()
+            with self.lock:
+                self.cache[key] = result
+            return result
+        finally:
+            with self.lock:
+                del self.pending[key]
+            event.set()
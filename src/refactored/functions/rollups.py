@@ -0,0 +1,166 @@
+"""rollups.py
+
+This script contains the Rollups class, which maintains pre-aggregated USD
+totals for dashboards next to the outputs of DataAnalysis.
+
+Three rollup tables are kept in the balance store: totals by chain x month,
+by ticker x month and by asset class x month. They are derived from a
+partials table with the USD value of every (chain, ticker, month). When a
+chain is processed again, only its partial rows are recomputed and the three
+small rollups are re-aggregated, so a dashboard load is a single Parquet read
+and never touches the balance or price files.
+
+Usage:
+    from rollups import Rollups
+
+    rollups = Rollups()
+    by_chain = rollups.query("chain")
+    stablecoins = rollups.query("asset_class", keys="stablecoin", start="2023-01")
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from balance_store import BalanceStore
+
+
+class Rollups:
+    """
+    Class to maintain and serve the dashboard rollup tables.
+
+    Attributes:
+        DIMENSIONS (list): The dimensions a rollup is kept for.
+        PARTIAL_COLUMNS (list): The columns of the partials table.
+        store (BalanceStore): The store the rollup tables are kept in.
+    """
+
+    DIMENSIONS = ["chain", "ticker", "asset_class"]
+    PARTIAL_COLUMNS = ["chain", "ticker", "asset_class", "date", "usd_amount"]
+
+    def __init__(self, store=None):
+        """
+        Initialize a new instance of the Rollups class.
+
+        Args:
+            store (BalanceStore, optional): The store to keep the rollups in,
+            the default store if None.
+        """
+        self.store = store or BalanceStore()
+
+    def partials_path(self):
+        """
+        Get the path of the partials table.
+
+        Returns:
+            str: The path of the Parquet file.
+        """
+        return os.path.join(self.store.directory, "rollup_partials.parquet")
+
+    def rollup_path(self, by):
+        """
+        Get the path of a rollup table.
+
+        Args:
+            by (str): The dimension of the rollup.
+
+        Returns:
+            str: The path of the Parquet file.
+        """
+        return os.path.join(self.store.directory, f"rollup_{by}_month.parquet")
+
+    def chain_partials(self, blockchain, months, prices, amounts, contracts):
+        """
+        Get the USD value of every ticker of a chain per month.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            months (PeriodIndex): The valued months.
+            prices (ndarray): The (month, contract) prices.
+            amounts (ndarray): The (month, contract) balances.
+            contracts (Index): The valued contract addresses.
+
+        Returns:
+            DataFrame: The partial rows of the chain.
+        """
+        # Imported here because treasury_cube imports calculations.
+        from treasury_cube import TreasuryCube
+
+        contract_dict = self.store.read_contract_dict(blockchain)
+        tickers = []
+        for contract in contracts:
+            ticker = contract_dict.get(contract, [None, None])[1]
+            tickers.append("" if pd.isna(ticker) else str(ticker).lower())
+        codes, labels = pd.factorize(tickers, sort=True)
+        sums = np.zeros((len(labels), len(months)))
+        np.add.at(sums, codes, np.nan_to_num(prices * amounts).T)
+        labels = np.asarray(labels, dtype=object)
+        return pd.DataFrame({
+            "chain": blockchain,
+            "ticker": np.repeat(labels, len(months)),
+            "asset_class": np.repeat(
+                [TreasuryCube.asset_class(label) for label in labels], len(months)
+            ),
+            "date": np.tile(np.asarray(months), len(labels)),
+            "usd_amount": sums.ravel(),
+        }, columns=self.PARTIAL_COLUMNS)
+
+    def update(self, blockchain, months, prices, amounts, contracts):
+        """
+        Replace the partial rows of a chain and rebuild the rollups.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            months (PeriodIndex): The valued months.
+            prices (ndarray): The (month, contract) prices.
+            amounts (ndarray): The (month, contract) balances.
+            contracts (Index): The valued contract addresses.
+        """
+        partials = self.chain_partials(blockchain, months, prices, amounts, contracts)
+        if os.path.exists(self.partials_path()):
+            stored = pd.read_parquet(self.partials_path())
+            stored = stored[stored["chain"].astype(str) != blockchain]
+            partials = pd.concat(
+                [stored.astype({"chain": str}), partials], ignore_index=True
+            )
+        partials = partials.assign(
+            date=pd.PeriodIndex(partials["date"], freq="M")
+        )
+        self.store.write(partials, self.partials_path())
+        for by in self.DIMENSIONS:
+            rollup = (
+                partials.groupby([by, "date"])["usd_amount"]
+                .sum()
+                .reset_index()
+            )
+            self.store.write(rollup, self.rollup_path(by))
+
+    def query(self, by, keys=None, start=None, end=None):
+        """
+        Read a rollup as a month x key table.
+
+        Args:
+            by (str): One of "chain", "ticker" or "asset_class".
+            keys (str or list, optional): The keys to return, all keys if
+            None.
+            start (str or Period, optional): The first month to return.
+            end (str or Period, optional): The last month to return.
+
+        Returns:
+            DataFrame: The USD totals indexed by month with one column per
+            key.
+
+        Raises:
+            ValueError: If the dimension is not known.
+        """
+        if by not in self.DIMENSIONS:
+            raise ValueError(f"Unknown dimension: {by}")
+        rollup = pd.read_parquet(self.rollup_path(by))
+        if keys is not None:
+            keys = [keys] if isinstance(keys, str) else list(keys)
+            rollup = rollup[rollup[by].isin(keys)]
+        table = rollup.pivot(index="date", columns=by, values="usd_amount")
+        table = table.sort_index().fillna(0)
+        return table.loc[
+            pd.Period(start, freq="M") if start is not None else None:
+            pd.Period(end, freq="M") if end is not None else None
+        ]
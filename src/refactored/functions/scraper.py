@@ -7,17 +7,31 @@ and storing the processed data for further analysis.
 
 The main functionality of the TokenData class can be accessed by creating
 an instance of the class and calling its run method.
+
+Selenium and web3 are imported when the first explorer page or RPC node is
+used, so importing this module and creating a TokenData is cheap.
+
+Resolved token details are recorded in the journal, so a restarted run does
+not look up the tokens an interrupted run already resolved.
 """
 
+import logging
 import os
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
-from selenium import webdriver
 #from selenium.webdriver.common.keys import Keys
 from dotenv import load_dotenv
-from web3 import Web3
 import json
+from token_filter import TokenClassifier
+from resolver import MetadataResolver
+from journal import JOURNAL
+from metrics import METRICS
+from transport import TRANSPORT
+from transfer_loader import TransferLoader
 
 
 INFURA_API_KEY = os.getenv("INFURA_API_KEY")
@@ -29,21 +43,49 @@ class TokenData:
 
     The TokenData class provides methods for gathering token data, calculating
     their values, and storing the processed data for further analysis.
+
+    Attributes:
+        EXPLORER_CHAINS (list): Chains whose metadata is scraped from the block
+        explorer with the shared browser.
+        RPC_CHAINS (list): Chains whose metadata is read from an Infura node.
+        SERVICE_LIMITS (dict): The (concurrency, rate) of each lookup service.
     """
 
-    def __init__(self):
+    EXPLORER_CHAINS = ["arbitrum-one", "avalanche", "binance-smart-chain", "fantom"]
+    RPC_CHAINS = ["optimistic-ethereum", "ethereum", "polygon-pos"]
+    SERVICE_LIMITS = {
+        "browser": (1, None),
+        "optimistic-ethereum": (4, 10.0),
+        "ethereum": (4, 10.0),
+        "polygon-pos": (4, 10.0),
+    }
+
+    def __init__(self, max_workers=None, chains=None, journal=None):
         """
         Initialize a new instance of the TokenData class.
 
-        This initializes a webdriver and loads the chain data from a CSV file.
+        This loads the chain data from a CSV file. The webdriver is started
+        when the first explorer page is loaded.
+
+        Args:
+            max_workers (int, optional): The number of chains processed
+            concurrently, one worker per chain if None.
+            chains (list, optional): The blockchains to process, every chain
+            of chain_info.csv if None.
+            journal (Journal, optional): The journal to record resolved
+            token details in, JOURNAL if None.
         """
         self.load_dotenv()
-        self.options = webdriver.ChromeOptions()
-        self.options.add_argument("--start-maximized")
-        self.options.add_argument("--log-level=3")
-        self.driver = webdriver.Chrome()
-        self.driver.set_window_size(1920, 1080)
+        self.driver = None
+        self.driver_lock = threading.Lock()
         self.data = pd.read_csv("chain_info.csv")
+        if chains is not None:
+            self.data = self.data[self.data["blockchain"].isin(chains)]
+        self.classifier = TokenClassifier()
+        self.resolver = MetadataResolver(self.SERVICE_LIMITS)
+        self.max_workers = max_workers
+        self.loader = TransferLoader()
+        self.journal = journal or JOURNAL
 
     def load_dotenv(self):
         """
@@ -75,6 +117,8 @@ class TokenData:
         ) as file:
             contract_abi = json.load(file)
 
+        from web3 import Web3
+
         contract = w3.eth.contract(
             address=Web3.to_checksum_address(contract_address), abi=contract_abi
         )
@@ -84,37 +128,103 @@ class TokenData:
             decimal_value = contract.functions.decimals().call()
             return token_name, token_symbol, decimal_value
         except Exception as err:
-            print("An error occurred:", str(err))
-            print(contract_address)
+            logging.warning("Token lookup of %s failed: %s", contract_address, err)
+            METRICS.increment("token_lookup_errors_total", source="rpc")
             return None
 
     def process_data(self):
         """
         Process the token data.
 
-        This method processes the token data by looping through unique contract
-        addresses, getting the token details, updating the dataframe with the
-        token details, and then calculating and filtering the data.
+        This method processes the chains concurrently with a pool of workers.
+        Metadata lookups from every worker go through the shared resolver, so
+        the block explorers and RPC nodes are never hit by more requests than
+        their limits allow.
         """
-        for _, row in self.data.iterrows():
-            blockchain, base_url = row["blockchain"], row["blockExplorerURL"]
-            print(blockchain, base_url)
-            w3 = self.get_web3(blockchain)
-            data = pd.read_csv(f"data/{blockchain}.csv")
-            data.drop(data.columns[[0]], axis=1, inplace=True)
-            contract_addresses = data["contract_address"].unique()
-            for contract_address in contract_addresses:
-                if data["ticker"].isnull().any() \
-                and data["decimal"].isnull().any():
-                    token_name, ticker, decimal = self.get_token_details(
-                        blockchain, base_url, contract_address, w3
-                    )
-                    data = self.update_data(
-                        data, contract_address, token_name, ticker, decimal
-                    )
-            data = self.calculate_values(data)
-            data = self.filter_data(data)
-            data.to_csv(f"data/{blockchain}.csv")
+        chains = [
+            (row["blockchain"], row["blockExplorerURL"])
+            for _, row in self.data.iterrows()
+        ]
+        with ThreadPoolExecutor(
+            max_workers=self.max_workers or len(chains)
+        ) as executor:
+            futures = [
+                executor.submit(self.process_chain, blockchain, base_url)
+                for blockchain, base_url in chains
+            ]
+            for future in futures:
+                future.result()
+        self.classifier.save()
+
+    def process_chain(self, blockchain, base_url):
+        """
+        Process the token data of a single blockchain.
+
+        This method loops through the contract addresses with missing token
+        details, gets the token details, updates the dataframe with them, and
+        then calculates, filters and writes the data. Details recorded in the
+        journal are used without a lookup.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            base_url (str): The base URL of the block explorer for the
+            blockchain.
+        """
+        logging.debug("Processing the tokens of %s from %s", blockchain, base_url)
+        w3 = None
+        data = self.loader.read(
+            f"data/{blockchain}.csv",
+            dtype={"token": "string", "ticker": "string", "decimal": "object"}
+        )
+        missing = data["ticker"].isnull() | data["decimal"].isnull()
+        for contract_address in data.loc[missing, "contract_address"].unique():
+            key = f"{blockchain}:{contract_address}"
+            details = self.journal.get("metadata", key)
+            if details is None:
+                service = "browser" if blockchain in self.EXPLORER_CHAINS else blockchain
+                if w3 is None and blockchain in self.RPC_CHAINS:
+                    w3 = self.get_web3(blockchain)
+                details = self.resolver.resolve(
+                    service,
+                    (blockchain, contract_address),
+                    lambda addr=contract_address: self.get_token_details(
+                        blockchain, base_url, addr, w3
+                    ),
+                )
+                if details is not None:
+                    self.journal.record("metadata", key, list(details))
+            if details is not None:
+                token_name, ticker, decimal = details
+                data = self.update_data(
+                    data, contract_address, token_name, ticker, decimal
+                )
+        data = self.calculate_values(data)
+        data = self.filter_data(data, blockchain)
+        self.write_data(data, blockchain)
+
+    def write_data(self, data, blockchain):
+        """
+        Write the token data of a blockchain atomically.
+
+        The data is written to a temporary file next to the target that then
+        replaces it, so a failed or interrupted run never leaves a partially
+        written file behind.
+
+        Args:
+            data (pd.DataFrame): The DataFrame containing the token data.
+            blockchain (str): The name of the blockchain.
+        """
+        path = f"data/{blockchain}.csv"
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w", newline="") as file:
+                data.to_csv(file)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
 
     def get_web3(self, blockchain):
         """
@@ -126,21 +236,26 @@ class TokenData:
         Returns:
             Web3: A Web3 instance used to interact with the given blockchain.
         """
+        from web3 import Web3
+
         if blockchain == "optimistic-ethereum":
             return Web3(
                 Web3.HTTPProvider(
-                    f"https://optimism-mainnet.infura.io/v3/{INFURA_API_KEY}"
+                    f"https://optimism-mainnet.infura.io/v3/{INFURA_API_KEY}",
+                    session=TRANSPORT.session()
                 )
             )
         elif blockchain == "ethereum":
             return Web3(
                 Web3.HTTPProvider(
-                    f"https://mainnet.infura.io/v3/{INFURA_API_KEY}")
+                    f"https://mainnet.infura.io/v3/{INFURA_API_KEY}",
+                    session=TRANSPORT.session())
             )
         elif blockchain == "polygon-pos":
             return Web3(
                 Web3.HTTPProvider(
-                    f"https://polygon-mainnet.infura.io/v3/{INFURA_API_KEY}"
+                    f"https://polygon-mainnet.infura.io/v3/{INFURA_API_KEY}",
+                    session=TRANSPORT.session()
                 )
             )
 
@@ -159,15 +274,55 @@ class TokenData:
             tuple: A tuple containing the token name, token symbol, and decimal
             value.
         """
-        self.driver.get(base_url + contract_address)
-        time.sleep(15)
-        if blockchain in ["arbitrum-one", "avalanche", "binance-smart-chain", "fantom"]:
-            return self.get_details_from_site()
-        elif blockchain in ["optimistic-ethereum", "ethereum", "polygon-pos"]:
+        if blockchain in self.EXPLORER_CHAINS:
+            url = base_url + contract_address
+            details = TRANSPORT.call(
+                "explorer", url, lambda: self.load_details_from_site(url)
+            )
+            return tuple(details) if details is not None else None
+        elif blockchain in self.RPC_CHAINS:
             try:
                 return self.get_token_info(contract_address, w3)
             except BaseException as err:
-                print("An error occurred:", str(err))
+                logging.warning(
+                    "Token lookup of %s on %s failed: %s", contract_address, blockchain, err
+                )
+                METRICS.increment("token_lookup_errors_total", source="rpc")
+
+    def get_driver(self):
+        """
+        Get the shared webdriver, starting it on first use.
+
+        Returns:
+            WebDriver: The webdriver.
+        """
+        with self.driver_lock:
+            if self.driver is None:
+                from selenium import webdriver
+
+                options = webdriver.ChromeOptions()
+                options.add_argument("--start-maximized")
+                options.add_argument("--log-level=3")
+                self.driver = webdriver.Chrome(options=options)
+                self.driver.set_window_size(1920, 1080)
+            return self.driver
+
+    def load_details_from_site(self, url):
+        """
+        Load a block explorer page and get the token details from it.
+
+        Args:
+            url (str): The URL of the token page.
+
+        Returns:
+            list: The token name, token symbol, and decimal value.
+        """
+        host, _ = METRICS.endpoint(url)
+        with METRICS.timer("browser_load_seconds", host=host):
+            self.get_driver().get(url)
+        with METRICS.timer("sleep_seconds", reason="explorer_render"):
+            time.sleep(15)
+        return list(self.get_details_from_site())
 
     def get_details_from_site(self):
         """
@@ -227,30 +382,22 @@ class TokenData:
         data["calc_value"] = (data["value"] * pow(10, -data["decimal"])).astype(float)
         return data
 
-    def filter_data(self, data):
+    def filter_data(self, data, blockchain):
         """
         Filter the token data.
 
-        This method filters out rows from the DataFrame that contain certain
-        strings in the 'ticker' and 'token' columns.
+        This method drops the rows of tokens that the TokenClassifier marks as
+        spam. Each distinct contract is classified once and the verdict is
+        cached, so the rows are dropped with a lookup on the contract code.
 
         Args:
             data (pd.DataFrame): The DataFrame containing the token data.
+            blockchain (str): The name of the blockchain.
 
         Returns:
             pd.DataFrame: The filtered DataFrame.
         """
-        data = data[
-            ~data["ticker"].str.contains(
-                "N/A|Visit|.com|.fi|.io|.xyz|.site|.exchange|.pro|.net"
-            )
-        ]
-        data = data[
-            ~data["token"].str.contains(
-                ".org|.com|.fi|.io|.org|.xyz|.site|.exchange|.pro|.net"
-            )
-        ]
-        return data
+        return self.classifier.filter(data, blockchain)
 
     def run(self):
         """
@@ -259,7 +406,10 @@ class TokenData:
         This method is the main entry point for the TokenData class. It calls
         the other methods to gather and process the data, calculate the token
         values, and then stores the processed data for further analysis.
+        The journal is cleared once every chain is written.
         """
         self.process_data()
-        self.driver.close()
-        self.driver.quit()
+        self.journal.clear("metadata")
+        if self.driver is not None:
+            self.driver.close()
+            self.driver.quit()
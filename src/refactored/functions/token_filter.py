@@ -0,0 +1,234 @@
+"""token_filter.py
+
+This script contains the TokenClassifier class, which decides whether a token
+seen in the treasury transfers is a spam or airdrop token that should be
+dropped before any balances are calculated.
+
+Spam tokens usually advertise a website in their name or ticker (for example
+"Visit xyz.com to claim"). The classifier matches those names with
+precompiled, escaped patterns and also honours explicit allow and deny lists
+of contract addresses, which take precedence over the patterns. The lists are
+read from `data/summary_info/token_lists.csv`, with the columns
+`contract_address` and `list` ("allow" or "deny"). The pattern
+verdict of each distinct contract is computed once and persisted to a CSV
+file, so later runs only match the names of new contracts. Rows without a
+contract address are matched on their own name and ticker.
+
+Usage:
+    from token_filter import TokenClassifier
+
+    classifier = TokenClassifier()
+    data = classifier.filter(data, "ethereum")
+    classifier.save()
+"""
+
+import os
+import re
+import numpy as np
+import pandas as pd
+
+
+class TokenClassifier:
+    """
+    Class to classify tokens as spam and filter them out of transfer data.
+
+    Attributes:
+        DOMAINS (tuple): Top level domains that mark a token name as spam.
+        TICKER_PATTERN (Pattern): Compiled pattern applied to tickers.
+        TOKEN_PATTERN (Pattern): Compiled pattern applied to token names.
+        verdict_file (str): File path where the verdicts are persisted.
+        list_file (str): File path of the allow and deny lists.
+        allow (set): Contract addresses that are never dropped.
+        deny (set): Contract addresses that are always dropped.
+        verdicts (dict): Cached pattern verdicts keyed by (blockchain,
+        contract).
+    """
+
+    DOMAINS = ("com", "fi", "io", "org", "xyz", "site", "exchange", "pro", "net")
+    _DOMAIN_RE = r"\.(?:" + "|".join(re.escape(d) for d in DOMAINS) + r")\b"
+    TICKER_PATTERN = re.compile(r"^N/A$|\bVisit\b|" + _DOMAIN_RE, re.IGNORECASE)
+    TOKEN_PATTERN = re.compile(_DOMAIN_RE, re.IGNORECASE)
+
+    def __init__(
+        self,
+        verdict_file="data/summary_info/token_verdicts.csv",
+        list_file="data/summary_info/token_lists.csv"
+    ):
+        """
+        Initialize a new instance of the TokenClassifier class.
+
+        Args:
+            verdict_file (str): File path where the verdicts are persisted.
+            list_file (str): File path of the allow and deny lists, which
+            may not exist.
+        """
+        self.verdict_file = verdict_file
+        self.list_file = list_file
+        self.allow, self.deny = self.load_lists()
+        self.verdicts = self.load()
+
+    def load_lists(self):
+        """
+        Load the allow and deny lists from the list file.
+
+        Returns:
+            tuple: The lower case contract addresses that are allowed and
+            the ones that are denied, both empty if there is no list file.
+
+        Raises:
+            ValueError: If a list is neither "allow" nor "deny".
+        """
+        if not os.path.exists(self.list_file):
+            return set(), set()
+        lists = pd.read_csv(self.list_file, dtype=str).dropna()
+        lists["list"] = lists["list"].str.strip().str.lower()
+        unknown = set(lists["list"]) - {"allow", "deny"}
+        if unknown:
+            raise ValueError(f"Unknown token lists in {self.list_file}: {sorted(unknown)}")
+        addresses = lists["contract_address"].str.strip().str.lower()
+        return (
+            set(addresses[lists["list"] == "allow"]),
+            set(addresses[lists["list"] == "deny"]),
+        )
+
+    def load(self):
+        """
+        Load the persisted verdicts from the verdict file.
+
+        Returns:
+            dict: The verdicts keyed by (blockchain, contract_address).
+        """
+        if not os.path.exists(self.verdict_file):
+            return {}
+        verdicts = pd.read_csv(self.verdict_file, dtype={"spam": bool})
+        keys = zip(verdicts["blockchain"], verdicts["contract_address"])
+        return dict(zip(keys, verdicts["spam"]))
+
+    def save(self):
+        """
+        Persist the cached verdicts to the verdict file.
+        """
+        rows = [
+            (blockchain, contract, spam)
+            for (blockchain, contract), spam in self.verdicts.items()
+        ]
+        verdicts = pd.DataFrame(
+            rows, columns=["blockchain", "contract_address", "spam"]
+        )
+        verdicts.sort_values(["blockchain", "contract_address"]).to_csv(
+            self.verdict_file, index=False
+        )
+
+    def is_spam(self, contract_address, ticker, token):
+        """
+        Classify a single token.
+
+        Args:
+            contract_address (str): The contract address of the token.
+            ticker (str): The ticker symbol of the token.
+            token (str): The name of the token.
+
+        Returns:
+            bool: True if the token is spam, False otherwise.
+        """
+        listed = self.listed(contract_address)
+        if listed is not None:
+            return listed
+        return self.matches(ticker, token)
+
+    def listed(self, contract_address):
+        """
+        Look a contract up in the allow and deny sets.
+
+        Args:
+            contract_address (str): The contract address of the token, or a
+            missing value.
+
+        Returns:
+            bool: False if the contract is allowed, True if it is denied,
+            None if it is in neither set.
+        """
+        if not isinstance(contract_address, str):
+            return None
+        contract_address = contract_address.lower()
+        if contract_address in self.allow:
+            return False
+        if contract_address in self.deny:
+            return True
+        return None
+
+    def matches(self, ticker, token):
+        """
+        Match the ticker and name of a token against the spam patterns.
+
+        Args:
+            ticker (str): The ticker symbol of the token.
+            token (str): The name of the token.
+
+        Returns:
+            bool: True if the ticker or the name looks like spam.
+        """
+        if isinstance(ticker, str) and self.TICKER_PATTERN.search(ticker):
+            return True
+        if isinstance(token, str) and self.TOKEN_PATTERN.search(token):
+            return True
+        return False
+
+    def classify(self, data, blockchain):
+        """
+        Classify every distinct contract in the data.
+
+        The allow and deny sets are checked first, the cached pattern
+        verdict is only used for contracts in neither set. Rows without a
+        contract address are left out.
+
+        Args:
+            data (pd.DataFrame): The DataFrame containing the token data.
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            dict: The verdicts of the contracts in the data.
+        """
+        tokens = data[["contract_address", "ticker", "token"]].dropna(
+            subset=["contract_address"]
+        ).drop_duplicates("contract_address")
+        result = {}
+        for contract, ticker, token in tokens.itertuples(index=False):
+            listed = self.listed(contract)
+            if listed is not None:
+                result[contract] = listed
+                continue
+            key = (blockchain, contract)
+            if key not in self.verdicts:
+                self.verdicts[key] = self.matches(ticker, token)
+            result[contract] = self.verdicts[key]
+        return result
+
+    def filter(self, data, blockchain):
+        """
+        Drop the rows of spam tokens from the data.
+
+        Rows without a contract address are matched on their own ticker and
+        name.
+
+        Args:
+            data (pd.DataFrame): The DataFrame containing the token data.
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            pd.DataFrame: The filtered DataFrame.
+        """
+        codes, contracts = pd.factorize(data["contract_address"])
+        verdicts = self.classify(data, blockchain)
+        spam = np.array([verdicts[c] for c in contracts], dtype=bool)
+        drop = np.zeros(len(data), dtype=bool)
+        known = codes >= 0
+        drop[known] = spam[codes[known]]
+        if not known.all():
+            drop[~known] = [
+                self.matches(ticker, token)
+                for ticker, token in data.loc[~known, ["ticker", "token"]].itertuples(
+                    index=False
+                )
+            ]
+        return data[~drop]
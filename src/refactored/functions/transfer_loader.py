@@ -0,0 +1,128 @@
+"""transfer_loader.py
+
+This script contains the TransferLoader class, the shared reader for the
+transfer CSV files used throughout the pipeline: the Dune results in
+`data/<queryID>.csv` and the processed `data/<blockchain>.csv` files.
+
+Read with default settings, every address, ticker and category in those files
+becomes a Python object string and `time` stays a string. The loader passes
+explicit `usecols` and `dtype` to the CSV reader instead: the repeated string
+columns are read as `category`, the amounts as float64 and `time` is parsed
+once to a UTC datetime64 column. The unnamed index column written by earlier
+stages is skipped.
+
+Usage:
+    from transfer_loader import TransferLoader
+
+    loader = TransferLoader()
+    data = loader.read("data/ethereum.csv")
+    for chunk in loader.read_chunks("data/ethereum.csv", 100_000):
+        ...
+"""
+
+import pandas as pd
+
+
+class TransferLoader:
+    """
+    Class to read transfer CSV files with memory-lean dtypes.
+
+    Attributes:
+        DTYPES (dict): The dtype of every known transfer column.
+        TIME_FORMAT (str): The timestamp format of the Dune results.
+    """
+
+    DTYPES = {
+        "blockchain": "category",
+        "category": "category",
+        "contract_address": "category",
+        "from": "category",
+        "to": "category",
+        "token": "category",
+        "ticker": "category",
+        "value": "float64",
+        "decimal": "float64",
+        "decimals": "float64",
+        "calc_value": "float64",
+    }
+    TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f UTC"
+
+    def read(self, path, columns=None, dtype=None):
+        """
+        Read a transfer CSV file.
+
+        Args:
+            path (str): The path of the CSV file.
+            columns (list, optional): The columns to read, every known column
+            present in the file if None.
+            dtype (dict, optional): Dtypes that override DTYPES, for example
+            "string" for columns that are written to later.
+
+        Returns:
+            DataFrame: The transfers with typed columns and a parsed `time`.
+        """
+        data = pd.read_csv(path, **self.read_options(path, columns, dtype))
+        if "time" in data.columns:
+            data["time"] = self.parse_times(data["time"])
+        return data
+
+    def read_chunks(self, path, chunksize, columns=None, dtype=None):
+        """
+        Read a transfer CSV file in chunks.
+
+        Args:
+            path (str): The path of the CSV file.
+            chunksize (int): The number of rows per chunk.
+            columns (list, optional): The columns to read, every known column
+            present in the file if None.
+            dtype (dict, optional): Dtypes that override DTYPES.
+
+        Yields:
+            DataFrame: The transfers of each chunk, typed like read.
+        """
+        options = self.read_options(path, columns, dtype)
+        with pd.read_csv(path, chunksize=chunksize, **options) as reader:
+            for chunk in reader:
+                if "time" in chunk.columns:
+                    chunk["time"] = self.parse_times(chunk["time"])
+                yield chunk
+
+    def read_options(self, path, columns=None, dtype=None):
+        """
+        Get the `usecols` and `dtype` arguments of the CSV reader for a file.
+
+        Args:
+            path (str): The path of the CSV file.
+            columns (list, optional): The columns to read, every known column
+            present in the file if None.
+            dtype (dict, optional): Dtypes that override DTYPES.
+
+        Returns:
+            dict: The keyword arguments for `pd.read_csv`.
+        """
+        dtypes = {**self.DTYPES, **(dtype or {})}
+        wanted = set(columns) if columns is not None else set(dtypes) | {"time"}
+        header = pd.read_csv(path, nrows=0).columns
+        usecols = [column for column in header if column in wanted]
+        return {
+            "usecols": usecols,
+            "dtype": {column: dtypes[column] for column in usecols if column in dtypes},
+        }
+
+    def parse_times(self, times):
+        """
+        Parse transfer timestamps to UTC datetime64.
+
+        The Dune format is tried first because an explicit format is much
+        faster to parse. Files rewritten by pandas use ISO 8601 instead.
+
+        Args:
+            times (Series): The timestamp strings.
+
+        Returns:
+            Series: The timestamps as datetime64[ns, UTC].
+        """
+        try:
+            return pd.to_datetime(times, format=self.TIME_FORMAT, utc=True)
+        except ValueError:
+            return pd.to_datetime(times, format="ISO8601", utc=True)
@@ -0,0 +1,202 @@
+"""transfer_valuation.py
+
+This script contains the TransferValuation class, which values every transfer
+at the USD price of its own execution time and sums the realized inflows and
+outflows per month.
+
+DataAnalysis only values the balances at the end of each month, and the
+`price_usd` column of its cleaned transfers stays empty. Here the transfers of
+a chain are joined to the nearest prior price of their contract with one
+sorted `merge_asof` over the daily price table of the balance store. Chains
+without daily prices fall back to the month-end prices of the price
+workbook. The prices of a chain are loaded once and cached.
+
+Usage:
+    from transfer_valuation import TransferValuation
+
+    valuation = TransferValuation()
+    valued = valuation.value_transfers("ethereum")
+    flows = valuation.monthly_flows(valued)
+    valuation.run()
+"""
+
+import os
+import pandas as pd
+from calculations import DataAnalysis
+from metrics import METRICS
+
+
+class TransferValuation:
+    """
+    Class to value transfers at their execution-time price.
+
+    Attributes:
+        analysis (DataAnalysis): The analysis used to load the transfers and
+        the monthly prices.
+        store (BalanceStore): The store the daily prices are read from and
+        the valued transfers are written to.
+        prices_file (str): File path of the monthly price workbook.
+        chain_file (str): File path of the chain info CSV file.
+        prices (dict): The loaded price tables keyed by blockchain.
+    """
+
+    def __init__(
+        self,
+        analysis=None,
+        prices_file="data/monthly_prices_full.xlsx",
+        chain_file="chain_info.csv"
+    ):
+        """
+        Initialize a new instance of the TransferValuation class.
+
+        Args:
+            analysis (DataAnalysis, optional): The analysis used to load the
+            data, a default DataAnalysis if None.
+            prices_file (str): File path of the monthly price workbook.
+            chain_file (str): File path of the chain info CSV file.
+        """
+        self.analysis = analysis or DataAnalysis()
+        self.store = self.analysis.store
+        self.prices_file = prices_file
+        self.chain_file = chain_file
+        self.excel_file = None
+        self.prices = {}
+
+    def load_prices(self, blockchain):
+        """
+        Load the price history of a blockchain, once.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            DataFrame: The contract_address, time and price rows sorted by
+            time, without missing prices.
+        """
+        METRICS.cache("prices", blockchain in self.prices)
+        if blockchain in self.prices:
+            return self.prices[blockchain]
+        prices = self.store.read_prices(blockchain)
+        if prices is None:
+            prices = self.load_monthly_prices(blockchain)
+        prices = pd.DataFrame({
+            "contract_address": prices["contract_address"].astype(str),
+            "time": pd.to_datetime(prices["time"], utc=True),
+            "price": prices["price"].astype(float),
+        }).dropna(subset=["price"])
+        self.prices[blockchain] = prices.sort_values("time", kind="stable")
+        return self.prices[blockchain]
+
+    def load_monthly_prices(self, blockchain):
+        """
+        Load the month-end prices of a blockchain from the price workbook.
+
+        Each price is dated at the start of the last day of its month, so a
+        transfer only picks it up from that day on.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+
+        Returns:
+            DataFrame: The contract_address, time and price rows.
+        """
+        if self.excel_file is None:
+            self.excel_file = pd.ExcelFile(self.prices_file)
+        monthly = self.analysis.load_monthly_data(self.excel_file, blockchain)
+        monthly.index = monthly.index.to_timestamp(how="end").normalize()
+        return monthly.rename_axis(
+            index="time", columns="contract_address"
+        ).stack().rename("price").reset_index()
+
+    def value_transfers(self, blockchain, data=None):
+        """
+        Value every transfer of a blockchain at its nearest prior price.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            data (DataFrame, optional): The already loaded transfers, loaded
+            from `data/<blockchain>.csv` if None.
+
+        Returns:
+            DataFrame: The transfers sorted by time with their signed amount,
+            price_usd and usd_value. Both are NaN when the contract has no
+            price at or before the transfer.
+        """
+        if data is None:
+            data = self.analysis.load_data(blockchain)
+        transfers = pd.DataFrame({
+            "time": pd.to_datetime(data["time"], utc=True),
+            "contract_address": data["contract_address"].astype(str),
+            "token": data["token"],
+            "ticker": data["ticker"],
+            "category": data["category"],
+            "amount": data["calc_value"].astype(float).where(
+                data["category"] != "from", -data["calc_value"].astype(float)
+            ),
+        })
+        valued = pd.merge_asof(
+            transfers.sort_values("time", kind="stable"),
+            self.load_prices(blockchain).rename(columns={"price": "price_usd"}),
+            on="time",
+            by="contract_address",
+            direction="backward",
+        )
+        valued["usd_value"] = valued["amount"] * valued["price_usd"]
+        return valued
+
+    def monthly_flows(self, valued):
+        """
+        Sum the realized USD inflows and outflows of valued transfers per
+        month.
+
+        Args:
+            valued (DataFrame): The valued transfers.
+
+        Returns:
+            DataFrame: The inflow_usd, outflow_usd and net_usd of every month,
+            and the number of transfers without a price.
+        """
+        months = valued["time"].dt.tz_localize(None).dt.to_period("M")
+        usd_value = valued["usd_value"]
+        flows = pd.DataFrame({
+            "inflow_usd": usd_value.clip(lower=0),
+            "outflow_usd": (-usd_value).clip(lower=0),
+            "net_usd": usd_value,
+            "unpriced": usd_value.isna(),
+        }).groupby(months.rename("date")).sum()
+        return flows.astype({"unpriced": "int64"})
+
+    def run(self):
+        """
+        Value the transfers of every chain and write the monthly flows.
+
+        The valued transfers are written to the balance store, the flows to
+        `data/<blockchain>_flows.csv` per chain and summed over all chains
+        to `flows.csv`. When the analysis is limited to some chains, the
+        flows of the other chains are read from their files.
+
+        Raises:
+            FileNotFoundError: If a chain that is not valued has no
+            `data/<blockchain>_flows.csv` file.
+        """
+        self.analysis.check_other_chains("_flows.csv", self.chain_file)
+        frames = []
+        chains = self.analysis.chains
+        for blockchain in pd.read_csv(self.chain_file)["blockchain"]:
+            path = f"data/{blockchain}_flows.csv"
+            if chains is not None and blockchain not in chains:
+                flows = pd.read_csv(path, index_col="date")
+                flows.index = pd.PeriodIndex(flows.index, freq="M")
+                frames.append(flows)
+                continue
+            valued = self.value_transfers(blockchain)
+            self.store.write(
+                valued,
+                os.path.join(
+                    self.store.directory, f"{blockchain}_transfer_values.parquet"
+                ),
+            )
+            flows = self.monthly_flows(valued)
+            flows.to_csv(path)
+            frames.append(flows)
+        pd.concat(frames).groupby("date").sum().to_csv("flows.csv")
@@ -0,0 +1,393 @@
+"""transport.py
+
+This script contains the Transport class, which records the outbound traffic
+of a run and replays it, and TRANSPORT, the instance the other modules send
+their requests through.
+
+Dune, CoinGecko and the Infura RPC nodes are called through request() or a
+session from session(), and the block explorer lookups through call(). The
+transport has three modes:
+
+    live    requests go to the network, nothing is stored (the default)
+    record  requests go to the network and the responses are stored
+    replay  the stored responses are served, the network is never used
+
+Responses are stored gzip-compressed, one file per normalized request: the
+method, the URL without API keys, the sorted query parameters and the body
+without its JSON-RPC id. Request headers are never part of the key, so the
+recordings do not contain the API keys. A request that returns different
+responses over time, like the status of a Dune execution, is stored as the
+sequence it was seen in and replayed in the same order. In replay mode the
+rate limiter waits and the fixed sleeps are skipped as well, so a full run
+takes only the time of its computations.
+
+The mode and the directory are read from the TWA_HTTP_MODE and
+TWA_HTTP_RECORDINGS environment variables.
+
+Usage:
+    TWA_HTTP_MODE=record python main.py
+    TWA_HTTP_MODE=replay python main.py
+
+    from transport import TRANSPORT
+
+    TRANSPORT.configure("replay", "data/http_recordings")
+    response = TRANSPORT.request("GET", url, params=params)
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlparse
+import requests
+from requests.structures import CaseInsensitiveDict
+from metrics import METRICS
+
+
+class Transport:
+    """
+    Class to send requests live, record them or replay them.
+
+    Attributes:
+        MODES (list): The supported modes.
+        SECRET_PARAMS (set): Query parameters left out of the request keys.
+        SECRET_PATHS (Pattern): URL path parts that hold API keys, replaced
+        in the request keys.
+        mode (str): The current mode.
+        directory (str): The directory the recordings are kept in.
+        recorded (dict): The responses stored during this run, keyed by
+        recording file.
+        loaded (dict): The recordings read for replay, keyed by recording
+        file.
+        replayed (dict): The number of responses served so far, keyed by
+        recording file.
+    """
+
+    MODES = ["live", "record", "replay"]
+    SECRET_PARAMS = {"api_key", "apikey", "x_cg_pro_api_key", "x_cg_demo_api_key"}
+    SECRET_PATHS = re.compile(r"/v3/[0-9a-fA-F]{32}")
+
+    def __init__(self, mode="live", directory="data/http_recordings"):
+        """
+        Initialize a new instance of the Transport class.
+
+        Args:
+            mode (str): "live", "record" or "replay".
+            directory (str): The directory the recordings are kept in.
+        """
+        self.lock = threading.Lock()
+        self.configure(mode, directory)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create a transport configured by the environment.
+
+        Returns:
+            Transport: The transport in the TWA_HTTP_MODE mode, recording to
+            TWA_HTTP_RECORDINGS.
+        """
+        return cls(
+            os.getenv("TWA_HTTP_MODE", "live"),
+            os.getenv("TWA_HTTP_RECORDINGS", "data/http_recordings"),
+        )
+
+    def configure(self, mode, directory=None):
+        """
+        Switch the mode and forget what was recorded and replayed.
+
+        Args:
+            mode (str): "live", "record" or "replay".
+            directory (str, optional): The directory the recordings are kept
+            in, unchanged if None.
+
+        Raises:
+            ValueError: If the mode is not known.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown transport mode: {mode}")
+        with self.lock:
+            self.mode = mode
+            if directory is not None:
+                self.directory = directory
+            self.recorded = {}
+            self.loaded = {}
+            self.replayed = {}
+
+    @property
+    def replaying(self):
+        """
+        bool: Whether responses are served from the recordings.
+        """
+        return self.mode == "replay"
+
+    def sleep(self, seconds):
+        """
+        Sleep, unless the responses are replayed.
+
+        Args:
+            seconds (float): The number of seconds.
+        """
+        if not self.replaying and seconds > 0:
+            time.sleep(seconds)
+
+    def request_key(self, method, url, params=None, data=None, json_body=None):
+        """
+        Get the normalized key of a request.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL.
+            params (dict, optional): The query parameters.
+            data (bytes or str, optional): The body.
+            json_body (object, optional): The JSON body.
+
+        Returns:
+            str: The method, URL, sorted query and body of the request,
+            without API keys and JSON-RPC ids.
+        """
+        parsed = urlparse(url)
+        query = parse_qsl(parsed.query) + list((params or {}).items())
+        query = sorted(
+            (str(k), str(v)) for k, v in query if k.lower() not in self.SECRET_PARAMS
+        )
+        path = self.SECRET_PATHS.sub("/v3/{key}", parsed.path)
+        body = json_body
+        if body is None and data:
+            try:
+                body = json.loads(data)
+            except (TypeError, ValueError):
+                body = data.decode() if isinstance(data, bytes) else str(data)
+        if isinstance(body, dict):
+            body = {k: v for k, v in body.items() if k != "id"}
+        return json.dumps([
+            method.upper(),
+            f"{parsed.scheme}://{parsed.netloc}{path}",
+            urlencode(query),
+            body,
+        ], sort_keys=True)
+
+    def path(self, kind, key):
+        """
+        Get the file of a recording.
+
+        Args:
+            kind (str): "http" or the name of a call().
+            key (str): The request key.
+
+        Returns:
+            str: The path of the gzip-compressed JSON file.
+        """
+        digest = hashlib.sha256(key.encode()).hexdigest()[:32]
+        return os.path.join(self.directory, kind, f"{digest}.json.gz")
+
+    def store(self, kind, key, entry):
+        """
+        Add a response to the recording of a request.
+
+        The first response of a request in a run replaces what was recorded
+        before, later ones are added to the sequence.
+
+        Args:
+            kind (str): "http" or the name of a call().
+            key (str): The request key.
+            entry (dict): The JSON serializable response.
+        """
+        path = self.path(kind, key)
+        with self.lock:
+            entries = self.recorded.setdefault(path, [])
+            entries.append(entry)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as file:
+                json.dump({"key": key, "responses": entries}, file)
+            os.replace(tmp_path, path)
+
+    def load(self, kind, key):
+        """
+        Get the next recorded response of a request.
+
+        The last response of a sequence is served again once the sequence
+        is used up.
+
+        Args:
+            kind (str): "http" or the name of a call().
+            key (str): The request key.
+
+        Returns:
+            dict: The recorded response.
+
+        Raises:
+            LookupError: If the request was not recorded.
+        """
+        path = self.path(kind, key)
+        with self.lock:
+            if path not in self.loaded:
+                if not os.path.exists(path):
+                    METRICS.cache("replay", False)
+                    raise LookupError(f"No recorded response for {key}")
+                with gzip.open(path, "rt", encoding="utf-8") as file:
+                    self.loaded[path] = json.load(file)["responses"]
+            entries = self.loaded[path]
+            index = self.replayed.get(path, 0)
+            self.replayed[path] = index + 1
+        METRICS.cache("replay", True)
+        return entries[min(index, len(entries) - 1)]
+
+    def request(self, method, url, send=None, **kwargs):
+        """
+        Send a request through the transport.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL.
+            send (callable, optional): Function without arguments that sends
+            the request live, METRICS.request with the same arguments if
+            None.
+            **kwargs: The keyword arguments of requests.request.
+
+        Returns:
+            Response: The live or the replayed response.
+
+        Raises:
+            LookupError: If the request is replayed but was not recorded.
+        """
+        key = self.request_key(
+            method, url, kwargs.get("params"), kwargs.get("data"), kwargs.get("json")
+        )
+        if self.replaying:
+            return self.build_response(method, url, kwargs, self.load("http", key))
+        if send is None:
+            response = METRICS.request(method, url, **kwargs)
+        else:
+            response = send()
+        if self.mode == "record":
+            self.store("http", key, {
+                "status": response.status_code,
+                "reason": response.reason,
+                "headers": {
+                    "Content-Type": response.headers.get("Content-Type", "")
+                },
+                "body": base64.b64encode(response.content).decode("ascii"),
+            })
+        return response
+
+    def build_response(self, method, url, kwargs, entry):
+        """
+        Build a response from a recording.
+
+        The id of a JSON-RPC response is set to the id of the request, as
+        ids are not part of the request key.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL.
+            kwargs (dict): The keyword arguments of the request.
+            entry (dict): The recorded response.
+
+        Returns:
+            Response: The response.
+        """
+        body = base64.b64decode(entry["body"])
+        request_body = kwargs.get("json")
+        if request_body is None and kwargs.get("data"):
+            try:
+                request_body = json.loads(kwargs["data"])
+            except (TypeError, ValueError):
+                request_body = None
+        if isinstance(request_body, dict) and "id" in request_body:
+            payload = json.loads(body)
+            payload["id"] = request_body["id"]
+            body = json.dumps(payload).encode()
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = entry.get("reason")
+        response.headers = CaseInsensitiveDict(entry.get("headers", {}))
+        response.url = requests.Request(
+            method, url, params=kwargs.get("params")
+        ).prepare().url
+        response.encoding = "utf-8"
+        response._content = body
+        return response
+
+    def call(self, kind, key, fetch):
+        """
+        Run a lookup that is not a plain HTTP request through the transport,
+        such as a page scraped with the browser.
+
+        Args:
+            kind (str): The name of the lookup.
+            key (str): The key of the lookup, for example the page URL.
+            fetch (callable): Function without arguments that performs the
+            lookup and returns a JSON serializable result.
+
+        Returns:
+            object: The live or the replayed result.
+
+        Raises:
+            LookupError: If the lookup is replayed but was not recorded.
+        """
+        if self.replaying:
+            return self.load(kind, key)["result"]
+        result = fetch()
+        if self.mode == "record":
+            self.store(kind, key, {"result": result})
+        return result
+
+    def session(self):
+        """
+        Get a requests session that sends through the transport, for clients
+        that take a session such as the web3 HTTPProvider.
+
+        Returns:
+            Session: The session. Its live responses are recorded in the
+            metrics.
+        """
+        session = TransportSession(self)
+        session.hooks["response"].append(METRICS.record_response)
+        return session
+
+
+class TransportSession(requests.Session):
+    """
+    Class of the requests sessions that send through a Transport.
+
+    Attributes:
+        transport (Transport): The transport.
+    """
+
+    def __init__(self, transport):
+        """
+        Initialize a new instance of the TransportSession class.
+
+        Args:
+            transport (Transport): The transport to send through.
+        """
+        super().__init__()
+        self.transport = transport
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the transport instead of straight to the
+        network.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL.
+            **kwargs: The keyword arguments of requests.Session.request.
+
+        Returns:
+            Response: The live or the replayed response.
+        """
+        return self.transport.request(
+            method, url,
+            send=lambda: super(TransportSession, self).request(method, url, **kwargs),
+            **kwargs
+        )
+
+
+TRANSPORT = Transport.from_env()
@@ -0,0 +1,272 @@
+"""treasury_cube.py
+
+This script contains the TreasuryCube class, which holds the balances and
+prices of every chain in one aligned in-memory array so cross-chain questions
+can be answered without reloading any files.
+
+The cube is built once from the balance store, the monthly price workbook and
+the token tables. It keeps dense (chain, contract, period) arrays of amounts,
+prices and USD values with categorical indexes for the chain and contract
+dimensions, plus the ticker and asset class of every (chain, contract) pair.
+Slice and sum queries are vectorized reductions over those arrays.
+
+Usage:
+    from treasury_cube import TreasuryCube
+
+    cube = TreasuryCube()
+    by_chain = cube.sum(by="chain")
+    stablecoins = cube.sum(asset_class="stablecoin")
+    usdc_amounts = cube.sum(by="chain", measure="amount", ticker="usdc")
+"""
+
+import re
+import numpy as np
+import pandas as pd
+from balance_store import BalanceStore
+from calculations import DataAnalysis
+
+
+class TreasuryCube:
+    """
+    Class to hold the treasury balances of every chain in an aligned array.
+
+    Attributes:
+        STABLECOINS (set): Lower case tickers of USD stablecoins.
+        ETH_TICKERS (set): Lower case tickers of ETH and its wrappers.
+        BTC_TICKERS (set): Lower case tickers of BTC wrappers.
+        LP_PATTERN (Pattern): Matches tickers with an "lp" token, like
+        "3nrv-lp", but not tickers that merely contain the letters, like
+        "slp".
+        chains (CategoricalIndex): The chain dimension.
+        contracts (CategoricalIndex): The contract dimension.
+        periods (PeriodIndex): The monthly period dimension.
+        amounts (ndarray): The token balances, shaped (chain, contract,
+        period).
+        prices (ndarray): The USD prices, NaN where unknown, shaped like
+        amounts.
+        usd (ndarray): The USD values, 0 where the price is unknown.
+        tickers (ndarray): The ticker of every (chain, contract) pair.
+        asset_classes (ndarray): The asset class of every (chain, contract)
+        pair.
+        held (ndarray): Whether a (chain, contract) pair is held at all.
+    """
+
+    STABLECOINS = {
+        "usdc", "usdt", "dai", "busd", "frax", "nusd", "usdc.e", "usdt.e",
+        "dai.e", "mim", "lusd", "tusd", "usdb", "usd+", "usdbc", "fusdt",
+    }
+    ETH_TICKERS = {"eth", "weth", "neth", "weth.e"}
+    BTC_TICKERS = {"wbtc", "btc.b", "btcb", "wbtc.e"}
+    LP_PATTERN = re.compile(r"(^|[-_ ])lp($|[-_ ])")
+
+    def __init__(
+        self,
+        store=None,
+        prices_file="data/monthly_prices_full.xlsx",
+        chain_file="chain_info.csv"
+    ):
+        """
+        Initialize a new instance of the TreasuryCube class.
+
+        Args:
+            store (BalanceStore, optional): The balance store to read the
+            balances and tokens from, the default store if None.
+            prices_file (str): File path of the monthly price workbook.
+            chain_file (str): File path of the chain info CSV file.
+        """
+        self.store = store or BalanceStore()
+        self.analysis = DataAnalysis(store=self.store)
+        self.build(prices_file, chain_file)
+
+    def build(self, prices_file, chain_file):
+        """
+        Load the balances, prices and tokens of every chain into the cube.
+
+        Args:
+            prices_file (str): File path of the monthly price workbook.
+            chain_file (str): File path of the chain info CSV file.
+        """
+        chains = list(pd.read_csv(chain_file)["blockchain"])
+        balances = {chain: self.analysis.load_chain_data(chain) for chain in chains}
+        excel_file = pd.ExcelFile(prices_file)
+        prices = {
+            chain: self.analysis.load_monthly_data(excel_file, chain)
+            for chain in chains
+            if chain in excel_file.sheet_names
+        }
+
+        contracts = sorted(set().union(*(b.columns for b in balances.values())))
+        periods = pd.PeriodIndex(
+            sorted(set().union(*(b.index for b in balances.values()))), freq="M"
+        )
+        self.chains = pd.CategoricalIndex(chains, categories=chains, name="chain")
+        self.contracts = pd.CategoricalIndex(
+            contracts, categories=contracts, name="contract_address"
+        )
+        self.periods = periods.rename("date")
+
+        shape = (len(chains), len(contracts), len(periods))
+        self.amounts = np.zeros(shape)
+        self.prices = np.full(shape, np.nan)
+        for i, chain in enumerate(chains):
+            self.fill(self.amounts[i], balances[chain])
+            if chain in prices:
+                self.fill(self.prices[i], prices[chain])
+        self.usd = np.nan_to_num(self.amounts * self.prices)
+
+        self.tickers = np.full(shape[:2], "", dtype=object)
+        self.held = np.zeros(shape[:2], dtype=bool)
+        for i, chain in enumerate(chains):
+            cols = self.contracts.get_indexer(balances[chain].columns)
+            self.held[i, cols] = True
+            tokens = self.store.read_tokens(chain)
+            rows = self.contracts.get_indexer(tokens["contract_address"].astype(str))
+            found = rows >= 0
+            self.tickers[i, rows[found]] = tokens["ticker"].fillna("").to_numpy(
+                dtype=object
+            )[found]
+        self.asset_classes = np.vectorize(self.asset_class, otypes=[object])(
+            self.tickers
+        )
+
+    def fill(self, target, frame):
+        """
+        Copy a (month x contract) frame into a (contract, period) slice.
+
+        Args:
+            target (ndarray): The (contract, period) slice of the cube.
+            frame (DataFrame): The frame indexed by month with one column
+            per contract address.
+        """
+        rows = self.periods.get_indexer(frame.index)
+        cols = self.contracts.get_indexer(frame.columns)
+        keep_rows, keep_cols = rows >= 0, cols >= 0
+        values = frame.to_numpy(dtype=float)[np.ix_(keep_rows, keep_cols)]
+        target[np.ix_(cols[keep_cols], rows[keep_rows])] = values.T
+
+    @classmethod
+    def asset_class(cls, ticker):
+        """
+        Get the asset class of a token from its ticker.
+
+        Args:
+            ticker (str): The ticker of the token.
+
+        Returns:
+            str: One of "stablecoin", "eth", "btc", "lp" or "other".
+        """
+        ticker = ticker.lower()
+        if cls.LP_PATTERN.search(ticker):
+            return "lp"
+        if ticker in cls.STABLECOINS:
+            return "stablecoin"
+        if ticker in cls.ETH_TICKERS:
+            return "eth"
+        if ticker in cls.BTC_TICKERS:
+            return "btc"
+        return "other"
+
+    def mask(self, chain=None, ticker=None, asset_class=None, contract=None):
+        """
+        Select (chain, contract) pairs by their labels.
+
+        Every argument accepts a single label or a list of labels, and None
+        selects everything.
+
+        Args:
+            chain (str or list, optional): The chains to select.
+            ticker (str or list, optional): The tickers to select, matched
+            case-insensitively.
+            asset_class (str or list, optional): The asset classes to select.
+            contract (str or list, optional): The contract addresses to
+            select.
+
+        Returns:
+            ndarray: The (chain, contract) boolean selection.
+        """
+        selected = self.held.copy()
+        if chain is not None:
+            selected &= np.isin(self.chains, self.as_list(chain))[:, None]
+        if contract is not None:
+            selected &= np.isin(self.contracts, self.as_list(contract))[None, :]
+        if ticker is not None:
+            tickers = [t.lower() for t in self.as_list(ticker)]
+            lowered = np.char.lower(self.tickers.astype(str))
+            selected &= np.isin(lowered, tickers)
+        if asset_class is not None:
+            selected &= np.isin(self.asset_classes, self.as_list(asset_class))
+        return selected
+
+    def as_list(self, labels):
+        """
+        Wrap a single label in a list.
+
+        Args:
+            labels (str or list): A label or a list of labels.
+
+        Returns:
+            list: The labels.
+        """
+        return [labels] if isinstance(labels, str) else list(labels)
+
+    def group_labels(self, by):
+        """
+        Get the group label of every (chain, contract) pair.
+
+        Args:
+            by (str): One of "chain", "contract", "ticker" or "asset_class".
+
+        Returns:
+            ndarray: The (chain, contract) array of labels.
+
+        Raises:
+            ValueError: If the dimension is not known.
+        """
+        if by == "chain":
+            return np.broadcast_to(
+                np.asarray(self.chains, dtype=object)[:, None], self.held.shape
+            )
+        if by == "contract":
+            return np.broadcast_to(
+                np.asarray(self.contracts, dtype=object)[None, :], self.held.shape
+            )
+        if by == "ticker":
+            return np.char.lower(self.tickers.astype(str)).astype(object)
+        if by == "asset_class":
+            return self.asset_classes
+        raise ValueError(f"Unknown dimension: {by}")
+
+    def sum(self, by=None, measure="usd", periods=None, **filters):
+        """
+        Sum a measure over the selected (chain, contract) pairs.
+
+        Args:
+            by (str, optional): The dimension to group by, one of "chain",
+            "contract", "ticker" or "asset_class". A single total per
+            period is returned if None.
+            measure (str): Either "usd" for USD values or "amount" for token
+            balances.
+            periods (slice or list, optional): The periods to return, all
+            periods if None.
+            **filters: Selections passed on to mask.
+
+        Returns:
+            Series or DataFrame: The sums indexed by period, with one column
+            per group when by is given.
+        """
+        values = self.usd if measure == "usd" else self.amounts
+        selected = self.mask(**filters)
+        if by is None:
+            result = pd.Series(
+                values[selected].sum(axis=0), index=self.periods, name=measure
+            )
+        else:
+            codes, labels = pd.factorize(self.group_labels(by)[selected], sort=True)
+            sums = np.zeros((len(labels), len(self.periods)))
+            np.add.at(sums, codes, values[selected])
+            result = pd.DataFrame(
+                sums.T, index=self.periods, columns=pd.Index(labels, name=by)
+            )
+        if periods is not None:
+            result = result.loc[periods]
+        return result
@@ -0,0 +1,224 @@
+"""wallet_analysis.py
+
+This script contains the WalletAnalysis class, which computes the balances and
+USD values of every treasury wallet of a chain in one pass.
+
+DataAnalysis treats all transfers of a chain as one treasury: `clean_data`
+signs the amounts by `category` and drops the `from` and `to` columns. Here
+every transfer is attributed to a wallet instead, the receiving `to` address
+for incoming transfers and the sending `from` address for outgoing ones, and
+the balances are computed in a single vectorized grouping over
+(wallet, contract, period). The transfer file and the price sheet of a chain
+are read once for all of its wallets, and the token metadata written by
+TokenData is shared as it is keyed by contract only.
+
+The wallets of each chain are listed in `wallet_info.csv` with the columns
+`blockchain` and `wallet`. Chains without an entry keep every wallet that
+appears in their transfers.
+
+Usage:
+    from wallet_analysis import WalletAnalysis
+
+    wallets = WalletAnalysis()
+    wallets.run()
+    balances = wallets.store.read_wallet_balances("ethereum")
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from calculations import DataAnalysis
+
+
+class WalletAnalysis:
+    """
+    Class to compute balances and USD values per treasury wallet.
+
+    Attributes:
+        analysis (DataAnalysis): The analysis used to load the transfers and
+        prices and to run the balance kernel.
+        store (BalanceStore): The store the wallet balances are written to.
+        wallet_file (str): File path of the wallet list CSV file.
+        chain_file (str): File path of the chain info CSV file.
+    """
+
+    def __init__(
+        self,
+        analysis=None,
+        wallet_file="wallet_info.csv",
+        chain_file="chain_info.csv"
+    ):
+        """
+        Initialize a new instance of the WalletAnalysis class.
+
+        Args:
+            analysis (DataAnalysis, optional): The analysis used to load the
+            data, a default DataAnalysis if None.
+            wallet_file (str): File path of the wallet list CSV file.
+            chain_file (str): File path of the chain info CSV file.
+        """
+        self.analysis = analysis or DataAnalysis()
+        self.store = self.analysis.store
+        self.wallet_file = wallet_file
+        self.chain_file = chain_file
+
+    def load_wallets(self):
+        """
+        Load the wallet list of every chain.
+
+        Returns:
+            dict: The lower case wallet addresses keyed by blockchain, empty
+            if there is no wallet file.
+        """
+        if not os.path.exists(self.wallet_file):
+            return {}
+        wallets = pd.read_csv(self.wallet_file, dtype=str)
+        wallets["wallet"] = wallets["wallet"].str.strip().str.lower()
+        return {
+            blockchain: list(group["wallet"])
+            for blockchain, group in wallets.groupby("blockchain")
+        }
+
+    def attribute(self, data, wallets=None):
+        """
+        Attribute every transfer to the treasury wallet it moved funds of.
+
+        Incoming transfers belong to their `to` address and add to its
+        balance, outgoing transfers belong to their `from` address and
+        subtract from it. A transfer between two treasury wallets is listed
+        once per direction, so each side gets its own row.
+
+        Args:
+            data (DataFrame): The transfers of a chain.
+            wallets (list, optional): The wallets to keep, every wallet if
+            None.
+
+        Returns:
+            DataFrame: The time, wallet, contract_address and signed
+            calc_value of every attributed transfer.
+        """
+        outgoing = (data["category"] == "from").to_numpy()
+        wallet = np.where(
+            outgoing,
+            data["from"].astype(str).str.lower(),
+            data["to"].astype(str).str.lower(),
+        )
+        df = pd.DataFrame({
+            "time": pd.to_datetime(data["time"]).to_numpy(),
+            "wallet": wallet,
+            "contract_address": data["contract_address"].to_numpy(),
+            "calc_value": data["calc_value"].astype(float).to_numpy()
+            * np.where(outgoing, -1, 1),
+        })
+        if wallets is not None:
+            df = df[df["wallet"].isin(wallets)]
+        return df
+
+    def process_chain(self, blockchain, wallets=None):
+        """
+        Compute and store the balances of every wallet of a blockchain.
+
+        When the periods of the analysis cross month ends, the monthly
+        balances are stored as well, as they are the ones valued.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            wallets (list, optional): The wallets to keep, every wallet if
+            None.
+
+        Returns:
+            DataFrame: The balances indexed by period with one
+            (wallet, contract_address) column per wallet and contract.
+        """
+        df = self.attribute(self.analysis.load_data(blockchain), wallets)
+        df_pivot = self.analysis.get_balance_matrix(
+            df, keys=("wallet", "contract_address")
+        )
+        self.store.write_wallet_balances(blockchain, df_pivot)
+        month_end = self.analysis.month_end
+        if month_end is not None:
+            month_end.store.write_wallet_balances(
+                blockchain,
+                month_end.get_balance_matrix(df, keys=("wallet", "contract_address"))
+            )
+        return df_pivot
+
+    def value_chain(self, blockchain, excel_file):
+        """
+        Calculate the USD value of every wallet of a blockchain per month.
+
+        The balances are reduced to month ends the way load_chain_data of the
+        analysis reduces the chain balances.
+
+        Args:
+            blockchain (str): The name of the blockchain.
+            excel_file (ExcelFile): The opened price workbook.
+
+        Returns:
+            DataFrame: The USD values indexed by month with one column per
+            wallet.
+        """
+        monthly = self.analysis.load_monthly_data(excel_file, blockchain)
+        valued = self.analysis.month_end or self.analysis
+        balances = valued.store.read_wallet_balances(blockchain)
+        if valued.freq != "M":
+            balances = balances.groupby(balances.index.asfreq("M")).last()
+        months = balances.index[balances.index.isin(monthly.index)].sort_values()
+        price_columns = monthly.columns.get_indexer(
+            balances.columns.get_level_values("contract_address")
+        )
+        prices = monthly.to_numpy(dtype=float)[
+            monthly.index.get_indexer(months)
+        ][:, price_columns]
+        prices[:, price_columns < 0] = np.nan
+        amounts = balances.to_numpy(dtype=float)[balances.index.get_indexer(months)]
+        usd = np.nan_to_num(prices * amounts)
+
+        wallet_codes, wallets = pd.factorize(
+            balances.columns.get_level_values("wallet"), sort=True
+        )
+        sums = np.zeros((len(months), len(wallets)))
+        np.add.at(sums.T, wallet_codes, usd.T)
+        return pd.DataFrame(
+            sums,
+            index=months.rename("date"),
+            columns=pd.Index(wallets, name="wallet"),
+        )
+
+    def run(self):
+        """
+        Compute, store and value the wallet balances of every chain.
+
+        The values are written to `data/<blockchain>_wallet_summed.csv` per
+        chain and summed over all chains to `wallet_summed.csv`. When the
+        analysis is limited to some chains, the values of the other chains
+        are read from their files.
+
+        Raises:
+            FileNotFoundError: If a chain that is not processed has no
+            `data/<blockchain>_wallet_summed.csv` file.
+        """
+        self.analysis.check_other_chains("_wallet_summed.csv", self.chain_file)
+        wallets = self.load_wallets()
+        excel_file = self.analysis.load_excel_file()
+        frames = []
+        chains = self.analysis.chains
+        for blockchain in pd.read_csv(self.chain_file)["blockchain"]:
+            path = f"data/{blockchain}_wallet_summed.csv"
+            if chains is not None and blockchain not in chains:
+                sums = pd.read_csv(path, index_col="date")
+                sums.index = pd.PeriodIndex(sums.index, freq="M")
+                sums.columns.name = "wallet"
+                frames.append(sums.stack().rename("usd_amount").reset_index())
+                continue
+            self.process_chain(blockchain, wallets.get(blockchain))
+            sums = self.value_chain(blockchain, excel_file)
+            sums.to_csv(path)
+            frames.append(sums.stack().rename("usd_amount").reset_index())
+        summed = (
+            pd.concat(frames)
+            .groupby(["date", "wallet"])["usd_amount"]
+            .sum()
+            .unstack(fill_value=0)
+        )
+        summed.to_csv("wallet_summed.csv")
@@ -1,33 +1,276 @@
 """main.py
 main function of the the application
 
-Creates an instance of the different classe and runs the querys for each of
-them individually
+Declares the stages of the application with the files each of them reads and
+writes, and runs them as a dependency graph. Stages whose inputs and outputs
+are unchanged since their last run are skipped, and independent stages run
+concurrently. The fetch stage streams every chain through the Dune query,
+the metadata lookups and the price fetch on its own, so a chain does not
+wait for the slowest chain between those steps. The timings of the run are written to a JSON report and a
+Prometheus textfile.
+
+The modules of a stage are imported when the stage runs, so a run of the
+analysis stages never loads selenium, web3 or the API clients.
+
+The fetch stages journal their finished work, so rerunning after a crash
+resumes where the run stopped; --fresh starts over instead.
+
+Usage:
+    python main.py run
+    python main.py run --stages calc --chains ethereum,fantom
+    python main.py run --stages fetch --force fetch
+    python main.py run --http-mode replay
+    python main.py run --stages fetch --fresh
+    python main.py stages
 """
 
+import argparse
 import logging
-from scraper import TokenData
-from get_gecko import GetGecko
-from calculations import DataAnalysis
-from get_dune import Dune
+import os
+import sys
+from metrics import METRICS
+from pipeline import Pipeline
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "functions")
+REPORT_FILE = "data/metrics/run_report.json"
+PROMETHEUS_FILE = "data/metrics/twa.prom"
+
+
+def code(*modules):
+    """
+    Get the paths of source modules, so code changes rerun their stages.
+
+    Args:
+        *modules (str): The file names of the modules.
+
+    Returns:
+        list: The paths of the modules.
+    """
+    return [os.path.join(CODE_DIR, module) for module in modules]
+
+
+def load_chains(chains=None):
+    """
+    Load the chains of chain_info.csv.
+
+    Args:
+        chains (list, optional): The blockchains to keep, every chain if
+        None.
+
+    Returns:
+        list: The (blockchain, queryCSV) of the selected chains.
+
+    Raises:
+        ValueError: If a selected chain is not in chain_info.csv.
+    """
+    import csv
+
+    with open("chain_info.csv", newline="", encoding="utf-8") as file:
+        rows = [
+            (row["blockchain"], row["queryCSV"])
+            for row in csv.DictReader(file, skipinitialspace=True)
+        ]
+    if chains is None:
+        return rows
+    unknown = set(chains) - {blockchain for blockchain, _ in rows}
+    if unknown:
+        raise ValueError(f"Unknown chains: {sorted(unknown)}")
+    return [row for row in rows if row[0] in chains]
+
+
+def run_fetch(chains):
+    """
+    Stream the chains through the Dune query, the metadata lookups and the
+    price fetch.
+
+    Args:
+        chains (list, optional): The blockchains to fetch, every chain if
+        None.
+
+    Raises:
+        RuntimeError: If a chain failed in one of its stages.
+    """
+    from chain_pipeline import ChainPipeline
+    results = ChainPipeline(chains=chains, value=False).run()
+    failed = {chain: stage for chain, stage in results.items() if stage != "done"}
+    if failed:
+        raise RuntimeError(f"Chains failed in stages {failed}")
+
+
+def run_calc(chains):
+    """
+    Compute and value the balances of the chains and write summed.csv.
+
+    Args:
+        chains (list, optional): The blockchains to process, every chain if
+        None.
+    """
+    from calculations import DataAnalysis
+    DataAnalysis(chains=chains).run()
+
+
+def run_flows(chains):
+    """
+    Value the transfers of the chains at their execution-time prices and
+    write flows.csv.
+
+    Args:
+        chains (list, optional): The blockchains to process, every chain if
+        None.
+    """
+    from calculations import DataAnalysis
+    from transfer_valuation import TransferValuation
+    TransferValuation(DataAnalysis(chains=chains)).run()
+
+
+def run_wallets(chains):
+    """
+    Compute and value the balances of every treasury wallet and write
+    wallet_summed.csv.
+
+    Args:
+        chains (list, optional): The blockchains to process, every chain if
+        None.
+    """
+    from calculations import DataAnalysis
+    from wallet_analysis import WalletAnalysis
+    WalletAnalysis(DataAnalysis(chains=chains)).run()
+
+
+def build_pipeline(chains=None):
+    """
+    Declare the stages of the application.
+
+    Args:
+        chains (list, optional): The blockchains the stages process, every
+        chain if None.
+
+    Returns:
+        Pipeline: The pipeline with every stage declared.
+    """
+    selected = load_chains(chains)
+    dune_files = [f"data/{name}" for _, name in selected]
+    chain_files = [f"data/{blockchain}.csv" for blockchain, _ in selected]
+    prices_file = "data/monthly_prices_full.xlsx"
+    wallet_files = [path for path in ["wallet_info.csv"] if os.path.exists(path)]
+    token_lists = [
+        path for path in ["data/summary_info/token_lists.csv"] if os.path.exists(path)
+    ]
+
+    pipeline = Pipeline()
+    pipeline.add(
+        "fetch",
+        lambda: run_fetch(chains),
+        inputs=["chain_info.csv", *token_lists,
+                *code("chain_pipeline.py", "get_dune.py", "get_gecko.py",
+                      "scraper.py", "token_filter.py", "resolver.py",
+                      "transfer_loader.py")],
+        outputs=[*dune_files, "data/monthly_prices.xlsx", prices_file,
+                 "data/store/*_daily_prices.parquet", "data/contract_info.csv",
+                 *chain_files],
+    )
+    pipeline.add(
+        "calc",
+        lambda: run_calc(chains),
+        inputs=["chain_info.csv", prices_file, *chain_files,
+                *code("calculations.py", "balance_store.py",
+                      "transfer_loader.py", "rollups.py")],
+        outputs=["summed.csv",
+                 *[f"data/{blockchain}_summed.csv" for blockchain, _ in selected],
+                 *[f"data/store/{blockchain}_{table}.parquet"
+                   for blockchain, _ in selected
+                   for table in ("balances", "tokens", "state")],
+                 "data/store/rollup_*.parquet"],
+    )
+    pipeline.add(
+        "flows",
+        lambda: run_flows(chains),
+        inputs=["chain_info.csv", prices_file, "data/store/*_daily_prices.parquet",
+                *chain_files, *code("transfer_valuation.py")],
+        outputs=["flows.csv"],
+    )
+    pipeline.add(
+        "wallets",
+        lambda: run_wallets(chains),
+        inputs=["chain_info.csv", prices_file, *wallet_files, *chain_files,
+                *code("wallet_analysis.py")],
+        outputs=["wallet_summed.csv"],
+    )
+    return pipeline
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line. Without a command, `run` is assumed.
+
+    Args:
+        argv (list, optional): The arguments, sys.argv if None.
+
+    Returns:
+        Namespace: The parsed arguments.
+    """
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0].startswith("-") and argv[0] not in ("-h", "--help"):
+        argv.insert(0, "run")
+    parser = argparse.ArgumentParser(
+        prog="twa", description="Treasury wallet analysis."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the pipeline")
+    run.add_argument(
+        "--stages", nargs="+", metavar="STAGE",
+        help="the stages to run, every stage by default; stages outside "
+             "the list are treated as done",
+    )
+    run.add_argument(
+        "--chains",
+        type=lambda value: [chain.strip() for chain in value.split(",") if chain.strip()],
+        help="comma separated blockchains to process, every chain by default; "
+             "the totals over all chains are kept complete",
+    )
+    run.add_argument(
+        "--force", nargs="+", metavar="STAGE", default=[],
+        help="stages to run even if they are up to date",
+    )
+    run.add_argument(
+        "--http-mode", choices=["live", "record", "replay"],
+        help="send, record or replay the outbound requests",
+    )
+    run.add_argument(
+        "--fresh", action="store_true",
+        help="forget the work journaled by an interrupted run instead of "
+             "resuming it",
+    )
+    commands.add_parser("stages", help="list the stages and their dependencies")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "stages":
+        pipeline = build_pipeline()
+        for name, stage in pipeline.stages.items():
+            print(f"{name}: {', '.join(sorted(pipeline.dependencies(stage))) or '-'}")
+        return
 
-def main():
     # Set up logging
     logging.basicConfig(filename='/log/app.log', filemode='w', format='%(name)s - %(levelname)s - %(message)s', level=logging.INFO)
     logging.info('Started')
 
-    # Instantiate classes and run the program
-    get_dune = Dune()
-    gecko = GetGecko()
-    token_data = TokenData()
-    calculated_data = DataAnalysis()
-
-    # Run methods
-    get_dune.run_query()
-    get_dune.run()
-    gecko.run()
-    token_data.run()
-    calculated_data.run()
+    if args.http_mode is not None:
+        from transport import TRANSPORT
+        TRANSPORT.configure(args.http_mode)
+    if args.fresh:
+        from journal import JOURNAL
+        JOURNAL.clear()
+
+    try:
+        results = build_pipeline(args.chains).run(args.stages, args.force)
+        for stage, result in results.items():
+            logging.info('Stage %s: %s', stage, result)
+    finally:
+        METRICS.write_report(REPORT_FILE)
+        METRICS.write_prometheus(PROMETHEUS_FILE)
 
     logging.info('Finished')
 